@@ -1,25 +1,145 @@
 import os
+import json
 import requests
 import uuid
-import requests
-from db_operations import DatabaseManager
+from db_operations import get_db_manager
+from http_session import get_session, get_timeout
+from rate_limit import notion_limiter, todoist_limiter, kimai_limiter
+from tracing import traced
 from dotenv import load_dotenv
-from typing import Any, Dict, List, Tuple
-import logging
+from typing import Any, Dict, Iterator, List, Tuple
 from notion_client import Client
-import logger
+from logger import logger, payload
 
 load_dotenv()
 
 DB_TYPE = os.getenv("DB_TYPE")
 DB_PATH = os.getenv("DB_PATH")
-db_manager = DatabaseManager(DB_TYPE, DB_PATH)
+# Notion databases.query 单页最多返回 100 条
+NOTION_PAGE_SIZE = min(int(os.getenv("NOTION_PAGE_SIZE", "100")), 100)
+
+# 可指向本地的模拟服务 (见 fake_servers.py)，默认是官方地址
+KIMAI_BASE_URL = os.getenv("KIMAI_BASE_URL", "https://kimai.kingschats.com/api")
+# Kimai /api/timesheets 单页条数；user=all 需要账号有查看他人工时的权限
+KIMAI_PAGE_SIZE = int(os.getenv("KIMAI_PAGE_SIZE", "100"))
+KIMAI_USER = os.getenv("KIMAI_USER", "")
+TODOIST_BASE_URL = os.getenv("TODOIST_BASE_URL", "https://api.todoist.com/sync/v9")
+NOTION_BASE_URL = os.getenv("NOTION_BASE_URL")
+
+# Sync v9 单次请求最多接受 100 条命令
+MAX_COMMANDS_PER_SYNC = 100
+# 命令参数中可能引用其他命令 temp_id 的字段
+TEMP_ID_REFERENCE_FIELDS = ("item_id", "project_id", "parent_id", "section_id")
+# 发送命令时顺带请求的资源，响应中直接带回刚创建/更新的对象，省去 /items/get
+COMMAND_RESOURCE_TYPES = {"items": ["items", "notes"], "notes": ["items", "notes"], "projects": ["projects"]}
+
+
+class TodoistCommandQueue:
+    """Collects Sync API commands and sends them in batches of up to 100 per /sync call.
+
+    ``add`` returns the command uuid. Callbacks run after the batch containing the
+    command has been sent: ``on_success(real_id)`` receives the id resolved through
+    ``temp_id_mapping`` (or the ``id`` arg for commands without a temp id), and
+    ``on_error(error)`` receives the ``sync_status`` error object, or the exception
+    if ``on_success`` raised. By then the affected items and notes are in the
+    client's cache (``get_item``/``get_note``).
+    """
+
+    def __init__(self, client: "TodoistSyncClient", resource_type: str, batch_size: int = MAX_COMMANDS_PER_SYNC):
+        self.client = client
+        self.resource_type = resource_type
+        self.batch_size = min(batch_size, MAX_COMMANDS_PER_SYNC)
+        self.pending: List[Tuple[Dict[str, Any], Any, Any]] = []
+        self.temp_id_mapping: Dict[str, str] = {}
+        self.sync_status: Dict[str, Any] = {}
+        self.failed: Dict[str, Any] = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, command_type: str, args: Dict[str, Any], temp_id: str = None, on_success=None, on_error=None) -> str:
+        command = {
+            "type": command_type,
+            "uuid": str(uuid.uuid4()),
+            "args": args
+        }
+        if temp_id:
+            command["temp_id"] = temp_id
+        self.pending.append((command, on_success, on_error))
+        return command["uuid"]
+
+    def resolve_id(self, id_or_temp_id: str) -> str:
+        return self.temp_id_mapping.get(id_or_temp_id, id_or_temp_id)
+
+    def _resolve_references(self, command: Dict[str, Any]):
+        # 前一批次已经得到真实 ID 的 temp_id 不能再跨请求使用，需替换为真实 ID
+        args = command["args"]
+        for field in TEMP_ID_REFERENCE_FIELDS:
+            if args.get(field) in self.temp_id_mapping:
+                args[field] = self.temp_id_mapping[args[field]]
+
+    @traced("todoist.command_queue.flush")
+    def flush(self) -> Dict[str, Any]:
+        while self.pending:
+            batch = self.pending[:self.batch_size]
+            self.pending = self.pending[self.batch_size:]
+            for command, _, _ in batch:
+                self._resolve_references(command)
+            result = self.client.sync_commands(self.resource_type, [command for command, _, _ in batch])
+            self.temp_id_mapping.update(result.get("temp_id_mapping", {}))
+            sync_status = result.get("sync_status", {})
+            self.sync_status.update(sync_status)
+            for command, on_success, on_error in batch:
+                status = sync_status.get(command["uuid"])
+                if status == "ok":
+                    real_id = self.temp_id_mapping.get(command.get("temp_id")) or command["args"].get("id")
+                    try:
+                        if on_success:
+                            on_success(real_id)
+                        continue
+                    except Exception as e:
+                        # 命令已执行但记录失败，按失败处理，让调用方保留重试的机会
+                        logger.error("Callback for Todoist command %s (%s) failed: %s", command['type'], command['uuid'], e)
+                        status = e
+                else:
+                    logger.error("Todoist command %s (%s) failed: %s", command['type'], command['uuid'], status)
+                self.failed[command["uuid"]] = status
+                if on_error:
+                    try:
+                        on_error(status)
+                    except Exception as e:
+                        # 单个回调失败不影响同批次其他命令
+                        logger.error("Error callback for Todoist command %s (%s) failed: %s", command['type'], command['uuid'], e)
+        return {
+            "temp_id_mapping": self.temp_id_mapping,
+            "sync_status": self.sync_status,
+            "failed": self.failed
+        }
+
 
 class TodoistSyncClient:
-    def __init__(self, token: str, DB_TYPE: str, DB_PATH: str):
+    def __init__(self, token: str, DB_TYPE: str = None, DB_PATH: str = None, db_manager=None):
         self.token = token
-        self.base_url = "https://api.todoist.com/sync/v9"
-        self.db_manager = DatabaseManager(DB_TYPE, DB_PATH)
+        self.base_url = TODOIST_BASE_URL
+        self.db_manager = db_manager or get_db_manager()
+        self.session = get_session()
+        # 从 /sync 响应中得到的对象，按 ID 缓存
+        self.item_cache: Dict[str, Dict[str, Any]] = {}
+        self.note_cache: Dict[str, Dict[str, Any]] = {}
+        # 本次运行中命令响应返回的 sync token，只在客户端内推进，不写回数据库
+        self.command_sync_tokens: Dict[str, str] = {}
+
+    def post(self, url: str, data: Dict[str, Any]) -> requests.Response:
+        headers = {"Authorization": f"Bearer {self.token}"}
+        # 限速、429/5xx 重试和熔断都在 todoist_limiter 中处理
+        return todoist_limiter.call(self.session.post, url, json=data, headers=headers, timeout=get_timeout())
 
     def sync_api(self, resource_types: str, sync_token: str, commands: List[Dict[str, Any]] = None) -> Dict[str, Any]:
         url = f"{self.base_url}/sync"
@@ -29,20 +149,60 @@ class TodoistSyncClient:
         }
         if commands:
             params["commands"] = commands
-        headers = {"Authorization": f"Bearer {self.token}"}
         
         # 打印调试信息
-        logging.info(f"Sending request to {url} with params: {params} and headers: {headers}")
+        logger.info("Sending request to %s with params: %s", url, payload(params))
         
-        response = requests.post(url, json=params, headers=headers)
+        response = self.post(url, params)
         try:
             response.raise_for_status()
         except requests.exceptions.HTTPError as e:
-            logging.error(f"HTTPError: {e.response.status_code} - {e.response.text}")
+            logger.error("HTTPError: %s - %s", e.response.status_code, payload(e.response.text))
             raise
         result = response.json()
         return result
 
+    def sync_commands(self, resource_type: str, commands: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Send commands and read back the objects they touched in the same request.
+
+        The first batch asks for the delta since the stored token; later batches use
+        the token returned by the previous response, so each batch only downloads
+        what changed since then. The stored token is not advanced here, so foreign
+        changes are still seen by the next poll, and our own writes are skipped
+        there by the hash check.
+        """
+        sync_token = self.command_sync_tokens.get(resource_type) or self.db_manager.get_sync_token(resource_type)
+        if not sync_token or sync_token == "*":
+            # 没有增量 token 时不请求资源，避免一次全量同步
+            result = self.sync_api("[]", "*", commands)
+        else:
+            result = self.sync_api(json.dumps(COMMAND_RESOURCE_TYPES.get(resource_type, [resource_type])), sync_token, commands)
+        if result.get("sync_token"):
+            self.command_sync_tokens[resource_type] = result["sync_token"]
+        self.cache_resources(result)
+        return result
+
+    def cache_resources(self, result: Dict[str, Any]):
+        for item in result.get("items", []):
+            self.item_cache[str(item["id"])] = item
+        for note in result.get("notes", []):
+            self.note_cache[str(note["id"])] = note
+
+    def get_item(self, item_id: str) -> Dict[str, Any]:
+        """Return an item from the sync-response cache, falling back to /items/get."""
+        item = self.item_cache.get(str(item_id))
+        if item is None:
+            item = self.get_single_task(item_id).get("item", {})
+            if item:
+                self.item_cache[str(item_id)] = item
+        return item
+
+    def get_note(self, note_id: str) -> Dict[str, Any]:
+        return self.note_cache.get(str(note_id))
+
+    def command_queue(self, resource_type: str = "items", batch_size: int = MAX_COMMANDS_PER_SYNC) -> TodoistCommandQueue:
+        return TodoistCommandQueue(self, resource_type, batch_size)
+
     def get_tasks(self, sync_token: str ) -> Dict[str, Any]:
         result = self.sync_api('["items"]', sync_token)
         return result
@@ -54,10 +214,9 @@ class TodoistSyncClient:
             "item_id": task_id,
             "all_data": False
         }
-        headers = {"Authorization": f"Bearer {self.token}"}
-        response = requests.post(url, json=data, headers=headers)
+        response = self.post(url, data)
         result = response.json()
-        logging.info(f"result: {result}")
+        logger.debug("result: %s", payload(result))
         return result
     def get_projects(self, sync_token: str) -> Dict[str, Any]:
         result = self.sync_api('["projects"]', sync_token)
@@ -68,8 +227,7 @@ class TodoistSyncClient:
             "project_id": project_id,
             "all_data": False
         }
-        headers = {"Authorization": f"Bearer {self.token}"}
-        response = requests.post(url, json=params, headers=headers)
+        response = self.post(url, params)
         result = response.json()
         return result
     def create_task(self, task_data: Dict[str, Any], temp_id: str) -> Dict[str, Any]:
@@ -86,8 +244,6 @@ class TodoistSyncClient:
         return result
     
     def create_task_with_note(self, task_data: Dict[str, Any], temp_id: str, content: str) -> Tuple[str, str, str]:
-        sync_token = self.db_manager.get_sync_token("items")
-        resource_types = '["items"]'
         commands = [
             {
                 "type": "item_add",
@@ -105,7 +261,7 @@ class TodoistSyncClient:
                 "uuid": str(uuid.uuid4())
             }
         ]
-        result = self.sync_api(resource_types, sync_token, commands)
+        result = self.sync_commands("items", commands)
         sync_token = result["sync_token"]
         temp_id_mapping = result.get("temp_id_mapping", {})
         item_id = temp_id_mapping.get(temp_id)
@@ -115,7 +271,6 @@ class TodoistSyncClient:
             if temp_id_key != temp_id:
                 note_id = real_id_value
                 break
-        self.db_manager.update_sync_token("items", result["sync_token"])
         #print(f"create_task_with_note() 返回: {(sync_token, item_id, note_id)}")
         return sync_token, item_id, note_id
 
@@ -134,8 +289,6 @@ class TodoistSyncClient:
         return result
 
     def update_task(self, task_id: str, task_data: Dict[str, Any]) -> Dict[str, Any]:
-        sync_token = self.db_manager.get_sync_token("items")
-        resource_types = '["items"]'
         commands = [{
             "type": "item_update",
             "uuid": str(uuid.uuid4()),
@@ -144,8 +297,7 @@ class TodoistSyncClient:
                 **task_data
             }
         }]
-        result = self.sync_api(resource_types, sync_token, commands)
-        self.db_manager.update_sync_token("items", result["sync_token"])
+        result = self.sync_commands("items", commands)
         #print(f"update_task() 返回: {(result)}")
         return result
 
@@ -205,8 +357,7 @@ class TodoistSyncClient:
                 "content": content
             }
         }]
-        headers = {"Authorization": f"Bearer {self.token}"}
-        response = requests.post(url, json={"commands": commands}, headers=headers)
+        response = self.post(url, {"commands": commands})
         result = response.json()
       #  #print(f"add_note() 返回: {(result)}")
         return result
@@ -262,9 +413,28 @@ class TodoistSyncClient:
 class NotionClient:
     def __init__(self, token: str):
         self.token = token
-        self.client = Client(auth=self.token)
+        self.client = Client(auth=self.token, base_url=NOTION_BASE_URL) if NOTION_BASE_URL else Client(auth=self.token)
+        # 所有 Notion 端点最终都走 Client.request，在这里统一限速和重试
+        self.client.request = notion_limiter.wrap(self.client.request)
         self.task_database_id = os.getenv("NOTION_TASK_DATABASE_ID")
         self.project_database_id = os.getenv("NOTION_PROJECT_DATABASE_ID")
+        self._bot_user_id = None
+
+    @property
+    def bot_user_id(self):
+        """The integration's own user id, looked up once with users.me; None if the lookup fails."""
+        if self._bot_user_id is None:
+            try:
+                self._bot_user_id = self.client.users.me().get("id") or ""
+            except Exception as e:
+                logger.warning("Failed to look up the Notion integration user: %s", e)
+                self._bot_user_id = ""
+        return self._bot_user_id or None
+
+    def is_own_edit(self, page: Dict[str, Any]) -> bool:
+        """True when the page was last edited by this integration."""
+        editor = (page.get("last_edited_by") or {}).get("id")
+        return editor is not None and editor == self.bot_user_id
 
     def create_page(self, database_id: str, properties: Dict[str, Any]) -> Dict[str, Any]:
         data = {
@@ -344,24 +514,35 @@ class NotionClient:
         result = self.client.pages.update(**data)
         #print(f"restore_task() 返回: {result}")
         return result
-    def get_projects(self, filter_properties: Dict[str, Any] = None) -> Dict[str, Any]:
+    def query_database(self, database_id: str, filter_properties: Dict[str, Any] = None, page_size: int = None) -> Iterator[Dict[str, Any]]:
+        """Yield every page of a database query, following start_cursor/has_more one response at a time."""
         data = {
-            "database_id": self.project_database_id,
+            "database_id": database_id,
+            "page_size": page_size or NOTION_PAGE_SIZE,
         }
         if filter_properties:
             data["filter"] = filter_properties
-        result = self.client.databases.query(**data)
-        logging.info(f"本次请求的内容: 数据库ID={self.project_database_id}, 参数={data}")
+        while True:
+            result = self.client.databases.query(**data)
+            logger.info("本次请求的内容: 数据库ID=%s, 参数=%s, 返回 %d 条", database_id, payload(data), len(result.get('results', [])))
+            yield from result.get("results", [])
+            if not result.get("has_more") or not result.get("next_cursor"):
+                break
+            data["start_cursor"] = result["next_cursor"]
+
+    def iter_projects(self, filter_properties: Dict[str, Any] = None, page_size: int = None) -> Iterator[Dict[str, Any]]:
+        return self.query_database(self.project_database_id, filter_properties, page_size)
+
+    def iter_tasks(self, filter_properties: Dict[str, Any] = None, page_size: int = None) -> Iterator[Dict[str, Any]]:
+        return self.query_database(self.task_database_id, filter_properties, page_size)
+
+    def get_projects(self, filter_properties: Dict[str, Any] = None) -> Dict[str, Any]:
+        result = {"object": "list", "results": list(self.iter_projects(filter_properties)), "has_more": False}
         #print(f"get_projects() 返回: {result}")
         return result
     
     def get_tasks(self, filter_properties: Dict[str, Any] = None) -> Dict[str, Any]:
-        data = {
-            "database_id": self.task_database_id,
-        }
-        if filter_properties:
-            data["filter"] = filter_properties
-        result = self.client.databases.query(**data)
+        result = {"object": "list", "results": list(self.iter_tasks(filter_properties)), "has_more": False}
         #print(f"get_tasks() 返回: {result}")
         return result
 
@@ -415,7 +596,37 @@ class NotionTask:
         self.deleted = deleted
 
 class KimaiClient:
-    def __init__(self, token: str):
+    def __init__(self, token: str, base_url: str = KIMAI_BASE_URL):
         self.token = token
-        self.base_url = "https://kimai.kingschats.com/api"
-        self.headers = {"Authorization": f"Bearer {self.token}"}
\ No newline at end of file
+        self.base_url = base_url.rstrip("/")
+        self.headers = {"Authorization": f"Bearer {self.token}"}
+        self.session = get_session()
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        # 限速、429/5xx 重试和熔断都在 kimai_limiter 中处理
+        response = kimai_limiter.call(self.session.request, method, url, headers=self.headers, timeout=get_timeout(), **kwargs)
+        response.raise_for_status()
+        return response
+
+    def get_timesheets(self, modified_after: str = None, page: int = 1, size: int = KIMAI_PAGE_SIZE) -> Tuple[List[Dict[str, Any]], int]:
+        """One page of timesheets and the total page count from the X-Total-Pages header."""
+        params = {"page": page, "size": size, "order": "ASC", "orderBy": "id", "full": "true"}
+        if modified_after:
+            params["modified_after"] = modified_after
+        if KIMAI_USER:
+            params["user"] = KIMAI_USER
+        response = self.request("GET", "timesheets", params=params)
+        total_pages = int(response.headers.get("X-Total-Pages") or page)
+        return response.json(), total_pages
+
+    def iter_timesheets(self, modified_after: str = None, size: int = KIMAI_PAGE_SIZE) -> Iterator[List[Dict[str, Any]]]:
+        """Yield timesheets page by page; Kimai answers 404 past the last page, so stop at X-Total-Pages."""
+        page = 1
+        while True:
+            timesheets, total_pages = self.get_timesheets(modified_after, page, size)
+            if timesheets:
+                yield timesheets
+            if page >= total_pages or len(timesheets) < size:
+                return
+            page += 1
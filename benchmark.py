@@ -0,0 +1,243 @@
+"""Offline sync benchmark against the fake Todoist and Notion servers.
+
+    python benchmark.py --sizes 100,1000,10000 --latency-ms 20
+    python benchmark.py --startup
+
+--startup instead times a cold import of each entry module in a fresh
+interpreter without credentials, and checks that the import created no
+database or log file.
+
+Each size runs in its own child process, because the sync modules read their
+configuration at import time and keep process-wide singletons (DB connection,
+HTTP session, identity map). For every phase it reports wall time, API calls
+per task, DB statements per task and peak Python memory (tracemalloc), and
+checks the number of changes each phase reported against the work it was
+given; any mismatch or error is flagged and makes the run exit with status 1.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+TASK_DATABASE_ID = "00000000-0000-4000-8000-00000000a001"
+PROJECT_DATABASE_ID = "00000000-0000-4000-8000-00000000a002"
+CHANGED_FRACTION = 0.1
+STARTUP_MODULES = ("api_client", "project_sync", "task_sync", "notion_properties", "webhook_server", "main")
+STARTUP_SCRIPT = """
+import sys, time, json, os
+sys.path.insert(0, {repo!r})
+started = time.perf_counter()
+import {module}
+imported = time.perf_counter() - started
+side_effects = [name for name in ("startup.db", "log.json") if os.path.exists(name)]
+started = time.perf_counter()
+from services import services
+services.db_manager
+first_use = time.perf_counter() - started
+print(json.dumps({{"module": {module!r}, "import_seconds": imported, "first_db_use_seconds": first_use, "side_effects": side_effects}}))
+"""
+
+
+def seed(todoist, size):
+    inbox = todoist.seed_project("Inbox", inbox=True)
+    projects = [inbox] + [todoist.seed_project(f"Project {index}") for index in range(max(size // 50, 1))]
+    for index in range(size):
+        todoist.seed_item(
+            f"Task {index}", projects[index % len(projects)]["id"],
+            priority=index % 4 + 1,
+            description=f"Description {index}" if index % 3 == 0 else "",
+            due={"date": f"2030-01-{index % 28 + 1:02d}", "is_recurring": False} if index % 2 == 0 else None,
+        )
+    return len(projects)
+
+
+def edit_todoist_items(todoist, fraction):
+    item_ids = [item_id for item_id, item in todoist.resources["items"].items() if not item.get("is_deleted")]
+    for item_id in random.sample(item_ids, int(len(item_ids) * fraction)):
+        todoist.edit_item(item_id, content=todoist.resources["items"][item_id]["content"] + " (edited in Todoist)")
+
+
+def edit_notion_pages(notion, fraction):
+    page_ids = [page_id for page_id, page in notion.pages.items() if page["parent"]["database_id"] == TASK_DATABASE_ID]
+    for page_id in random.sample(page_ids, int(len(page_ids) * fraction)):
+        title = notion.pages[page_id]["properties"].get("Task", {}).get("title", [{}])[0].get("text", {}).get("content", "")
+        notion.edit(page_id, {"Task": {"title": [{"text": {"content": title + " (edited in Notion)"}}]}})
+
+
+def measure(name, func, expected, size, servers, sync_stats, track_memory):
+    for server in servers:
+        server.reset_calls()
+    statements_before = sync_stats.get("db_statements")
+    if track_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    error = None
+    try:
+        changes = func()
+    except Exception as e:
+        changes, error = None, f"{type(e).__name__}: {e}"
+    elapsed = time.perf_counter() - started
+    peak = None
+    if track_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    calls = {server.name: dict(server.calls) for server in servers}
+    api_calls = sum(server.total_calls() for server in servers)
+    db_statements = sync_stats.get("db_statements") - statements_before
+    return {
+        "phase": name,
+        "size": size,
+        "changes": changes,
+        "expected": expected,
+        "ok": error is None and changes == expected,
+        "wall_seconds": round(elapsed, 3),
+        "api_calls": api_calls,
+        "api_calls_per_task": round(api_calls / size, 3),
+        "db_statements": db_statements,
+        "db_statements_per_task": round(db_statements / size, 3),
+        "peak_memory_mb": round(peak / 1024 / 1024, 2) if peak is not None else None,
+        "calls": calls,
+        "error": error,
+    }
+
+
+def run_child(args):
+    sys.path.insert(0, REPO_DIR)
+    from fake_servers import start_fake_servers, fake_environment
+
+    random.seed(args.seed)
+    todoist, notion = start_fake_servers(latency=args.latency_ms / 1000, rate_limit=args.server_rate)
+    notion.round_to_minute = args.round_to_minute
+    project_count = seed(todoist, args.child)
+
+    workdir = tempfile.mkdtemp(prefix="sync-bench-")
+    os.chdir(workdir)
+    os.environ.update(fake_environment(todoist, notion, TASK_DATABASE_ID, PROJECT_DATABASE_ID))
+    os.environ.update({"DB_TYPE": "sqlite", "DB_PATH": os.path.join(workdir, "bench.db"), "DB_NAME": os.path.join(workdir, "bench.db")})
+    if not args.real_rate_limits:
+        # 只测同步代码本身，客户端不按官方限速节流
+        os.environ.update({"NOTION_RATE_PER_SEC": "1000000", "NOTION_BURST": "1000000", "TODOIST_RATE_PER_SEC": "1000000", "TODOIST_BURST": "1000000"})
+
+    import project_sync
+    import task_sync
+    from sync_stats import sync_stats
+    if not args.verbose:
+        logging.disable(logging.WARNING)
+
+    def run(func, async_func=None):
+        if args.mode == "async" and async_func is not None:
+            return lambda: asyncio.run(async_func())
+        return func
+
+    servers = (todoist, notion)
+    size = args.child
+    changed = int(size * CHANGED_FRACTION)
+    # 每个阶段应当报告的变更数；不一致说明同步丢失或重复了变更
+    phases = [
+        ("todoist_projects_to_notion", run(project_sync.sync_todoist_projects_to_notion, project_sync.sync_todoist_projects_to_notion_async), project_count),
+        ("notion_projects_to_todoist", project_sync.sync_notion_projects_to_todoist, 0),
+        ("todoist_to_notion_initial", run(task_sync.sync_todoist_to_notion, task_sync.sync_todoist_to_notion_async), size),
+        ("notion_to_todoist_initial", task_sync.sync_notion_to_todoist, 0),
+        ("todoist_to_notion_changed", lambda: (edit_todoist_items(todoist, CHANGED_FRACTION), run(task_sync.sync_todoist_to_notion, task_sync.sync_todoist_to_notion_async)())[1], changed),
+        ("notion_to_todoist_changed", lambda: (edit_notion_pages(notion, CHANGED_FRACTION), task_sync.sync_notion_to_todoist())[1], changed),
+        ("todoist_to_notion_idle", run(task_sync.sync_todoist_to_notion, task_sync.sync_todoist_to_notion_async), 0),
+        ("notion_to_todoist_idle", task_sync.sync_notion_to_todoist, 0),
+    ]
+    results = [measure(name, func, expected, size, servers, sync_stats, not args.no_memory) for name, func, expected in phases]
+    todoist.stop()
+    notion.stop()
+    print(json.dumps({"size": size, "results": results, "stats": sync_stats.snapshot()}))
+
+
+def run_startup(repeat):
+    env = {key: value for key, value in os.environ.items() if not key.endswith("_TOKEN")}
+    print(f"{'module':<20} {'import ms':>10} {'first DB use ms':>16}  side effects at import")
+    for module in STARTUP_MODULES:
+        rows = []
+        for _ in range(repeat):
+            workdir = tempfile.mkdtemp(prefix="sync-startup-")
+            run_env = dict(env, DB_TYPE="sqlite", DB_PATH=os.path.join(workdir, "startup.db"), LOG_CONSOLE="false")
+            completed = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT.format(repo=REPO_DIR, module=module)], cwd=workdir, env=run_env, capture_output=True, text=True)
+            if completed.returncode != 0:
+                print(f"{module:<20} failed: {completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else completed.returncode}")
+                break
+            rows.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+        if rows:
+            best = min(rows, key=lambda row: row["import_seconds"])
+            print(f"{module:<20} {best['import_seconds'] * 1000:>10.1f} {best['first_db_use_seconds'] * 1000:>16.1f}  {', '.join(best['side_effects']) or 'none'}")
+
+
+def print_report(reports):
+    header = f"{'size':>6} {'phase':<28} {'changes':>8} {'expected':>8} {'wall s':>9} {'api/task':>9} {'db/task':>9} {'peak MB':>8}"
+    print(header)
+    print("-" * len(header))
+    for report in reports:
+        for row in report["results"]:
+            peak = f"{row['peak_memory_mb']:.2f}" if row["peak_memory_mb"] is not None else "-"
+            flag = "" if row["ok"] else "  MISMATCH"
+            print(f"{row['size']:>6} {row['phase']:<28} {str(row['changes']):>8} {row['expected']:>8} {row['wall_seconds']:>9.3f} {row['api_calls_per_task']:>9.3f} {row['db_statements_per_task']:>9.3f} {peak:>8}{flag}")
+            if row["error"]:
+                print(f"{'':>6} {'':<28} error: {row['error']}")
+        print(f"{'':>6} counters: {report['stats']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100,1000,10000", help="comma-separated task counts")
+    parser.add_argument("--latency-ms", type=float, default=0, help="latency added by the fake servers to every request")
+    parser.add_argument("--server-rate", type=int, default=None, help="requests per second the fake servers accept before answering 429")
+    parser.add_argument("--real-rate-limits", action="store_true", help="keep the client-side token buckets at the documented API rates")
+    parser.add_argument("--round-to-minute", action="store_true", help="round Notion last_edited_time to the minute like the real API")
+    parser.add_argument("--mode", choices=("sequential", "async"), default="sequential", help="Todoist -> Notion implementation to drive")
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc, which slows the run down")
+    parser.add_argument("--json", help="also write the raw results to this file")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--verbose", action="store_true")
+    parser.add_argument("--startup", action="store_true", help="measure cold import time and side effects of the entry modules")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per module for --startup (best is reported)")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return run_child(args)
+    if args.startup:
+        return run_startup(args.repeat)
+
+    child_args = ["--latency-ms", str(args.latency_ms), "--mode", args.mode, "--seed", str(args.seed)]
+    if args.server_rate:
+        child_args += ["--server-rate", str(args.server_rate)]
+    for flag in ("real_rate_limits", "round_to_minute", "no_memory", "verbose"):
+        if getattr(args, flag):
+            child_args.append("--" + flag.replace("_", "-"))
+
+    reports = []
+    failed = False
+    for size in [int(size) for size in args.sizes.split(",") if size]:
+        command = [sys.executable, os.path.abspath(__file__), "--child", str(size)] + child_args
+        completed = subprocess.run(command, capture_output=True, text=True)
+        if completed.returncode != 0:
+            print(f"size {size} failed:\n{completed.stderr}", file=sys.stderr)
+            failed = True
+            continue
+        reports.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    print_report(reports)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=2)
+    mismatches = [(report["size"], row["phase"]) for report in reports for row in report["results"] if not row["ok"]]
+    if mismatches:
+        print(f"phases with errors or unexpected change counts: {mismatches}", file=sys.stderr)
+    if failed or mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,17 @@
 import os
 import sqlite3
+import threading
+import time
+import functools
 import mysql.connector
+import mysql.connector.pooling
 from contextlib import contextmanager
 from sql_statements import *
+from migrations import apply_migrations
+from sync_stats import sync_stats
+from metrics import metrics
+from tracing import span, traced
+from logger import logger
 
 DB_TYPE = os.getenv("DB_TYPE", "sqlite")
 DB_NAME = os.getenv("DB_NAME", "sync_tasks.db")
@@ -11,13 +20,54 @@ MYSQL_USER = os.getenv("MYSQL_USER")
 DB_PATH = os.getenv("DB_PATH")
 MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD")
 MYSQL_DATABASE = os.getenv("MYSQL_DATABASE", "sync_tasks")
+# 每累积多少行写入提交一次事务
+DB_CHUNK_SIZE = int(os.getenv("DB_CHUNK_SIZE", "200"))
+# SQLite 连接调优参数
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+# 负数表示以 KiB 为单位，默认 64MB
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))
+# MySQL 连接池参数
+MYSQL_POOL_NAME = os.getenv("MYSQL_POOL_NAME", "sync_pool")
+MYSQL_POOL_SIZE = int(os.getenv("MYSQL_POOL_SIZE", "5"))
+MYSQL_POOL_TIMEOUT = float(os.getenv("MYSQL_POOL_TIMEOUT", "10"))
+MYSQL_CONNECT_TIMEOUT = int(os.getenv("MYSQL_CONNECT_TIMEOUT", "10"))
+MYSQL_RECONNECT_ATTEMPTS = int(os.getenv("MYSQL_RECONNECT_ATTEMPTS", "3"))
+MYSQL_STATEMENT_TIMEOUT_MS = int(os.getenv("MYSQL_STATEMENT_TIMEOUT_MS", "30000"))
+
+_db_manager = None
+_db_manager_lock = threading.Lock()
+
+
+def get_db_manager():
+    """Return the process-wide DatabaseManager, opening the connection and bootstrapping the schema on first use."""
+    global _db_manager
+    if _db_manager is None:
+        with _db_manager_lock:
+            if _db_manager is None:
+                _db_manager = DatabaseManager(DB_TYPE, DB_PATH or DB_NAME)
+    return _db_manager
+
 
 class DatabaseManager:
-    def __init__(self, db_type, db_path):
+    def __init__(self, db_type, db_path, bootstrap=True):
         self.db_type = db_type
         self.db_path = db_path
-        self.connection = self.create_connection()
-        self.create_tables_if_not_exists()
+        # SQLite: 连接在线程间共享，所有语句和事务都在这把锁内执行
+        # MySQL: 每条语句从连接池借出连接，事务期间由当前线程独占同一连接
+        self.lock = threading.RLock()
+        self.local = threading.local()
+        self.pool = None
+        self.connection = None
+        self.ensure_connection()
+        if bootstrap:
+            self.create_tables_if_not_exists()
+
+    @property
+    def transaction_depth(self):
+        return getattr(self.local, "depth", 0)
 
     def create_connection(self):
         if self.db_type == "mysql":
@@ -28,18 +78,91 @@ class DatabaseManager:
                 database=MYSQL_DATABASE
             )
         else:
-            return sqlite3.connect(self.db_path)
+            connection = sqlite3.connect(self.db_path, check_same_thread=False)
+            connection.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+            connection.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+            connection.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+            connection.execute(f"PRAGMA cache_size={SQLITE_CACHE_SIZE}")
+            connection.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}")
+            connection.execute("PRAGMA temp_store=MEMORY")
+            return connection
+
+    def create_pool(self):
+        options = {}
+        if MYSQL_STATEMENT_TIMEOUT_MS:
+            # 每个物理连接建立 (及重连) 时设置一次，借出连接时不再额外执行语句
+            options["init_command"] = f"SET SESSION max_execution_time = {MYSQL_STATEMENT_TIMEOUT_MS}"
+        return mysql.connector.pooling.MySQLConnectionPool(
+            pool_name=MYSQL_POOL_NAME,
+            pool_size=MYSQL_POOL_SIZE,
+            # 归还时不做 COM_RESET_CONNECTION：省一次往返，也保留上面的会话变量
+            pool_reset_session=False,
+            host=MYSQL_HOST,
+            user=MYSQL_USER,
+            password=MYSQL_PASSWORD,
+            database=MYSQL_DATABASE,
+            connection_timeout=MYSQL_CONNECT_TIMEOUT,
+            **options
+        )
 
     def ensure_connection(self):
-        if self.connection is None or not self.connection:
+        if self.db_type == "mysql":
+            if self.pool is None:
+                self.pool = self.create_pool()
+        elif self.connection is None or not self.connection:
             self.connection = self.create_connection()
 
+    def checkout_connection(self):
+        """Borrow a pooled MySQL connection, waiting while the pool is exhausted.
+
+        The pool pings the connection on checkout and reconnects it when the
+        server has dropped it; a failed reconnect is retried a few times.
+        """
+        self.ensure_connection()
+        deadline = time.monotonic() + MYSQL_POOL_TIMEOUT
+        reconnect_attempts = 0
+        while True:
+            try:
+                return self.pool.get_connection()
+            except mysql.connector.errors.PoolError:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.05)
+            except mysql.connector.errors.InterfaceError:
+                reconnect_attempts += 1
+                if reconnect_attempts >= MYSQL_RECONNECT_ATTEMPTS:
+                    raise
+                time.sleep(1)
+
+    @contextmanager
+    def connection_scope(self):
+        if self.db_type != "mysql":
+            with self.lock:
+                self.ensure_connection()
+                yield self.connection
+            return
+        connection = getattr(self.local, "connection", None)
+        if connection is not None:
+            yield connection
+            return
+        connection = self.checkout_connection()
+        try:
+            yield connection
+        finally:
+            # 归还连接池
+            connection.close()
+
+    def adapt_query(self, query):
+        # 手写查询统一使用 ? 占位符，MySQL 需要 %s
+        return query.replace("?", "%s") if self.db_type == "mysql" else query
+
     def create_tables_if_not_exists(self):
         self.ensure_connection()
         self.execute_query(get_create_tasks_table_sql(self.db_type))
         self.execute_query(get_create_projects_table_sql(self.db_type))
         self.execute_query(get_create_sync_tokens_table_sql(self.db_type))
         self.initialize_sync_tokens()
+        apply_migrations(self)
 
     def initialize_sync_tokens(self):
         self.ensure_connection()
@@ -48,26 +171,81 @@ class DatabaseManager:
             if not self.fetch_one("SELECT sync_token FROM sync_tokens WHERE resource_type = ?", (resource_type,)):
                 self.execute_query("INSERT INTO sync_tokens (resource_type, sync_token) VALUES (?, ?)", (resource_type, sync_token))
 
+    @contextmanager
+    def transaction(self):
+        """Defer commits until the outermost block exits; roll back if it raises."""
+        if self.transaction_depth:
+            self.local.depth += 1
+            try:
+                yield self
+            finally:
+                self.local.depth -= 1
+            return
+        with self.connection_scope() as connection:
+            self.local.connection = connection if self.db_type == "mysql" else None
+            self.local.depth = 1
+            try:
+                yield self
+            except Exception:
+                connection.rollback()
+                raise
+            else:
+                connection.commit()
+            finally:
+                self.local.connection = None
+                self.local.depth = 0
+
     def execute_query(self, query, params=None):
-        self.ensure_connection()
-        cursor = self.connection.cursor()
-        if params:
-            cursor.execute(query, params)
-        else:
-            cursor.execute(query)
-        self.connection.commit()
-        cursor.close()
+        sync_stats.increment("db_statements")
+        with metrics.timer("db_statement_duration_seconds", operation="execute"), span("db.execute", query=query[:80]), self.connection_scope() as connection:
+            cursor = connection.cursor()
+            if params:
+                cursor.execute(self.adapt_query(query), params)
+            else:
+                cursor.execute(query)
+            if not self.transaction_depth:
+                connection.commit()
+            cursor.close()
+
+    def execute_many(self, query, rows):
+        if not rows:
+            return
+        # executemany 算一条语句，行数单独统计
+        sync_stats.increment("db_statements")
+        sync_stats.increment("db_rows", len(rows))
+        with metrics.timer("db_statement_duration_seconds", operation="execute_many"), span("db.execute_many", query=query[:80]), self.connection_scope() as connection:
+            cursor = connection.cursor()
+            cursor.executemany(self.adapt_query(query), rows)
+            if not self.transaction_depth:
+                connection.commit()
+            cursor.close()
 
     def fetch_one(self, query, params=None):
-        self.ensure_connection()
-        cursor = self.connection.cursor()
-        if params:
-            cursor.execute(query, params)
-        else:
-            cursor.execute(query)
-        result = cursor.fetchone()
-        cursor.close()
-        return result
+        sync_stats.increment("db_statements")
+        with metrics.timer("db_statement_duration_seconds", operation="fetch_one"), span("db.fetch_one", query=query[:80]), self.connection_scope() as connection:
+            cursor = connection.cursor()
+            if params:
+                cursor.execute(self.adapt_query(query), params)
+            else:
+                cursor.execute(query)
+            result = cursor.fetchone()
+            # 读完剩余结果，MySQL 连接才能被复用
+            if self.db_type == "mysql":
+                cursor.fetchall()
+            cursor.close()
+            return result
+
+    def fetch_all(self, query, params=None):
+        sync_stats.increment("db_statements")
+        with metrics.timer("db_statement_duration_seconds", operation="fetch_all"), span("db.fetch_all", query=query[:80]), self.connection_scope() as connection:
+            cursor = connection.cursor()
+            if params:
+                cursor.execute(self.adapt_query(query), params)
+            else:
+                cursor.execute(query)
+            result = cursor.fetchall()
+            cursor.close()
+            return result
 
     def get_sync_token(self, resource_type):
         self.ensure_connection()
@@ -80,6 +258,14 @@ class DatabaseManager:
         query = get_update_sync_token_query(self.db_type)
         self.execute_query(query, (resource_type, sync_token))
 
+    def get_notion_cursor(self, database_id):
+        # Notion 增量同步的 last_edited_time 高水位，与 Todoist sync token 存在同一张表
+        cursor = self.get_sync_token(f"notion:{database_id}")
+        return None if cursor == "*" else cursor
+
+    def update_notion_cursor(self, database_id, cursor):
+        self.update_sync_token(f"notion:{database_id}", cursor)
+
     def insert_task(self, task):
         self.ensure_connection()
         query = get_insert_task_query(self.db_type)
@@ -90,6 +276,67 @@ class DatabaseManager:
         query = get_update_task_query(self.db_type)
         self.execute_query(query, task)
 
+    def insert_tasks(self, tasks):
+        self.execute_many(get_insert_task_query(self.db_type), tasks)
+
+    def update_tasks(self, tasks):
+        self.execute_many(get_update_task_query(self.db_type), tasks)
+
+    def update_sync_hashes(self, table, rows):
+        """Store payload hashes; ``rows`` are (sync_hash, todoist_id), or (sync_hash, sync_snapshot, notion_written_at, todoist_written_at, todoist_id) for tasks."""
+        self.execute_many(get_update_sync_hash_query(self.db_type, table), rows)
+
+    def upsert_projects(self, projects):
+        """Insert or update projects keyed by todoist_id. Rows use the column order of get_insert_project_query."""
+        if not projects:
+            return
+        # 同一批次内重复的 todoist_id 只保留最后一行
+        projects = list({str(project[2]): project for project in projects}.values())
+        with self.transaction():
+            todoist_ids = [project[2] for project in projects]
+            placeholders = ", ".join(["%s" if self.db_type == "mysql" else "?"] * len(todoist_ids))
+            existing = {str(row[0]) for row in self.fetch_all(f"SELECT todoist_id FROM projects WHERE todoist_id IN ({placeholders})", todoist_ids)}
+            inserts = [project for project in projects if str(project[2]) not in existing]
+            updates = [
+                (project[1], project[3], project[4], project[5], project[7], project[8], project[9], project[10], project[11], project[2])
+                for project in projects if str(project[2]) in existing
+            ]
+            self.execute_many(get_insert_project_query(self.db_type), inserts)
+            self.execute_many(get_update_project_by_todoist_id_query(self.db_type), updates)
+
+    def upsert_timesheets(self, timesheets):
+        """Insert or replace Kimai timesheets keyed by kimai_id. Rows use the column order of get_upsert_timesheet_query."""
+        # 同一批次内重复的 kimai_id 只保留最后一行
+        self.execute_many(get_upsert_timesheet_query(self.db_type), list({row[0]: row for row in timesheets}.values()))
+
+    def update_timesheet_tasks(self, rows):
+        """Link timesheets to tasks; ``rows`` are (todoist_id, kimai_id)."""
+        self.execute_many(get_update_timesheet_task_query(self.db_type), rows)
+
+    def get_unlinked_timesheets(self, since):
+        """Timesheets not linked to a task that began at or after ``since`` (Kimai local time string)."""
+        placeholder = "%s" if self.db_type == "mysql" else "?"
+        return self.fetch_all(f"SELECT kimai_id, task_ref, description FROM timesheets WHERE todoist_id IS NULL AND begin_time >= {placeholder}", (since,))
+
+    def find_task_ids(self, column, values, chunk_size=500):
+        """Map values of a tasks column (todoist_id, notion_id or content) to todoist_id with chunked IN queries."""
+        if column not in ("todoist_id", "notion_id", "content"):
+            raise ValueError(f"Unsupported tasks lookup column: {column}")
+        values = list(dict.fromkeys(value for value in values if value))
+        placeholder = "%s" if self.db_type == "mysql" else "?"
+        # 按标题匹配时跳过已删除的任务
+        condition = " AND deleted IS FALSE" if column == "content" else ""
+        found = {}
+        for start in range(0, len(values), chunk_size):
+            chunk = values[start:start + chunk_size]
+            query = f"SELECT {column}, todoist_id FROM tasks WHERE {column} IN ({', '.join([placeholder] * len(chunk))}){condition}"
+            for value, todoist_id in self.fetch_all(query, chunk):
+                found.setdefault(str(value), str(todoist_id))
+        return found
+
+    def unit_of_work(self, chunk_size=DB_CHUNK_SIZE):
+        return UnitOfWork(self, chunk_size)
+
     def insert_project(self, project):
         self.ensure_connection()
         query = get_insert_project_query(self.db_type)
@@ -104,3 +351,135 @@ class DatabaseManager:
         if self.connection:
             self.connection.close()
             self.connection = None
+        if self.pool is not None:
+            self.pool._remove_connections()
+            self.pool = None
+
+
+class UnitOfWork:
+    """Buffers task, project and timesheet rows and writes them with executemany.
+
+    Rows are flushed in one transaction every ``chunk_size`` rows. Sync tokens and
+    cursors recorded with ``update_sync_token`` are only written by ``commit``, in
+    the same transaction as the last rows, so a token never gets ahead of the rows
+    it covers. If any row had to be dropped, the tokens are not written at all and
+    the next cycle sees those changes again.
+    """
+
+    def __init__(self, db_manager, chunk_size=DB_CHUNK_SIZE):
+        self.db_manager = db_manager
+        self.db_type = db_manager.db_type
+        self.chunk_size = chunk_size
+        self.task_inserts = []
+        self.task_updates = []
+        self.projects = []
+        self.timesheets = []
+        self.sync_hashes = {"tasks": [], "projects": []}
+        self.sync_tokens = {}
+        self.dropped_rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            # 远端已经写入的行仍然落库，但不推进 sync token
+            self.flush()
+
+    def __len__(self):
+        return len(self.task_inserts) + len(self.task_updates) + len(self.projects) + len(self.timesheets) + sum(len(rows) for rows in self.sync_hashes.values())
+
+    def insert_task(self, task):
+        self.task_inserts.append(task)
+        self._flush_if_full()
+
+    def update_task(self, task):
+        self.task_updates.append(task)
+        self._flush_if_full()
+
+    def upsert_project(self, project):
+        self.projects.append(project)
+        self._flush_if_full()
+
+    def upsert_timesheet(self, timesheet):
+        self.timesheets.append(timesheet)
+        self._flush_if_full()
+
+    def set_sync_hash(self, table, todoist_id, sync_hash, snapshot=None, notion_written_at=None, todoist_written_at=None):
+        if table == "tasks":
+            self.sync_hashes[table].append((sync_hash, snapshot, notion_written_at, todoist_written_at, todoist_id))
+        else:
+            self.sync_hashes[table].append((sync_hash, todoist_id))
+        self._flush_if_full()
+
+    def update_sync_token(self, resource_type, sync_token):
+        self.sync_tokens[resource_type] = sync_token
+
+    def update_notion_cursor(self, database_id, cursor):
+        self.sync_tokens[f"notion:{database_id}"] = cursor
+
+    def _flush_if_full(self):
+        if len(self) >= self.chunk_size:
+            self.flush()
+
+    def _pending_writes(self):
+        # 哈希必须在对应行插入之后写入
+        writes = [
+            ("tasks insert", self.db_manager.insert_tasks, self.task_inserts),
+            ("tasks update", self.db_manager.update_tasks, self.task_updates),
+            ("projects upsert", self.db_manager.upsert_projects, self.projects),
+            ("timesheets upsert", self.db_manager.upsert_timesheets, self.timesheets),
+        ]
+        for table, rows in self.sync_hashes.items():
+            writes.append((f"{table} sync hash", functools.partial(self.db_manager.update_sync_hashes, table), rows))
+        return writes
+
+    def _write_rows_one_by_one(self, writes):
+        """Retry a failed chunk row by row; rows that still fail are logged and dropped. Returns the number dropped."""
+        dropped = 0
+        for name, write, rows in writes:
+            for row in rows:
+                try:
+                    write([row])
+                except Exception as e:
+                    dropped += 1
+                    sync_stats.increment("db_dropped_rows")
+                    logger.error("%s 写入失败，已丢弃该行: %s (row: %.200r)", name, e, row)
+        return dropped
+
+    @traced("db.unit_of_work.flush")
+    def flush(self, include_tokens=False):
+        """Write the buffered rows in one transaction.
+
+        When the chunk fails (e.g. a duplicate key), it is rolled back and written
+        again row by row so one bad row cannot block the rest of the cycle.
+        """
+        writes = self._pending_writes()
+        try:
+            with self.db_manager.transaction():
+                for _, write, rows in writes:
+                    write(rows)
+                if include_tokens and not self.dropped_rows:
+                    self._write_sync_tokens()
+        except Exception as e:
+            logger.error("批量写入 %s 行失败，改为逐行写入: %s", len(self), e)
+            self.dropped_rows += self._write_rows_one_by_one(writes)
+            if include_tokens and not self.dropped_rows:
+                with self.db_manager.transaction():
+                    self._write_sync_tokens()
+        if include_tokens and self.dropped_rows and self.sync_tokens:
+            # 丢弃的行没有记录映射，token 不推进，下一轮重新处理这些变更
+            logger.error("%s 行未能写入，不推进 sync token: %s", self.dropped_rows, ", ".join(self.sync_tokens))
+        self.task_inserts, self.task_updates, self.projects, self.timesheets = [], [], [], []
+        self.sync_hashes = {"tasks": [], "projects": []}
+        if include_tokens:
+            self.sync_tokens = {}
+
+    def _write_sync_tokens(self):
+        for resource_type, sync_token in self.sync_tokens.items():
+            self.db_manager.update_sync_token(resource_type, sync_token)
+
+    def commit(self):
+        self.flush(include_tokens=True)
@@ -0,0 +1,107 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+# Notion -> Todoist 方向拿不到锁时等待的秒数，超时则跳过该任务留到下一轮
+ENTITY_LOCK_TIMEOUT = float(os.getenv("ENTITY_LOCK_TIMEOUT", "30"))
+
+
+def task_lock_keys(todoist_id=None, notion_id=None):
+    """Lock keys for one task; either id may be missing for not-yet-linked tasks."""
+    keys = []
+    if notion_id:
+        keys.append(f"notion:{str(notion_id).replace('-', '').lower()}")
+    if todoist_id:
+        keys.append(f"todoist:{todoist_id}")
+    return keys
+
+
+class KeyedLocks:
+    """Per-key mutexes created on demand and dropped once nobody holds or waits on them.
+
+    Keys are always acquired in sorted order, so two callers locking overlapping
+    key sets cannot deadlock.
+    """
+
+    def __init__(self):
+        self.mutex = threading.Lock()
+        self.locks = {}
+
+    def _ref(self, key):
+        with self.mutex:
+            entry = self.locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+            return entry[0]
+
+    def _unref(self, key):
+        with self.mutex:
+            entry = self.locks[key]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.locks[key]
+
+    def acquire(self, keys, timeout=None):
+        """Acquire every key or none of them; return False if ``timeout`` expired."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        acquired = []
+        for key in sorted(set(key for key in keys if key)):
+            lock = self._ref(key)
+            if deadline is None:
+                ok = lock.acquire()
+            else:
+                ok = lock.acquire(timeout=max(deadline - time.monotonic(), 0))
+            if not ok:
+                self._unref(key)
+                self.release(acquired)
+                return False
+            acquired.append(key)
+        return True
+
+    def release(self, keys):
+        for key in sorted(set(key for key in keys if key), reverse=True):
+            with self.mutex:
+                lock = self.locks[key][0]
+            lock.release()
+            self._unref(key)
+
+    @contextmanager
+    def hold(self, *keys):
+        self.acquire(keys)
+        try:
+            yield
+        finally:
+            self.release(keys)
+
+    def batch(self, timeout=ENTITY_LOCK_TIMEOUT):
+        return LockBatch(self, timeout)
+
+
+class LockBatch:
+    """Locks accumulated across a batch of queued commands and released together after the flush."""
+
+    def __init__(self, keyed_locks, timeout):
+        self.keyed_locks = keyed_locks
+        self.timeout = timeout
+        self.held = set()
+
+    def add(self, keys):
+        new_keys = [key for key in keys if key and key not in self.held]
+        if not self.keyed_locks.acquire(new_keys, self.timeout):
+            return False
+        self.held.update(new_keys)
+        return True
+
+    def release_all(self):
+        self.keyed_locks.release(self.held)
+        self.held = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release_all()
+        return False
+
+
+entity_locks = KeyedLocks()
@@ -0,0 +1,467 @@
+import json
+import re
+import time
+import uuid
+import threading
+from collections import Counter
+from urllib.parse import parse_qsl
+from datetime import datetime, timezone, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 本地模拟的 Todoist Sync v9、Notion 和 Kimai API，只实现同步代码用到的端点，用于离线基准测试。
+
+
+def now_iso():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+def parse_iso(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+class FakeServer:
+    """Base for the fake APIs: request counting, optional latency and a 429 rate limit.
+
+    ``latency`` seconds are slept on every request. With ``rate_limit`` (requests
+    per second) set, requests beyond it get 429 with a Retry-After header.
+    """
+
+    name = "fake"
+
+    def __init__(self, latency=0.0, rate_limit=None, host="127.0.0.1", port=0):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.calls = Counter()
+        self.lock = threading.RLock()
+        self.window_start = time.monotonic()
+        self.window_count = 0
+        handler = type(f"{type(self).__name__}Handler", (FakeHandler,), {"server_impl": self})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def throttled(self):
+        if not self.rate_limit:
+            return None
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_start >= 1:
+                self.window_start, self.window_count = now, 0
+            self.window_count += 1
+            if self.window_count > self.rate_limit:
+                return max(1 - (now - self.window_start), 0.01)
+        return None
+
+    def total_calls(self):
+        with self.lock:
+            return sum(self.calls.values())
+
+    def reset_calls(self):
+        with self.lock:
+            self.calls.clear()
+
+    def handle(self, method, path, body):
+        raise NotImplementedError
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    server_impl = None
+    protocol_version = "HTTP/1.1"
+    # 头和 body 分两次写出，开着 Nagle 时每个请求会多等一次 40ms 的延迟 ACK
+    disable_nagle_algorithm = True
+
+    def dispatch(self, method):
+        impl = self.server_impl
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        if impl.latency:
+            time.sleep(impl.latency)
+        retry_after = impl.throttled()
+        if retry_after is not None:
+            with impl.lock:
+                impl.calls["429"] += 1
+            return self.reply(429, {"object": "error", "code": "rate_limited", "message": "Rate limited"}, {"Retry-After": f"{retry_after:.2f}"})
+        try:
+            body = json.loads(raw) if raw else {}
+        except ValueError:
+            body = {}
+        path, _, query = self.path.partition("?")
+        if method == "GET" and query:
+            # GET 的查询参数作为 body 传给 handle
+            body = dict(parse_qsl(query))
+        result = impl.handle(method, path, body)
+        status, payload, headers = result if len(result) == 3 else (*result, None)
+        self.reply(status, payload, headers)
+
+    def reply(self, status, payload, headers=None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def do_PATCH(self):
+        self.dispatch("PATCH")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeTodoistServer(FakeServer):
+    """Sync v9 /sync (read + commands) and /items/get backed by in-memory items, notes and projects.
+
+    Sync tokens are a global revision number: ``*`` returns everything, any other
+    token returns the objects changed after that revision.
+    """
+
+    name = "todoist"
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.revision = 0
+        self.next_id = 1000000
+        self.resources = {"items": {}, "notes": {}, "projects": {}}
+        self.revisions = {"items": {}, "notes": {}, "projects": {}}
+
+    def new_id(self):
+        self.next_id += 1
+        return str(self.next_id)
+
+    def touch(self, resource, obj):
+        self.revision += 1
+        obj["updated_at"] = now_iso()
+        self.resources[resource][obj["id"]] = obj
+        self.revisions[resource][obj["id"]] = self.revision
+
+    def seed_project(self, name, inbox=False):
+        with self.lock:
+            project = {"id": self.new_id(), "name": name, "is_archived": False, "is_deleted": False, "inbox_project": inbox}
+            self.touch("projects", project)
+            return project
+
+    def seed_item(self, content, project_id, **fields):
+        with self.lock:
+            item = {
+                "id": self.new_id(), "content": content, "description": "", "priority": 1, "due": None,
+                "project_id": project_id, "checked": False, "is_deleted": False, "added_at": now_iso(),
+            }
+            item.update(fields)
+            self.touch("items", item)
+            return item
+
+    def edit_item(self, item_id, **fields):
+        with self.lock:
+            item = dict(self.resources["items"][item_id])
+            item.update(fields)
+            self.touch("items", item)
+            return item
+
+    def handle(self, method, path, body):
+        with self.lock:
+            if path.endswith("/items/get"):
+                self.calls["items/get"] += 1
+                item = self.resources["items"].get(str(body.get("item_id")))
+                if item is None:
+                    return 404, {"error": "Item not found", "error_code": 22}
+                notes = [note for note in self.resources["notes"].values() if note["item_id"] == item["id"]]
+                return 200, {"item": item, "notes": notes}
+            if path.endswith("/sync"):
+                self.calls["sync:commands" if body.get("commands") else "sync:read"] += 1
+                return 200, self.sync(body)
+            return 404, {"error": f"unknown endpoint {path}"}
+
+    def sync(self, body):
+        commands = body.get("commands") or []
+        if isinstance(commands, str):
+            commands = json.loads(commands)
+        temp_id_mapping, sync_status = {}, {}
+        for command in commands:
+            try:
+                self.run_command(command, temp_id_mapping)
+                sync_status[command["uuid"]] = "ok"
+            except KeyError as e:
+                sync_status[command["uuid"]] = {"error": f"Not found: {e}", "error_code": 22, "http_code": 404}
+        resource_types = body.get("resource_types") or "[]"
+        if isinstance(resource_types, str):
+            resource_types = json.loads(resource_types)
+        token = body.get("sync_token") or "*"
+        since = 0 if token == "*" else int(token)
+        result = {"sync_token": str(self.revision), "full_sync": token == "*", "temp_id_mapping": temp_id_mapping, "sync_status": sync_status}
+        for resource in resource_types:
+            if resource in self.resources:
+                result[resource] = [
+                    obj for obj_id, obj in self.resources[resource].items()
+                    if self.revisions[resource][obj_id] > since and not (token == "*" and obj.get("is_deleted"))
+                ]
+        return result
+
+    def run_command(self, command, temp_id_mapping):
+        args = dict(command.get("args") or {})
+        for field in ("id", "item_id", "project_id", "parent_id"):
+            if args.get(field) in temp_id_mapping:
+                args[field] = temp_id_mapping[args[field]]
+        command_type = command["type"]
+        if command_type == "item_add":
+            item = {"id": self.new_id(), "description": "", "priority": 1, "due": None, "checked": False, "is_deleted": False, "added_at": now_iso()}
+            item.update({key: value for key, value in args.items() if key not in ("id", "todoist_id")})
+            self.touch("items", item)
+            temp_id_mapping[command["temp_id"]] = item["id"]
+        elif command_type == "note_add":
+            if str(args["item_id"]) not in self.resources["items"]:
+                raise KeyError(args["item_id"])
+            note = {"id": self.new_id(), "item_id": str(args["item_id"]), "content": args.get("content"), "is_deleted": False}
+            self.touch("notes", note)
+            temp_id_mapping[command["temp_id"]] = note["id"]
+        elif command_type in ("item_update", "item_complete", "item_delete"):
+            item = dict(self.resources["items"][str(args.pop("id"))])
+            if command_type == "item_update":
+                item.update({key: value for key, value in args.items() if key != "todoist_id"})
+            elif command_type == "item_complete":
+                item["checked"] = True
+            else:
+                item["is_deleted"] = True
+            self.touch("items", item)
+        elif command_type == "project_add":
+            project = {"id": self.new_id(), "name": args.get("name"), "is_archived": False, "is_deleted": False, "inbox_project": False}
+            self.touch("projects", project)
+            temp_id_mapping[command["temp_id"]] = project["id"]
+        elif command_type == "project_update":
+            project = dict(self.resources["projects"][str(args.pop("id"))])
+            project.update(args)
+            self.touch("projects", project)
+        else:
+            raise KeyError(command_type)
+
+
+class FakeNotionServer(FakeServer):
+    """Notion v1 pages and databases endpoints backed by an in-memory page store.
+
+    Query filters understand ``and``/``or``, ``last_edited_time`` timestamps and
+    checkbox/rich_text/title property conditions; anything else matches. Writes
+    through the API are made by ``bot_user_id``; ``create``/``edit`` called
+    directly stand for a person editing in Notion.
+    """
+
+    name = "notion"
+    bot_user_id = "00000000-0000-4000-8000-0000000b0700"
+    person_user_id = "00000000-0000-4000-8000-0000000e0500"
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.pages = {}
+        # 模拟 Notion 按分钟取整的 last_edited_time
+        self.round_to_minute = False
+
+    def stamp(self):
+        moment = datetime.now(timezone.utc)
+        if self.round_to_minute:
+            moment = moment.replace(second=0, microsecond=0)
+        return moment.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+    def create(self, database_id, properties, editor=None):
+        with self.lock:
+            page_id = str(uuid.uuid4())
+            stamp = self.stamp()
+            user = {"object": "user", "id": editor or self.person_user_id}
+            page = {
+                "object": "page", "id": page_id, "created_time": stamp, "last_edited_time": stamp,
+                "created_by": user, "last_edited_by": user,
+                "archived": False, "parent": {"type": "database_id", "database_id": database_id},
+                "properties": properties or {}, "url": f"https://www.notion.so/{page_id.replace('-', '')}",
+            }
+            self.pages[page_id] = page
+            return page
+
+    def edit(self, page_id, properties=None, archived=None, editor=None):
+        with self.lock:
+            page = self.pages[page_id]
+            page["properties"] = {**page["properties"], **(properties or {})}
+            if archived is not None:
+                page["archived"] = archived
+            page["last_edited_time"] = self.stamp()
+            page["last_edited_by"] = {"object": "user", "id": editor or self.person_user_id}
+            return page
+
+    def handle(self, method, path, body):
+        with self.lock:
+            match = re.match(r"^/v1/databases/([^/]+)/query$", path)
+            if match and method == "POST":
+                self.calls["databases.query"] += 1
+                return 200, self.query(match.group(1), body)
+            match = re.match(r"^/v1/databases/([^/]+)$", path)
+            if match and method == "GET":
+                self.calls["databases.retrieve"] += 1
+                return 200, {"object": "database", "id": match.group(1), "properties": {}}
+            if path == "/v1/users/me" and method == "GET":
+                self.calls["users.me"] += 1
+                return 200, {"object": "user", "id": self.bot_user_id, "type": "bot", "bot": {}}
+            if path == "/v1/pages" and method == "POST":
+                self.calls["pages.create"] += 1
+                return 200, self.create(body.get("parent", {}).get("database_id"), body.get("properties"), self.bot_user_id)
+            match = re.match(r"^/v1/pages/([^/]+)$", path)
+            if match:
+                page_id = self.resolve(match.group(1))
+                if page_id is None:
+                    return 404, {"object": "error", "status": 404, "code": "object_not_found", "message": "Page not found"}
+                if method == "GET":
+                    self.calls["pages.retrieve"] += 1
+                    return 200, self.pages[page_id]
+                if method == "PATCH":
+                    self.calls["pages.update"] += 1
+                    return 200, self.edit(page_id, body.get("properties"), body.get("archived"), self.bot_user_id)
+            return 404, {"object": "error", "status": 404, "code": "invalid_request_url", "message": f"{method} {path}"}
+
+    def resolve(self, page_id):
+        if page_id in self.pages:
+            return page_id
+        compact = page_id.replace("-", "")
+        return next((key for key in self.pages if key.replace("-", "") == compact), None)
+
+    def query(self, database_id, body):
+        compact = database_id.replace("-", "")
+        pages = [
+            page for page in self.pages.values()
+            if page["parent"]["database_id"].replace("-", "") == compact and not page["archived"] and self.matches(page, body.get("filter"))
+        ]
+        pages.sort(key=lambda page: (page["created_time"], page["id"]))
+        start = int(body.get("start_cursor") or 0)
+        page_size = min(int(body.get("page_size") or 100), 100)
+        chunk = pages[start:start + page_size]
+        has_more = start + page_size < len(pages)
+        return {"object": "list", "results": chunk, "has_more": has_more, "next_cursor": str(start + page_size) if has_more else None}
+
+    def matches(self, page, condition):
+        if not condition:
+            return True
+        if "and" in condition:
+            return all(self.matches(page, part) for part in condition["and"])
+        if "or" in condition:
+            return any(self.matches(page, part) for part in condition["or"])
+        if condition.get("timestamp") in ("last_edited_time", "created_time"):
+            field = condition["timestamp"]
+            rule = condition.get(field, {})
+            value = parse_iso(page[field])
+            if "on_or_after" in rule:
+                return value >= parse_iso(rule["on_or_after"])
+            if "after" in rule:
+                return value > parse_iso(rule["after"])
+            return True
+        prop = page["properties"].get(condition.get("property"), {})
+        if "checkbox" in condition:
+            return bool(prop.get("checkbox")) == condition["checkbox"].get("equals")
+        for kind in ("rich_text", "title"):
+            if kind in condition:
+                text = "".join(part.get("text", {}).get("content", "") for part in prop.get(kind, []))
+                rule = condition[kind]
+                if "equals" in rule:
+                    return text == rule["equals"]
+                if "is_empty" in rule:
+                    return not text
+        return True
+
+
+class FakeKimaiServer(FakeServer):
+    """Kimai /api/timesheets with page/size pagination, X-Total-* headers and modified_after.
+
+    Times are naive local strings in the account timezone (``utc_offset_hours``),
+    like the real API. Asking for a page past the last one returns 404, as Kimai does.
+    """
+
+    name = "kimai"
+
+    def __init__(self, utc_offset_hours=8, **kwargs):
+        super().__init__(**kwargs)
+        self.utc_offset = timezone(timedelta(hours=utc_offset_hours))
+        self.timesheets = {}
+        self.modified = {}
+        self.next_id = 1
+
+    def local_now(self):
+        return datetime.now(self.utc_offset).strftime("%Y-%m-%dT%H:%M:%S")
+
+    def seed_timesheet(self, description, begin=None, duration=3600, project=1, activity=1, user=1, meta_fields=None, **fields):
+        with self.lock:
+            timesheet_id = self.next_id
+            self.next_id += 1
+            begin = begin or datetime.now(self.utc_offset).replace(microsecond=0)
+            timesheet = {
+                "id": timesheet_id, "description": description, "duration": duration,
+                "begin": begin.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "end": (begin + timedelta(seconds=duration)).strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "project": {"id": project}, "activity": {"id": activity}, "user": {"id": user},
+                "rate": 0.0, "exported": False, "metaFields": meta_fields or [],
+            }
+            timesheet.update(fields)
+            self.timesheets[timesheet_id] = timesheet
+            self.modified[timesheet_id] = self.local_now()
+            return timesheet
+
+    def edit_timesheet(self, timesheet_id, **fields):
+        with self.lock:
+            self.timesheets[timesheet_id].update(fields)
+            self.modified[timesheet_id] = self.local_now()
+            return self.timesheets[timesheet_id]
+
+    def handle(self, method, path, body):
+        with self.lock:
+            if path != "/api/timesheets" or method != "GET":
+                return 404, {"code": 404, "message": "Not found"}
+            self.calls["timesheets"] += 1
+            modified_after = body.get("modified_after")
+            timesheets = [
+                self.timesheets[timesheet_id] for timesheet_id in sorted(self.timesheets)
+                if not modified_after or self.modified[timesheet_id] >= modified_after
+            ]
+            page, size = int(body.get("page") or 1), int(body.get("size") or 50)
+            total_pages = max((len(timesheets) + size - 1) // size, 1)
+            if page > total_pages:
+                return 404, {"code": 404, "message": "Not found"}
+            headers = {"X-Page": str(page), "X-Per-Page": str(size), "X-Total-Count": str(len(timesheets)), "X-Total-Pages": str(total_pages)}
+            return 200, timesheets[(page - 1) * size:page * size], headers
+
+
+def start_fake_servers(latency=0.0, rate_limit=None):
+    """Start both fake APIs on free local ports and return (todoist, notion)."""
+    return FakeTodoistServer(latency=latency, rate_limit=rate_limit).start(), FakeNotionServer(latency=latency, rate_limit=rate_limit).start()
+
+
+def fake_environment(todoist, notion, task_database_id, project_database_id):
+    """Environment variables that point the sync code at the fake servers."""
+    return {
+        "TODOIST_BASE_URL": f"{todoist.url}/sync/v9",
+        "NOTION_BASE_URL": notion.url,
+        "TODOIST_TOKEN": "fake-todoist-token",
+        "NOTION_TOKEN": "fake-notion-token",
+        "NOTION_TASK_DATABASE_ID": task_database_id,
+        "NOTION_PROJECT_DATABASE_ID": project_database_id,
+    }
+
+
+def fake_kimai_environment(kimai):
+    return {
+        "KIMAI_BASE_URL": f"{kimai.url}/api",
+        "KIMAI_TOKEN": "fake-kimai-token",
+        "KIMAI_UTC_OFFSET_HOURS": str(kimai.utc_offset.utcoffset(None).total_seconds() / 3600),
+    }
@@ -0,0 +1,81 @@
+import os
+import socket
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from typing import Any, Dict, Tuple
+
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "10"))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "10"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+HTTP_KEEPALIVE = os.getenv("HTTP_KEEPALIVE", "true").lower() != "false"
+HTTP_KEEPALIVE_IDLE = int(os.getenv("HTTP_KEEPALIVE_IDLE", "60"))
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class KeepAliveAdapter(HTTPAdapter):
+    """HTTPAdapter that turns on TCP keep-alive for pooled sockets."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        if HTTP_KEEPALIVE:
+            socket_options = [(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1), (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+            if hasattr(socket, "TCP_KEEPIDLE"):
+                socket_options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, HTTP_KEEPALIVE_IDLE))
+            kwargs["socket_options"] = socket_options
+        super().init_poolmanager(*args, **kwargs)
+
+
+def get_timeout() -> Tuple[float, float]:
+    return (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+
+
+def create_session() -> requests.Session:
+    session = requests.Session()
+    adapter = KeepAliveAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["Connection"] = "keep-alive" if HTTP_KEEPALIVE else "close"
+    return session
+
+
+def get_session() -> requests.Session:
+    """Return the process-wide pooled session shared by the Todoist and Kimai clients."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = create_session()
+    return _session
+
+
+def close_session():
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def get_connection_stats() -> Dict[str, Any]:
+    """Sum request and connection counters over every host pool of the shared session."""
+    stats = {"pools": 0, "requests": 0, "new_connections": 0, "reused": 0}
+    if _session is None:
+        return stats
+    seen = set()
+    for adapter in _session.adapters.values():
+        if id(adapter) in seen:
+            continue
+        seen.add(id(adapter))
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            stats["pools"] += 1
+            stats["requests"] += pool.num_requests
+            stats["new_connections"] += pool.num_connections
+    stats["reused"] = max(stats["requests"] - stats["new_connections"], 0)
+    return stats
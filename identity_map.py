@@ -0,0 +1,172 @@
+import os
+import threading
+from datetime import datetime
+from collections import OrderedDict
+
+IDENTITY_MAP_MAX_SIZE = int(os.getenv("IDENTITY_MAP_MAX_SIZE", "50000"))
+# true: 跨同步周期保留映射 (依靠写穿更新保持一致); false: 每个周期重新加载
+IDENTITY_MAP_WARM = os.getenv("IDENTITY_MAP_WARM", "true").lower() != "false"
+
+TASK_FIELDS = ("todoist_id", "notion_id", "note_id", "note", "date_updated", "project_id", "todoist_modified", "notion_created", "notion_modified", "sync_hash", "sync_snapshot", "notion_written_at", "todoist_written_at")
+PROJECT_FIELDS = ("todoist_id", "notion_id", "name", "updated_at", "sync_hash")
+
+_identity_map = None
+_identity_map_lock = threading.Lock()
+
+
+def _key(value):
+    # SQLite 的 INTEGER 列会把 Todoist 的字符串 ID 存成整数，统一用字符串作为键
+    return None if value is None else str(value)
+
+
+def _normalize(row):
+    # SQLite 的 DATETIME 列读回来是字符串，MySQL 是 datetime；写穿的值也统一成 SQLite 的字符串形式，
+    # 保证同一个字段无论来自数据库还是写穿都可以互相比较
+    for field, value in row.items():
+        if isinstance(value, datetime):
+            row[field] = value.isoformat(" ")
+    return row
+
+
+class LRUIndex:
+    """Bounded mapping of primary id -> row dict with a secondary notion_id index."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.rows = OrderedDict()
+        self.by_notion_id = {}
+        self.evicted = False
+
+    def get(self, todoist_id):
+        row = self.rows.get(todoist_id)
+        if row is not None:
+            self.rows.move_to_end(todoist_id)
+        return row
+
+    def get_by_notion_id(self, notion_id):
+        todoist_id = self.by_notion_id.get(notion_id)
+        return self.get(todoist_id) if todoist_id is not None else None
+
+    def put(self, todoist_id, row):
+        old = self.rows.get(todoist_id)
+        if old is not None and old.get("notion_id") != row.get("notion_id"):
+            self.by_notion_id.pop(old.get("notion_id"), None)
+        self.rows[todoist_id] = row
+        self.rows.move_to_end(todoist_id)
+        if row.get("notion_id"):
+            self.by_notion_id[row["notion_id"]] = todoist_id
+        while len(self.rows) > self.max_size:
+            _, evicted_row = self.rows.popitem(last=False)
+            self.by_notion_id.pop(evicted_row.get("notion_id"), None)
+            self.evicted = True
+
+    def remove(self, todoist_id):
+        row = self.rows.pop(todoist_id, None)
+        if row is not None:
+            self.by_notion_id.pop(row.get("notion_id"), None)
+
+    def clear(self):
+        self.rows.clear()
+        self.by_notion_id.clear()
+        self.evicted = False
+
+
+class IdentityMap:
+    """In-memory todoist_id <-> notion_id map for tasks and projects.
+
+    Rows are loaded once, answered from memory and kept current through the
+    ``put_*`` write-through methods. When the size bound has evicted rows, a miss
+    falls back to a DB lookup; otherwise a miss means the row does not exist.
+    """
+
+    def __init__(self, db_manager, max_size=IDENTITY_MAP_MAX_SIZE):
+        self.db_manager = db_manager
+        self.tasks = LRUIndex(max_size)
+        self.projects = LRUIndex(max_size)
+        self.lock = threading.RLock()
+        self.loaded = False
+
+    def load(self):
+        with self.lock:
+            self.tasks.clear()
+            self.projects.clear()
+            for row in self.db_manager.fetch_all(f"SELECT {', '.join(TASK_FIELDS)} FROM tasks"):
+                self._put(self.tasks, TASK_FIELDS, row)
+            for row in self.db_manager.fetch_all(f"SELECT {', '.join(PROJECT_FIELDS)} FROM projects"):
+                self._put(self.projects, PROJECT_FIELDS, row)
+            self.loaded = True
+        return self
+
+    def _put(self, index, fields, values):
+        row = _normalize(dict(zip(fields, values)))
+        row["todoist_id"] = _key(row["todoist_id"])
+        if row["todoist_id"] is not None:
+            index.put(row["todoist_id"], row)
+        return row
+
+    def _fallback(self, index, table, fields, column, value):
+        if not index.evicted or value is None:
+            return None
+        values = self.db_manager.fetch_one(f"SELECT {', '.join(fields)} FROM {table} WHERE {column} = ?", (value,))
+        return self._put(index, fields, values) if values else None
+
+    def get_task(self, todoist_id):
+        todoist_id = _key(todoist_id)
+        with self.lock:
+            return self.tasks.get(todoist_id) or self._fallback(self.tasks, "tasks", TASK_FIELDS, "todoist_id", todoist_id)
+
+    def get_task_by_notion_id(self, notion_id):
+        with self.lock:
+            return self.tasks.get_by_notion_id(notion_id) or self._fallback(self.tasks, "tasks", TASK_FIELDS, "notion_id", notion_id)
+
+    def get_project(self, todoist_id):
+        todoist_id = _key(todoist_id)
+        with self.lock:
+            return self.projects.get(todoist_id) or self._fallback(self.projects, "projects", PROJECT_FIELDS, "todoist_id", todoist_id)
+
+    def get_project_by_notion_id(self, notion_id):
+        with self.lock:
+            return self.projects.get_by_notion_id(notion_id) or self._fallback(self.projects, "projects", PROJECT_FIELDS, "notion_id", notion_id)
+
+    def get_project_name(self, todoist_id):
+        project = self.get_project(todoist_id)
+        return project.get("name") if project else None
+
+    def put_task(self, todoist_id, **fields):
+        todoist_id = _key(todoist_id)
+        with self.lock:
+            row = dict(self.tasks.get(todoist_id) or {})
+            row.update(_normalize(fields))
+            row["todoist_id"] = todoist_id
+            self.tasks.put(todoist_id, row)
+        return row
+
+    def put_project(self, todoist_id, **fields):
+        todoist_id = _key(todoist_id)
+        with self.lock:
+            row = dict(self.projects.get(todoist_id) or {})
+            row.update(_normalize(fields))
+            row["todoist_id"] = todoist_id
+            self.projects.put(todoist_id, row)
+        return row
+
+    def invalidate_task(self, todoist_id):
+        with self.lock:
+            self.tasks.remove(_key(todoist_id))
+            self.tasks.evicted = True
+
+    def invalidate_project(self, todoist_id):
+        with self.lock:
+            self.projects.remove(_key(todoist_id))
+            self.projects.evicted = True
+
+
+def get_identity_map(db_manager):
+    """Return the identity map for this cycle, reusing the warm instance when IDENTITY_MAP_WARM is set."""
+    global _identity_map
+    with _identity_map_lock:
+        if _identity_map is None or not IDENTITY_MAP_WARM:
+            _identity_map = IdentityMap(db_manager).load()
+        else:
+            _identity_map.db_manager = db_manager
+        return _identity_map
@@ -0,0 +1,141 @@
+import os
+import re
+from datetime import datetime, timezone, timedelta
+from services import services
+from sync_stats import sync_stats
+from tracing import traced
+from logger import logger, payload
+
+# Kimai 按账号时区解释 modified_after (不带时区的本地时间)，默认与其他模块一致用 UTC+8
+KIMAI_UTC_OFFSET_HOURS = float(os.getenv("KIMAI_UTC_OFFSET_HOURS", "8"))
+# 游标回退的秒数，覆盖两端时钟偏差；重复拉到的工时按 kimai_id 覆盖写入
+KIMAI_CURSOR_OVERLAP = int(os.getenv("KIMAI_CURSOR_OVERLAP", "120"))
+# 工时的自定义字段中保存 Todoist 任务 ID 的字段名
+KIMAI_TASK_META_FIELD = os.getenv("KIMAI_TASK_META_FIELD", "todoist_id")
+# 未关联到任务的工时，在这么多天内每轮重新尝试关联 (任务可能稍后才同步进来)
+KIMAI_RELINK_DAYS = int(os.getenv("KIMAI_RELINK_DAYS", "30"))
+KIMAI_CURSOR_KEY = "kimai:timesheets"
+
+TODOIST_TASK_URL = re.compile(r"todoist\.com/(?:showTask\?id=|app/task/(?:[\w-]*-)?)(\w+)")
+NOTION_PAGE_URL = re.compile(r"notion\.so/(?:[\w%-]*-)?([0-9a-fA-F]{32})")
+
+
+def kimai_now():
+    return datetime.now(timezone(timedelta(hours=KIMAI_UTC_OFFSET_HOURS))).replace(tzinfo=None)
+
+
+def format_kimai_time(moment):
+    # Kimai 的 HTML5 本地时间格式
+    return moment.strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def ref_id(value):
+    """Timesheet relations are ids, or objects with an id when requested with full=true."""
+    return value.get("id") if isinstance(value, dict) else value
+
+
+def dashed_uuid(compact):
+    return f"{compact[:8]}-{compact[8:12]}-{compact[12:16]}-{compact[16:20]}-{compact[20:]}"
+
+
+def timesheet_task_ref(timesheet):
+    """Explicit task reference of a timesheet: the meta field, or a Todoist/Notion task URL in the description."""
+    for field in timesheet.get("metaFields") or []:
+        if field.get("name") == KIMAI_TASK_META_FIELD and field.get("value"):
+            return f"todoist:{field['value']}"
+    description = timesheet.get("description") or ""
+    match = TODOIST_TASK_URL.search(description)
+    if match:
+        return f"todoist:{match.group(1)}"
+    match = NOTION_PAGE_URL.search(description)
+    if match:
+        return f"notion:{dashed_uuid(match.group(1).lower())}"
+    return None
+
+
+def description_title(description):
+    """First line of the description, matched against task content when there is no explicit reference."""
+    lines = (description or "").strip().splitlines()
+    return lines[0].strip() if lines else None
+
+
+def resolve_task_ids(db_manager, entries):
+    """Map (task_ref, description) pairs to todoist_id (or None) with one batched lookup per kind."""
+    refs = {"todoist": [], "notion": []}
+    for task_ref, _ in entries:
+        if task_ref:
+            kind, value = task_ref.split(":", 1)
+            refs[kind].append(value)
+    found = {
+        "todoist": db_manager.find_task_ids("todoist_id", refs["todoist"]),
+        "notion": db_manager.find_task_ids("notion_id", refs["notion"]),
+        "content": db_manager.find_task_ids("content", [description_title(description) for _, description in entries]),
+    }
+    todoist_ids = []
+    for task_ref, description in entries:
+        todoist_id = None
+        if task_ref:
+            kind, value = task_ref.split(":", 1)
+            todoist_id = found[kind].get(value)
+        todoist_ids.append(todoist_id or found["content"].get(description_title(description)))
+    return todoist_ids
+
+
+def timesheet_row(timesheet, todoist_id, task_ref, synced_at):
+    """Row in the column order of get_upsert_timesheet_query."""
+    return (
+        timesheet["id"], todoist_id, task_ref,
+        ref_id(timesheet.get("project")), ref_id(timesheet.get("activity")), ref_id(timesheet.get("user")),
+        timesheet.get("begin"), timesheet.get("end"), timesheet.get("duration"),
+        timesheet.get("description"), timesheet.get("rate"), bool(timesheet.get("exported")), synced_at,
+    )
+
+
+def relink_timesheets(db_manager, days=KIMAI_RELINK_DAYS):
+    """Link recent unlinked timesheets whose task has been synced since; returns the number linked."""
+    since = format_kimai_time(kimai_now() - timedelta(days=days))
+    rows = db_manager.get_unlinked_timesheets(since)
+    if not rows:
+        return 0
+    todoist_ids = resolve_task_ids(db_manager, [(task_ref, description) for _, task_ref, description in rows])
+    links = [(todoist_id, kimai_id) for (kimai_id, _, _), todoist_id in zip(rows, todoist_ids) if todoist_id]
+    db_manager.update_timesheet_tasks(links)
+    return len(links)
+
+
+@traced("kimai.sync_timesheets")
+def sync_kimai_timesheets():
+    """Pull timesheets modified since the stored cursor, link them to tasks and upsert them.
+
+    The next cursor is this run's start time minus KIMAI_CURSOR_OVERLAP; it is
+    committed together with the last batch of rows.
+    """
+    db_manager = services.db_manager
+    kimai_client = services.kimai_client
+    cursor = db_manager.get_sync_token(KIMAI_CURSOR_KEY)
+    cursor = None if cursor == "*" else cursor
+    logger.info("Kimai timesheet cursor: %s", cursor)
+    # 先记下本轮开始时间，拉取期间发生的修改会在下一轮被拉到
+    started = kimai_now()
+    synced_at = format_kimai_time(started)
+    processed = linked = 0
+    with db_manager.unit_of_work() as unit_of_work:
+        for timesheets in kimai_client.iter_timesheets(cursor):
+            logger.debug("Kimai timesheets: %s", payload(timesheets))
+            task_refs = [timesheet_task_ref(timesheet) for timesheet in timesheets]
+            todoist_ids = resolve_task_ids(db_manager, [(task_ref, timesheet.get("description")) for task_ref, timesheet in zip(task_refs, timesheets)])
+            for timesheet, task_ref, todoist_id in zip(timesheets, task_refs, todoist_ids):
+                unit_of_work.upsert_timesheet(timesheet_row(timesheet, todoist_id, task_ref, synced_at))
+            processed += len(timesheets)
+            linked += sum(1 for todoist_id in todoist_ids if todoist_id)
+        unit_of_work.update_sync_token(KIMAI_CURSOR_KEY, format_kimai_time(started - timedelta(seconds=KIMAI_CURSOR_OVERLAP)))
+    relinked = relink_timesheets(db_manager)
+    sync_stats.increment("kimai_timesheets", processed)
+    logger.info("Synced %s Kimai timesheets (%s linked to tasks), relinked %s earlier timesheets", processed, linked, relinked)
+    return processed
+
+
+if __name__ == "__main__":
+    logger.info("Starting synchronization from Kimai...")
+    sync_kimai_timesheets()
+    logger.info("Completed synchronization from Kimai.")
@@ -0,0 +1,125 @@
+import os
+import sys
+import queue
+import atexit
+import random
+import logging
+import reprlib
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from pythonjsonlogger import jsonlogger
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FILE = os.getenv("LOG_FILE", "log.json")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_CONSOLE = os.getenv("LOG_CONSOLE", "true").lower() != "false"
+# 队列满时丢弃新日志，同步线程永远不会因为写日志而阻塞
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# 大对象 (API 响应、属性字典) 最多输出的字符数，以及 DEBUG/INFO 级别下的采样率
+LOG_PAYLOAD_LIMIT = int(os.getenv("LOG_PAYLOAD_LIMIT", "2000"))
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "1.0"))
+
+payload_repr = reprlib.Repr()
+payload_repr.maxlevel = 4
+payload_repr.maxdict = 20
+payload_repr.maxlist = 20
+payload_repr.maxtuple = 20
+payload_repr.maxset = 20
+payload_repr.maxstring = 200
+payload_repr.maxother = 200
+
+
+class Payload:
+    """Large log argument rendered only when a record passes the level check, in bounded time and size.
+
+    Use with %-style logging: ``logger.debug("Todoist tasks: %s", payload(tasks))``.
+    """
+
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value, limit=LOG_PAYLOAD_LIMIT):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self):
+        text = self.value if isinstance(self.value, str) else payload_repr.repr(self.value)
+        if len(text) > self.limit:
+            return f"{text[:self.limit]}... [truncated {len(text) - self.limit} chars]"
+        return text
+
+    __repr__ = __str__
+
+
+def payload(value, limit=LOG_PAYLOAD_LIMIT):
+    return Payload(value, limit)
+
+
+class PayloadSampler(logging.Filter):
+    """Keeps only ``rate`` of the DEBUG/INFO records that carry a Payload argument."""
+
+    def __init__(self, rate=LOG_PAYLOAD_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if self.rate >= 1 or record.levelno > logging.INFO or not record.args:
+            return True
+        args = record.args.values() if isinstance(record.args, dict) else record.args
+        if not any(isinstance(arg, Payload) for arg in args):
+            return True
+        return random.random() < self.rate
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler that drops records instead of blocking when the listener falls behind."""
+
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            NonBlockingQueueHandler.dropped += 1
+
+
+_listener = None
+
+
+def setup_logging():
+    """Route every logger through one queue to a single console + rotating JSON file handler set.
+
+    QueueHandler.prepare renders the message (%-args, including Payload) on the
+    calling thread, so arguments the sync code mutates afterwards are captured as
+    they were; Payload keeps that step bounded. The console/JSON formatters and
+    all file I/O run on the listener thread. Safe to call more than once.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+    handlers = []
+    if LOG_CONSOLE:
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(threadName)s %(name)s: %(message)s"))
+        handlers.append(console_handler)
+    if LOG_FILE:
+        file_handler = RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8", delay=True)
+        file_handler.setFormatter(jsonlogger.JsonFormatter("%(asctime)s %(levelname)s %(name)s %(threadName)s %(message)s"))
+        handlers.append(file_handler)
+
+    queue_handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    queue_handler.addFilter(PayloadSampler())
+    root = logging.getLogger()
+    # 去掉之前挂在根 logger 上的 handler，保证每条日志只写一次
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(LOG_LEVEL)
+
+    _listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
+
+
+setup_logging()
+logger = logging.getLogger("sync")
@@ -1,49 +1,85 @@
+import os
 import time
-from threading import Thread
+import asyncio
+from threading import Thread, Lock
 from logger import logger
-from project_sync import sync_todoist_projects_to_notion, sync_notion_projects_to_todoist
-from task_sync import sync_todoist_to_notion, sync_notion_to_todoist
+from http_session import get_connection_stats
+from sync_stats import sync_stats
+from tracing import tracer, install_signal_handler, TRACE_ENABLED
+from metrics import metrics, start_metrics_server, METRICS_PORT, METRICS_SNAPSHOT_PATH
+from services import services
+from project_sync import sync_todoist_projects_to_notion, sync_notion_projects_to_todoist, sync_todoist_projects_to_notion_async
+from kimai_sync import sync_kimai_timesheets
+from task_sync import sync_todoist_to_notion, sync_notion_to_todoist, sync_todoist_to_notion_async
+from scheduler import AdaptiveScheduler, ScheduledResource, POLL_INTERVAL, POLL_MAX_INTERVAL, PROJECT_POLL_MAX_INTERVAL
 
-def project_sync():
-    try:
-        logger.info("开始从 Notion 到 Todoist 的项目同步...")
-        sync_notion_projects_to_todoist()
-        logger.info("完成从 Notion 到 Todoist 的项目同步。")
-        
-        logger.info("开始从 Todoist 到 Notion 的项目同步...")
-        sync_todoist_projects_to_notion()
-        logger.info("完成从 Todoist 到 Notion 的项目同步。")
-    except Exception as e:
-        logger.error(f"项目同步过程中出错: {e}")
-
-def sync_all():
-    while True:
-        start_time = time.time()
-        
-        project_sync()  # 每次任务同步前先进行项目同步
-        
+# async: 并发处理 Todoist -> Notion 的写入; sequential: 逐条处理 (回退模式)
+SYNC_MODE = os.getenv("SYNC_MODE", "async")
+# 启用 webhook 推送后，轮询只作为兜底，间隔可以拉长
+WEBHOOK_ENABLED = os.getenv("WEBHOOK_ENABLED", "false").lower() == "true"
+WEBHOOK_POLL_INTERVAL = int(os.getenv("WEBHOOK_POLL_INTERVAL", "900"))
+# 配置了 Kimai token 才同步工时
+KIMAI_ENABLED = bool(os.getenv("KIMAI_TOKEN"))
+
+# 轮询周期与 webhook 推送共用，避免两者同时写同一批数据
+sync_lock = Lock()
+
+
+def run_todoist_projects_to_notion():
+    if SYNC_MODE == "async":
+        return asyncio.run(sync_todoist_projects_to_notion_async())
+    return sync_todoist_projects_to_notion()
+
+
+def run_todoist_to_notion():
+    if SYNC_MODE == "async":
+        return asyncio.run(sync_todoist_to_notion_async())
+    return sync_todoist_to_notion()
+
+def log_connection_stats():
+    logger.info("HTTP 连接复用统计: %s", get_connection_stats())
+    logger.info("同步计数 (skipped_writes: 跳过的无变化写入, suppressed_echoes: 忽略的自身写入回声): %s", sync_stats.snapshot())
+    if METRICS_SNAPSHOT_PATH:
         try:
-            logger.info("开始从 Todoist 到 Notion 的任务同步...")
-            if not sync_todoist_to_notion():
-                logger.info("没有新任务需要从 Todoist 同步到 Notion。")
-            else:
-                logger.info("完成从 Todoist 到 Notion 的任务同步。")
-            
-            logger.info("开始从 Notion 到 Todoist 的任务同步...")
-            if not sync_notion_to_todoist():
-                logger.info("没有新任务需要从 Notion 同步到 Todoist。")
-            else:
-                logger.info("完成从 Notion 到 Todoist 的任务同步。")
-        except Exception as e:
-            logger.error(f"任务同步过程中出错: {e}")
-        
-        # 计算剩余时间并等待
-        elapsed_time = time.time() - start_time
-        sleep_time = max(60 - elapsed_time, 0)  # 确保至少等待0秒
-        time.sleep(sleep_time)
+            metrics.write_snapshot(METRICS_SNAPSHOT_PATH)
+        except OSError as e:
+            logger.error("写入指标快照失败: %s", e)
+
+
+def build_scheduler():
+    # 每种资源独立调度；项目在 stage 0，任务在 stage 1，工时在 stage 2，同一轮到期时按 stage 顺序执行
+    # 项目两个方向没有实体锁，始终顺序执行；只有任务两个方向可在流水线模式下并行
+    if WEBHOOK_ENABLED:
+        min_interval = WEBHOOK_POLL_INTERVAL
+        max_interval = max(WEBHOOK_POLL_INTERVAL, POLL_MAX_INTERVAL)
+        project_max_interval = max(WEBHOOK_POLL_INTERVAL, PROJECT_POLL_MAX_INTERVAL)
+    else:
+        min_interval, max_interval, project_max_interval = POLL_INTERVAL, POLL_MAX_INTERVAL, PROJECT_POLL_MAX_INTERVAL
+    resources = [
+        ScheduledResource("notion_projects", sync_notion_projects_to_todoist, min_interval, project_max_interval),
+        ScheduledResource("todoist_projects", run_todoist_projects_to_notion, min_interval, project_max_interval),
+        ScheduledResource("todoist_items", run_todoist_to_notion, min_interval, max_interval, stage=1, concurrent=True),
+        ScheduledResource("notion_tasks", sync_notion_to_todoist, min_interval, max_interval, stage=1, concurrent=True),
+    ]
+    if KIMAI_ENABLED:
+        # 工时按任务关联，放在任务同步之后；Kimai 没有 webhook，始终按轮询间隔
+        resources.append(ScheduledResource("kimai_timesheets", sync_kimai_timesheets, POLL_INTERVAL, POLL_MAX_INTERVAL, stage=2))
+    return AdaptiveScheduler(resources, sync_lock, on_tick=log_connection_stats)
+
 
 if __name__ == "__main__":
-    sync_thread = Thread(target=sync_all)
+    # 进程启动时打开数据库连接并完成建表/迁移，之后各模块共用这一连接
+    services.db_manager
+    if METRICS_PORT:
+        start_metrics_server()
+    # kill -USR1 <pid> 录制接下来的 TRACE_CYCLES 个周期
+    install_signal_handler()
+    if TRACE_ENABLED:
+        tracer.arm()
+    if WEBHOOK_ENABLED:
+        from webhook_server import start_webhook_server
+        start_webhook_server(sync_lock)
+    sync_thread = Thread(target=build_scheduler().run_forever)
     sync_thread.daemon = True
     sync_thread.start()
     
@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logger import logger
+from sync_stats import sync_stats
+
+# METRICS_PORT 为 0 时不启动 /metrics 端点；METRICS_SNAPSHOT_PATH 为空时不写快照文件
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_SNAPSHOT_PATH = os.getenv("METRICS_SNAPSHOT_PATH", "")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+HELP = {
+    "sync_phase_duration_seconds": "Wall time of one run of a sync phase",
+    "sync_phase_errors_total": "Sync phase runs that raised",
+    "sync_entities_processed_total": "Entities changed by a sync phase",
+    "sync_entities_last_cycle": "Entities changed by the last run of a sync phase",
+    "api_request_duration_seconds": "Latency of one API request attempt",
+    "api_requests_total": "API request attempts",
+    "api_errors_total": "API request attempts that failed, by status or exception",
+    "api_circuit_open": "1 while the API circuit breaker is open",
+    "db_statement_duration_seconds": "Time spent executing one database statement",
+    "sync_events_total": "Process counters from sync_stats",
+}
+
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the ``q`` quantile (inf if above the last bucket)."""
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "avg": round(self.sum / self.count, 6) if self.count else 0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+class Metrics:
+    """Counters, gauges and histograms keyed by name and labels, rendered as Prometheus text or JSON."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def increment(self, name, count=1, **labels):
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            key = label_key(labels)
+            series[key] = series.get(key, 0) + count
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges.setdefault(name, {})[label_key(labels)] = value
+
+    def observe(self, name, value, **labels):
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            key = label_key(labels)
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for kind, metrics in (("counter", self.counters), ("gauge", self.gauges)):
+                for name in sorted(metrics):
+                    lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                    lines.append(f"# TYPE {name} {kind}")
+                    for key, value in sorted(metrics[name].items()):
+                        lines.append(f"{name}{format_labels(key)} {value}")
+            for name in sorted(self.histograms):
+                lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in sorted(self.histograms[name].items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{format_labels(key, [('le', bound)])} {cumulative}")
+                    lines.append(f"{name}_bucket{format_labels(key, [('le', '+Inf')])} {histogram.count}")
+                    lines.append(f"{name}_sum{format_labels(key)} {histogram.sum}")
+                    lines.append(f"{name}_count{format_labels(key)} {histogram.count}")
+        lines.append(f"# HELP sync_events_total {HELP['sync_events_total']}")
+        lines.append("# TYPE sync_events_total counter")
+        for name, value in sorted(sync_stats.snapshot().items()):
+            lines.append(f"sync_events_total{format_labels([('name', name)])} {value}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        def series(metrics, convert=lambda value: value):
+            return {
+                name: [{"labels": dict(key), "value": convert(value)} for key, value in sorted(values.items())]
+                for name, values in sorted(metrics.items())
+            }
+        with self.lock:
+            return {
+                "timestamp": time.time(),
+                "counters": series(self.counters),
+                "gauges": series(self.gauges),
+                "histograms": series(self.histograms, Histogram.summary),
+                "sync_stats": sync_stats.snapshot(),
+            }
+
+    def write_snapshot(self, path=METRICS_SNAPSHOT_PATH):
+        if not path:
+            return
+        # 先写临时文件再替换，读取方不会看到写了一半的快照
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(temp_path, path)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+
+metrics = Metrics()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Serve ``/metrics`` in Prometheus text format from a daemon thread and return the server."""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info("Metrics endpoint listening on %s:%s/metrics", host, server.server_port)
+    return server
@@ -0,0 +1,111 @@
+from datetime import datetime
+from logger import logger
+from sql_statements import get_create_schema_version_table_sql, get_schema_version_query, get_insert_schema_version_query
+
+# 按版本号顺序执行的迁移，每一步按数据库类型给出 DDL。
+# 新的表结构变更只需在末尾追加一项，已执行过的版本不会重复执行。
+# MySQL 的 TEXT 列建索引必须指定前缀长度。
+MIGRATIONS = [
+    (1, "add lookup indexes on tasks and projects", {
+        "sqlite": [
+            "CREATE INDEX IF NOT EXISTS idx_tasks_notion_id ON tasks (notion_id)",
+            "CREATE INDEX IF NOT EXISTS idx_tasks_deleted_date_updated ON tasks (deleted, date_updated)",
+            "CREATE INDEX IF NOT EXISTS idx_projects_todoist_id ON projects (todoist_id)",
+            "CREATE INDEX IF NOT EXISTS idx_projects_notion_id ON projects (notion_id)",
+            "CREATE INDEX IF NOT EXISTS idx_projects_name ON projects (name)",
+            "CREATE INDEX IF NOT EXISTS idx_projects_deleted_updated_at ON projects (deleted, updated_at)",
+        ],
+        "mysql": [
+            "CREATE INDEX idx_tasks_notion_id ON tasks (notion_id(64))",
+            "CREATE INDEX idx_tasks_deleted_date_updated ON tasks (deleted, date_updated)",
+            "CREATE INDEX idx_projects_todoist_id ON projects (todoist_id)",
+            "CREATE INDEX idx_projects_notion_id ON projects (notion_id(64))",
+            "CREATE INDEX idx_projects_name ON projects (name(191))",
+            "CREATE INDEX idx_projects_deleted_updated_at ON projects (deleted, updated_at)",
+        ],
+    }),
+    (2, "add sync_hash to tasks and projects", {
+        "sqlite": [
+            "ALTER TABLE tasks ADD COLUMN sync_hash TEXT",
+            "ALTER TABLE projects ADD COLUMN sync_hash TEXT",
+        ],
+        "mysql": [
+            "ALTER TABLE tasks ADD COLUMN sync_hash CHAR(64)",
+            "ALTER TABLE projects ADD COLUMN sync_hash CHAR(64)",
+        ],
+    }),
+    (3, "add sync_snapshot to tasks", {
+        "sqlite": ["ALTER TABLE tasks ADD COLUMN sync_snapshot TEXT"],
+        "mysql": ["ALTER TABLE tasks ADD COLUMN sync_snapshot TEXT"],
+    }),
+    (4, "add timesheets table for Kimai sync", {
+        "sqlite": [
+            """CREATE TABLE IF NOT EXISTS timesheets (
+                kimai_id INTEGER PRIMARY KEY,
+                todoist_id TEXT,
+                task_ref TEXT,
+                project_id INTEGER,
+                activity_id INTEGER,
+                user_id INTEGER,
+                begin_time TEXT,
+                end_time TEXT,
+                duration INTEGER,
+                description TEXT,
+                rate REAL,
+                exported BOOLEAN,
+                synced_at TEXT
+            )""",
+            "CREATE INDEX IF NOT EXISTS idx_timesheets_todoist_id ON timesheets (todoist_id)",
+        ],
+        "mysql": [
+            """CREATE TABLE IF NOT EXISTS timesheets (
+                kimai_id INT PRIMARY KEY,
+                todoist_id VARCHAR(64),
+                task_ref VARCHAR(80),
+                project_id INT,
+                activity_id INT,
+                user_id INT,
+                begin_time VARCHAR(40),
+                end_time VARCHAR(40),
+                duration INT,
+                description TEXT,
+                rate DOUBLE,
+                exported BOOLEAN,
+                synced_at VARCHAR(40)
+            )""",
+            "CREATE INDEX idx_timesheets_todoist_id ON timesheets (todoist_id)",
+        ],
+    }),
+    (5, "add own-write revisions to tasks for echo suppression", {
+        "sqlite": [
+            "ALTER TABLE tasks ADD COLUMN notion_written_at TEXT",
+            "ALTER TABLE tasks ADD COLUMN todoist_written_at TEXT",
+        ],
+        "mysql": [
+            "ALTER TABLE tasks ADD COLUMN notion_written_at VARCHAR(40)",
+            "ALTER TABLE tasks ADD COLUMN todoist_written_at VARCHAR(40)",
+        ],
+    }),
+]
+
+
+def get_schema_version(db_manager):
+    db_manager.execute_query(get_create_schema_version_table_sql(db_manager.db_type))
+    result = db_manager.fetch_one(get_schema_version_query(db_manager.db_type))
+    return result[0] if result and result[0] is not None else 0
+
+
+def apply_migrations(db_manager, migrations=MIGRATIONS):
+    """Run every migration newer than the recorded schema version, in order."""
+    dialect = "mysql" if db_manager.db_type == "mysql" else "sqlite"
+    current_version = get_schema_version(db_manager)
+    for version, description, statements in sorted(migrations, key=lambda migration: migration[0]):
+        if version <= current_version:
+            continue
+        logger.info("Applying schema migration %s: %s", version, description)
+        with db_manager.transaction():
+            for statement in statements[dialect]:
+                db_manager.execute_query(statement)
+            db_manager.execute_query(get_insert_schema_version_query(db_manager.db_type), (version, description, datetime.now()))
+        current_version = version
+    return current_version
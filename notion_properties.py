@@ -1,6 +1,5 @@
-from utils import map_priority, map_priority_reverse
-from db_operations import DatabaseManager
-from api_client import NotionClient, TodoistSyncClient
+from utils import map_priority_reverse
+from services import services
 from sql_statements import get_insert_project_query, get_insert_task_query
 import uuid
 import os
@@ -9,9 +8,6 @@ DB_TYPE = os.getenv("DB_TYPE") # 或 "mysql"
 DB_PATH = os.getenv("DB_PATH")
 NOTION_TOKEN = os.getenv("NOTION_TOKEN")
 Todoist_TOKEN = os.getenv("Todoist_TOKEN")
-db_manager = DatabaseManager(DB_TYPE, DB_PATH)
-notion_client = NotionClient(NOTION_TOKEN)
-todoist_client = TodoistSyncClient(Todoist_TOKEN, DB_TYPE, DB_PATH)
 
 
 def get_notion_project_properties(project):
@@ -39,6 +35,7 @@ def get_notion_project_properties(project):
         }
     }
 def get_todoist_project_id(task):
+    db_manager, notion_client = services.db_manager, services.notion_client
     todoist_project_id = None
     if task["Project"]["relation"] and task["Project"]["relation"][0]["id"]:
         todoist_project_id_result = db_manager.fetch_one("SELECT todoist_id FROM projects WHERE notion_id = ?", (task["Project"]["relation"][0]["id"],))
@@ -46,6 +43,8 @@ def get_todoist_project_id(task):
             todoist_project_id = todoist_project_id_result[0]
         else:
             project_name = notion_client.get_page(task['Project']['relation'][0]['id'])['Name']['title'][0]['text']['content']
+            # 只有本地没有映射时才需要 Todoist 客户端
+            todoist_client = services.new_todoist_client()
             todoist_projects = todoist_client.get_project("*")
             for project in todoist_projects:
                 if project['name'] == project_name:
@@ -68,6 +67,7 @@ def get_todoist_project_id(task):
     return todoist_project_id
 
 def get_todoist_task_id(task):
+    db_manager, notion_client = services.db_manager, services.notion_client
     todoist_task_id = None
     if task['TodoistID']['rich_text'] and task['TodoistID']['rich_text'][0]['text']['content']:
         todoist_task_id_result = db_manager.fetch_one("SELECT todoist_id FROM tasks WHERE notion_id = ?", (task["TodoistID"]["rich_text"][0]["text"]["content"],))
@@ -77,6 +77,7 @@ def get_todoist_task_id(task):
             todoist_task_id = todoist_task_id_result[0]
         else:
             task_name = task['Task']['title'][0]['text']['content']
+            todoist_client = services.new_todoist_client()
             todoist_tasks = todoist_client.get_task("*")
             for todoist_task in todoist_tasks:
                 if todoist_task['name'] == task_name:
@@ -1,26 +1,20 @@
-from api_client import TodoistSyncClient, NotionClient
-from logger import logger
-from db_operations import DatabaseManager
-from sql_statements import get_insert_project_query, get_update_project_query
-from utils import iso_to_timestamp, notion_project_property
+from logger import logger, payload
+from services import services
+from utils import iso_to_timestamp, notion_project_property, notion_last_edited_filter, next_notion_cursor, canonical_project_fields, payload_hash
+from sync_stats import sync_stats
 import uuid
 import os
-import logging
-from pythonjsonlogger import jsonlogger
+import asyncio
 from datetime import datetime, timezone, timedelta
 
-log_file = 'log.json'
-file_handler = logging.FileHandler(log_file)
-file_handler.setLevel(logging.INFO)
-formatter = jsonlogger.JsonFormatter()
-file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
 NOTION_PROJECT_DATABASE_ID = os.getenv("NOTION_PROJECT_DATABASE_ID")
 NOTION_TOKEN = os.getenv("NOTION_TOKEN")
 TODOIST_TOKEN = os.getenv("TODOIST_TOKEN")
 
 DB_TYPE = os.getenv("DB_TYPE")
 DB_PATH = os.getenv("DB_PATH")
+SYNC_CONCURRENCY = int(os.getenv("SYNC_CONCURRENCY", "8"))
+NOTION_CURSOR_OVERLAP = int(os.getenv("NOTION_CURSOR_OVERLAP", "120"))
 
 class TodoistProject:
     def __init__(self, id, name, created_at, updated_at, deleted, notion_id, notion_url):
@@ -55,91 +49,180 @@ def create_notion_project(notion_client, project):
     }
     new_project = notion_client.create_page(NOTION_PROJECT_DATABASE_ID, project_data)
     project_id = new_project['id']
-    logger.debug(f"Notion project created: {project_id}")
+    logger.debug("Notion project created: %s", project_id)
     return new_project
 
 
 
-def sync_todoist_projects_to_notion():
-    db_manager = DatabaseManager(DB_TYPE, DB_PATH)
-    todoist_client = TodoistSyncClient(TODOIST_TOKEN,DB_TYPE, DB_PATH)
-    notion_client = NotionClient(NOTION_TOKEN)
-    
+def fetch_todoist_projects(db_manager, todoist_client):
     project_sync_token = db_manager.get_sync_token("projects")
     projects_data = todoist_client.get_projects(project_sync_token)
-    logger.debug(f"Projects data: {projects_data['projects']}")
-#    if projects_data['projects']:
-#        project_last_modified = max(projects_data['projects'], key=lambda x: x['updated_at'])['updated_at']
-#        logger.info(f"Project last modified: {project_last_modified}")
-#    else:
-#        project_last_modified = None
-    db_project_count = db_manager.fetch_one("SELECT * From projects WHERE deleted IS FALSE")
-    db_project_count = db_project_count[0] if db_project_count else 0
-    todoist_projects = projects_data["projects"]
-    new_project_sync_token = projects_data['sync_token']
+    logger.debug("Projects data: %s", payload(projects_data['projects']))
+    return projects_data["projects"], projects_data['sync_token']
+
+
+def todoist_project_hash(project):
+    return payload_hash(canonical_project_fields(project.get("name"), project.get("is_archived"), project.get("is_deleted")))
+
+
+def notion_project_hash(project):
+    properties = project.get('properties', {})
+    project_name = properties.get('Name', {}).get('title', [{}])[0].get('text', {}).get('content', '')
+    return payload_hash(canonical_project_fields(project_name, properties.get('Archived', {}).get('checkbox'), project.get('archived')))
+
+
+def prepare_todoist_project(identity_map, project):
+    logger.debug("Project: %s", payload(project))
+    if not isinstance(project, dict):
+        logger.error("Expected project to be a dictionary but got %s: %s", type(project), payload(project))
+        return None
+    logger.info("Processing project: %s", project.get('name'))  # 打印调试信息
+    project_id = project.get('id')
+    project_name = project.get("name")
+    if not all([project_id, project_name]):
+        logger.error("Project data missing required fields: %s", payload(project))
+        return None
+
+    project_row = identity_map.get_project(project_id) or {}
+    notion_project_id = project_row.get("notion_id")
+    sync_hash = todoist_project_hash(project)
+    if notion_project_id and sync_hash == project_row.get("sync_hash"):
+        logger.info("Project %s unchanged since last sync, skipping Notion update", project_name)
+        sync_stats.increment("skipped_writes.notion_project")
+        return None
+    return {
+        "project": project,
+        "notion_project_id": notion_project_id,
+        "sync_hash": sync_hash
+    }
+
+
+def push_todoist_project(notion_client, context):
+    project = context["project"]
+    if context["notion_project_id"]:
+        logger.info("Notion project exists, updating...")
+        context["notion_project"] = notion_client.update_project(context["notion_project_id"], notion_project_property(project), project.get('is_deleted'))
+    else:
+        context["notion_project"] = create_notion_project(notion_client, project)
+    return context
+
+
+def record_todoist_project(unit_of_work, identity_map, context):
+    project = context["project"]
+    project_id = project.get('id')
+    project_name = project.get("name")
+    notion_project = context["notion_project"]
+    todoist_url = f"https://todoist.com/showProject?id={project_id}"
     current_date = datetime.now(timezone.utc).astimezone(timezone(timedelta(hours=8)))
-    project_db_last_modified = db_manager.fetch_one("SELECT MAX(updated_at) FROM projects WHERE deleted IS FALSE")
-    project_db_last_modified = project_db_last_modified[0] if project_db_last_modified else None
-    if project_db_last_modified == None:
-        logger.info(f"Database not set, start initial syncing")
-        for project in todoist_projects:
-                logger.info(f"Project: {project}")
-                if not isinstance(project, dict):
-                    logger.error(f"Expected project to be a dictionary but got {type(project)}: {project}")
-                    continue
+    if context["notion_project_id"]:
+        unit_of_work.upsert_project((None, project_name, project_id, context["notion_project_id"], todoist_url, notion_project['url'], None, current_date, notion_project['created_time'], notion_project['last_edited_time'], project.get('is_deleted'),project.get('is_archived')))
+        unit_of_work.set_sync_hash("projects", project_id, context["sync_hash"])
+        identity_map.put_project(project_id, notion_id=context["notion_project_id"], name=project_name, updated_at=current_date, sync_hash=context["sync_hash"])
+        logger.info("Project updated in Notion: %s (Todoist ID: %s, Notion ID: %s)", project_name, project_id, context['notion_project_id'])
+    else:
+        notion_url = notion_project.get('url')
+        unit_of_work.upsert_project((None, project_name, project_id, notion_project['id'], todoist_url, notion_url, current_date, current_date, notion_project['created_time'], notion_project['created_time'], project.get('is_deleted'),project.get('is_archived')))
+        unit_of_work.set_sync_hash("projects", project_id, context["sync_hash"])
+        identity_map.put_project(project_id, notion_id=notion_project['id'], name=project_name, updated_at=current_date, sync_hash=context["sync_hash"])
+        logger.info("Project synced to Notion: %s (Todoist ID: %s, Notion ID: %s)", project_name, project_id, notion_project['id'])
+
+
+def sync_todoist_projects_to_notion(todoist_projects=None):
+    db_manager = services.db_manager
+    todoist_client = services.new_todoist_client()
+    notion_client = services.notion_client
 
-                logger.info(f"Processing project: {project.get('name')}")  # 打印调试信息
-                project_id = project.get('id')
-                project_name = project.get("name")
-                update_notion_project = create_notion_project(notion_client, project)
-                notion_url = update_notion_project.get('url')
-                todoist_url = f"https://todoist.com/showProject?id={project_id}"
-                insert_project_query = get_insert_project_query(db_manager.db_type)
-                db_manager.execute_query(insert_project_query, (None, project_name, project_id, update_notion_project['id'], todoist_url, notion_url, current_date, current_date, update_notion_project['created_time'], update_notion_project['created_time'], project.get('is_deleted'),project.get('is_archived')))
-                logger.info(f"Project synced to Notion: {project_name} (Todoist ID: {project_id}, Notion ID: {update_notion_project['id']})")
-        db_manager.update_sync_token("projects", new_project_sync_token)
+    identity_map = services.identity_map
+
+    if todoist_projects is None:
+        todoist_projects, new_project_sync_token = fetch_todoist_projects(db_manager, todoist_client)
     else:
+        # 来自 webhook 的项目，不推进 sync token
+        new_project_sync_token = None
+    processed = 0
+    with db_manager.unit_of_work() as unit_of_work:
         for project in todoist_projects:
-            logger.debug(f"Project: {project}")
-            if not isinstance(project, dict):
-                logger.error(f"Expected project to be a dictionary but got {type(project)}: {project}")
-                continue
-            logger.info(f"Processing project: {project.get('name')}")  # 打印调试信息
-            project_id = project.get('id')
-            project_name = project.get("name")
-            todoist_url = f"https://todoist.com/showProject?id={project_id}"
-            if not all([project_id, project_name]):
-                logger.error(f"Project data missing required fields: {project}")
+            try:
+                context = prepare_todoist_project(identity_map, project)
+                if context is None:
+                    continue
+                push_todoist_project(notion_client, context)
+                record_todoist_project(unit_of_work, identity_map, context)
+                processed += 1
+            except Exception as e:
+                logger.error("Error processing project %s: %s", project.get('id') if isinstance(project, dict) else project, e)
                 continue
 
-            notion_project_id = db_manager.fetch_one("SELECT notion_id FROM projects WHERE todoist_id = ?", (project_id,))
-            notion_project_id = notion_project_id[0] if notion_project_id else None
-            current_date = datetime.now(timezone.utc).astimezone(timezone(timedelta(hours=8)))
-
-            if notion_project_id:
-                logger.info(f"Notion project exists, updating...")
-                update_notion_project = notion_client.update_project(notion_project_id, notion_project_property(project), project.get('is_deleted'))
-                update_project_query = get_update_project_query(db_manager.db_type)
-                db_manager.execute_query(update_project_query, (None, project_name, project_id, notion_project_id, todoist_url, update_notion_project['url'], None, None, update_notion_project['created_time'], update_notion_project['last_edited_time'], project.get('is_deleted'),project.get('is_archived')))
-                logger.info(f"Project updated in Notion: {project_name} (Todoist ID: {project_id}, Notion ID: {notion_project_id})")
-                db_manager.update_sync_token("projects", new_project_sync_token)
-            else:
-                update_notion_project = create_notion_project(notion_client, project)
-                notion_url = update_notion_project.get('url')
-                todoist_url = f"https://todoist.com/showProject?id={project_id}"
-                insert_project_query = get_insert_project_query(db_manager.db_type)
-                db_manager.execute_query(insert_project_query, (None, project_name, project_id, update_notion_project['id'], todoist_url, notion_url, current_date, current_date, update_notion_project['created_time'], update_notion_project['created_time'], project.get('is_deleted'),project.get('is_archived')))
-                logger.info(f"Project synced to Notion: {project_name} (Todoist ID: {project_id}, Notion ID: {update_notion_project['id']})")
-                db_manager.update_sync_token("projects", new_project_sync_token)
-
-        db_manager.close_connection()
+        if new_project_sync_token:
+            unit_of_work.update_sync_token("projects", new_project_sync_token)
+    return processed
+
+
+async def sync_todoist_projects_to_notion_async(todoist_projects=None, concurrency=SYNC_CONCURRENCY):
+    """Asyncio variant of sync_todoist_projects_to_notion; Notion writes run concurrently, DB access stays on the loop thread."""
+    db_manager = services.db_manager
+    todoist_client = services.new_todoist_client()
+    notion_client = services.notion_client
+    semaphore = asyncio.Semaphore(concurrency)
+    identity_map = services.identity_map
+
+    if todoist_projects is None:
+        todoist_projects, new_project_sync_token = await asyncio.to_thread(fetch_todoist_projects, db_manager, todoist_client)
+    else:
+        # 来自 webhook 的项目，不推进 sync token
+        new_project_sync_token = None
+    unit_of_work = db_manager.unit_of_work()
+
+    async def run_pipeline(project):
+        async with semaphore:
+            try:
+                context = prepare_todoist_project(identity_map, project)
+                if context is None:
+                    return 0
+                await asyncio.to_thread(push_todoist_project, notion_client, context)
+                record_todoist_project(unit_of_work, identity_map, context)
+                return 1
+            except Exception as e:
+                logger.error("Error processing project %s: %s", project.get('id') if isinstance(project, dict) else project, e)
+                return 0
+
+    with unit_of_work:
+        results = await asyncio.gather(*(run_pipeline(project) for project in todoist_projects))
+        if new_project_sync_token:
+            unit_of_work.update_sync_token("projects", new_project_sync_token)
+    return sum(results)
+
+
+def queue_todoist_project_creation(unit_of_work, identity_map, command_queue, project, current_date):
+    properties = project.get('properties', {})
+    todoist_id = next((prop['text']['content'] for prop in properties.get('TodoistID', {}).get('rich_text', [])), None)
+    project_name = properties.get('Name', {}).get('title', [{}])[0].get('text', {}).get('content', '')
+    todoist_project_data = {
+        "name": project_name,
+        "id": todoist_id,
+
+    }
+
+    def record_creation(todoist_project_id):
+        logger.info("Project created in todoist: %s (Todoist ID: %s), Notion ID:%s", project_name, todoist_project_id, project['id'])
+        notion_url = project.get('url')
+        todoist_url = f"https://todoist.com/showProject?id={todoist_project_id}"
+        unit_of_work.upsert_project((
+                None, project_name, todoist_project_id, project.get('id'), todoist_url, notion_url,
+                project.get('created_time'), current_date, project.get('created_time'), project.get('last_edited_time'), project.get('archived'),properties.get('Archived', {}).get('checkbox')
+        ))
+        sync_hash = notion_project_hash(project)
+        unit_of_work.set_sync_hash("projects", todoist_project_id, sync_hash)
+        identity_map.put_project(todoist_project_id, notion_id=project.get('id'), name=project_name, updated_at=current_date, sync_hash=sync_hash)
+        logger.info("Project synced to Todoist: %s (Todoist ID: %s, Notion ID: %s)", project_name, todoist_project_id, project.get('id'))
+
+    command_queue.add("project_add", todoist_project_data, temp_id=str(uuid.uuid4()), on_success=record_creation)
 
-    
 
 def sync_notion_projects_to_todoist():
-    db_manager = DatabaseManager(DB_TYPE, DB_PATH)
-    notion_client = NotionClient(NOTION_TOKEN)
-    todoist_client = TodoistSyncClient(TODOIST_TOKEN,DB_TYPE, DB_PATH)
+    db_manager = services.db_manager
+    notion_client = services.notion_client
+    todoist_client = services.new_todoist_client()
     filter = {
             "and":[{
                 "property": "Archived",
@@ -154,17 +237,23 @@ def sync_notion_projects_to_todoist():
     if confirm_notion_inbox:
         notion_inbox_id = confirm_notion_inbox[0]
     else:
-        logger.info(f"Inbox project not found in database or in Notion, start creating")
+        logger.info("Inbox project not found in database or in Notion, start creating")
         todoist_inbox = next((project for project in todoist_client.get_projects("*")['projects'] if project['inbox_project']), None)
-        logger.info(f"Todoist inbox: {todoist_inbox}")
+        logger.info("Todoist inbox: %s", payload(todoist_inbox))
         todoist_inbox_id = todoist_inbox['id']
         notion_client.create_project(notion_project_property(todoist_inbox))
 
+    project_db_last_modified = db_manager.fetch_one("SELECT MAX(updated_at) FROM projects WHERE deleted IS FALSE")
+    cursor = db_manager.get_notion_cursor(notion_client.project_database_id) if project_db_last_modified and project_db_last_modified[0] else None
+    cursor_filter = notion_last_edited_filter(cursor, NOTION_CURSOR_OVERLAP)
+    if cursor_filter:
+        filter["and"].append(cursor_filter)
+    logger.info("Notion project cursor: %s", cursor)
     notion_projects = notion_client.get_projects(filter)
-    logger.debug(f"Notion projects: {notion_projects}")
+    logger.debug("Notion projects: %s", payload(notion_projects))
     current_date = datetime.now(timezone.utc).astimezone(timezone(timedelta(hours=8)))
     valid_projects = [project for project in notion_projects.get("results", []) if project.get('last_edited_time') is not None]
-    logger.debug(f"Valid projects: {valid_projects}")
+    logger.debug("Valid projects: %s", payload(valid_projects))
     notion_projects = notion_projects['results']    
     if valid_projects:
         project_last_modified = max(valid_projects, key=lambda x: x['last_edited_time'])['last_edited_time']
@@ -173,79 +262,63 @@ def sync_notion_projects_to_todoist():
     project_db_last_modified = db_manager.fetch_one("SELECT MAX(updated_at) FROM projects WHERE deleted IS FALSE")
     project_db_last_modified = project_db_last_modified[0] if project_db_last_modified else None
 
+    command_queue = todoist_client.command_queue("projects")
+    identity_map = services.identity_map
+    unit_of_work = db_manager.unit_of_work()
     if project_db_last_modified == None:
-        logger.info(f"Database not set, start initial syncing")
+        logger.info("Database not set, start initial syncing")
         for project in notion_projects:
-            properties = project['properties']
-            todoist_id = next((prop['text']['content'] for prop in properties.get('TodoistID', {}).get('rich_text', [])), None)
-            project_name = properties.get('Name', {}).get('title', [{}])[0].get('text', {}).get('content', '')
-            project_created = project.get('created_time')
-            project_modified = project.get('last_edited_time')
-            temp_id = str(uuid.uuid4())
-            todoist_project_data = {
-                "name": properties.get('Name', {}).get('title', [{}])[0].get('text', {}).get('content', ''),
-                "id": todoist_id,
-
-            }
-            temp_id_mapping = todoist_client.create_project(todoist_project_data, temp_id)['temp_id_mapping']
-            logger.debug(f"temp_id_mapping: {temp_id_mapping}")
-            todoist_project_id = temp_id_mapping[temp_id]
-            logger.info(f"Project created in todoist: {project_name} (Todoist ID: {todoist_project_id}), Notion ID:{project['id']}")
-            notion_url = project.get('url')
-            todoist_url = f"https://todoist.com/showProject?id={todoist_project_id}"
-            insert_project_query = get_insert_project_query(db_manager.db_type)
-            db_manager.execute_query(insert_project_query, (
-                    None, project_name, project.get('id'), project.get('id'), todoist_url, notion_url, 
-                    project.get('created_time'), current_date, project.get('created_time'), project.get('last_edited_time'), project.get('archived'),properties.get('Archived', {}).get('checkbox')
-            ))
-            logger.info(f"Project synced to Notion: {project_name} (Todoist ID: {todoist_project_id}, Notion ID: {project.get('id')})")
+            queue_todoist_project_creation(unit_of_work, identity_map, command_queue, project, current_date)
     else:
-        logger.info(f"Comparing DB modified time: {project_db_last_modified} and Notion Project DB modified time: {project_last_modified}")
+        logger.info("Comparing DB modified time: %s and Notion Project DB modified time: %s", project_db_last_modified, project_last_modified)
         if iso_to_timestamp(str(project_last_modified)) > iso_to_timestamp(str(project_db_last_modified)):
-            logger.info(f"Notion Project modified time {project_last_modified} is later than DB modified time {project_db_last_modified}, time difference: {abs(iso_to_timestamp(str(project_last_modified)) - iso_to_timestamp(str(project_db_last_modified)))}")
+            logger.info("Notion Project modified time %s is later than DB modified time %s, time difference: %s", project_last_modified, project_db_last_modified, abs(iso_to_timestamp(str(project_last_modified)) - iso_to_timestamp(str(project_db_last_modified))))
             for project in valid_projects:
-                logger.debug(f"Project: {project}")
+                logger.debug("Project: %s", payload(project))
                 properties = project.get('properties', {})
                 todoist_id = next((prop['text']['content'] for prop in properties.get('TodoistID', {}).get('rich_text', [])), None)
                 project_name = properties.get('Name', {}).get('title', [{}])[0].get('text', {}).get('content', '')
-                project_created = project.get('created_time')
                 project_modified = project.get('last_edited_time')
                 todoist_url = f"https://todoist.com/showProject?id={todoist_id}"
-                db_todoist_id = db_manager.fetch_one("SELECT todoist_id FROM projects WHERE notion_id = ?", (project['id'],))
+                db_todoist_id = (identity_map.get_project_by_notion_id(project['id']) or {}).get("todoist_id")
                 todoist_project_data = {
-                    "name": properties.get('Name', {}).get('title', [{}])[0].get('text', {}).get('content', ''),
+                    "name": project_name,
                     "id": todoist_id,
 
                 }
-                modified = db_manager.fetch_one("SELECT updated_at FROM projects WHERE todoist_id = ?", (todoist_id,))
+                project_row = identity_map.get_project(todoist_id) or {}
+                modified = project_row.get("updated_at")
                 if todoist_id and db_todoist_id:
-                    if iso_to_timestamp(str(project_modified)) > iso_to_timestamp(str(modified[0])):
-                        logger.info(f"Comparing project_modified: {project_modified} and modified: {modified[0]}")
-                        logger.info(f"Notion project modified time {datetime.fromtimestamp(iso_to_timestamp(str(project_modified)))} is later than database modified time {datetime.fromtimestamp(iso_to_timestamp(str(modified[0])))}, time difference: {abs(iso_to_timestamp(str(project_modified)) - iso_to_timestamp(str(modified[0])))}")
-                        todoist_client.update_project(todoist_id, todoist_project_data)
-                        logger.info(f"Project updated in Todoist: {project_name} (Todoist ID: {todoist_id}, Notion ID: {project['id']})")
-                        update_project_query = get_update_project_query(db_manager.db_type)
-                        db_manager.execute_query(update_project_query, (None, project_name, todoist_id, project['id'], todoist_url, project.get("url"), project_modified, None, None, project_modified, project.get('archived'),properties.get('Archived', {}).get('checkbox')))
+                    if notion_project_hash(project) == project_row.get("sync_hash"):
+                        logger.info("Notion project %s edited but synced fields unchanged, skipping Todoist update", project_name)
+                        sync_stats.increment("skipped_writes.todoist_project")
+                    elif modified and iso_to_timestamp(str(project_modified)) > iso_to_timestamp(str(modified)):
+                        logger.info("Notion project modified time %s is later than database modified time %s, time difference: %s", datetime.fromtimestamp(iso_to_timestamp(str(project_modified))), datetime.fromtimestamp(iso_to_timestamp(str(modified))), abs(iso_to_timestamp(str(project_modified)) - iso_to_timestamp(str(modified))))
+                        update_row = (None, project_name, todoist_id, project['id'], todoist_url, project.get("url"), project.get('created_time'), project_modified, project.get('created_time'), project_modified, project.get('archived'),properties.get('Archived', {}).get('checkbox'))
+
+                        def record_update(real_id, update_row=update_row, project_name=project_name, project=project, project_modified=project_modified):
+                            logger.info("Project updated in Todoist: %s (Todoist ID: %s, Notion ID: %s)", project_name, real_id, project['id'])
+                            unit_of_work.upsert_project(update_row)
+                            sync_hash = notion_project_hash(project)
+                            unit_of_work.set_sync_hash("projects", real_id, sync_hash)
+                            identity_map.put_project(real_id, notion_id=project['id'], name=project_name, updated_at=project_modified, sync_hash=sync_hash)
+
+                        command_queue.add("project_update", todoist_project_data, on_success=record_update)
                 elif not db_todoist_id:
-                    logger.info(f"Project not in todoist, creating...")
-                    temp_id = str(uuid.uuid4())
-                    temp_id_mapping = todoist_client.create_project(todoist_project_data, temp_id)['temp_id_mapping']
-                    logger.debug(f"temp_id_mapping: {temp_id_mapping}")
-                    todoist_project_id = temp_id_mapping[temp_id]
-                    logger.info(f"Project created in todoist: {project_name} (Todoist ID: {todoist_project_id}), Notion ID:{project['id']}")
-                    notion_url = project.get('url')
-                    todoist_url = f"https://todoist.com/showProject?id={todoist_project_id}"
-                    insert_project_query = get_insert_project_query(db_manager.db_type)
-                    db_manager.execute_query(insert_project_query, (
-                            None, project_name, todoist_project_id, project.get('id'), todoist_url, notion_url, 
-                            project.get('created_time'), current_date, project.get('created_time'), project.get('last_edited_time'), project.get('archived'),properties.get('Archived', {}).get('checkbox')
-                    ))
-                    logger.info(f"Project synced to Todoist: {project_name} (Todoist ID: {todoist_project_id}, Notion ID: {project.get('id')})")
+                    logger.info("Project not in todoist, queueing creation...")
+                    queue_todoist_project_creation(unit_of_work, identity_map, command_queue, project, current_date)
         else:
-            logger.info(f"Notion Project modified time {project_last_modified} is earlier than DB modified time {project_db_last_modified}, time difference: {abs(iso_to_timestamp(str(project_last_modified)) - iso_to_timestamp(str(project_db_last_modified)))} seconds")
+            logger.info("Notion Project modified time %s is earlier than DB modified time %s, time difference: %s seconds", project_last_modified, project_db_last_modified, abs(iso_to_timestamp(str(project_last_modified)) - iso_to_timestamp(str(project_db_last_modified))))
 
-    db_manager.close_connection()
-    
+    queued = len(command_queue)
+    with unit_of_work:
+        result = command_queue.flush()
+        logger.info("Flushed %s Todoist project commands, %s failed", queued, len(result['failed']))
+        new_cursor = next_notion_cursor(cursor, [project_last_modified], [])
+        if new_cursor and not result['failed']:
+            unit_of_work.update_notion_cursor(notion_client.project_database_id, new_cursor)
+            logger.info("Notion project cursor advanced to: %s", new_cursor)
+    return queued
 
 
 if __name__ == "__main__":
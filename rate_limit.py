@@ -0,0 +1,290 @@
+import os
+import re
+import time
+import random
+import threading
+import requests
+from logger import logger
+from sync_stats import sync_stats
+from metrics import metrics
+from tracing import span
+from urllib.parse import urlparse
+
+# Notion 文档限速: 平均每秒 3 个请求
+NOTION_RATE_PER_SEC = float(os.getenv("NOTION_RATE_PER_SEC", "3"))
+NOTION_BURST = int(os.getenv("NOTION_BURST", "3"))
+# Todoist 文档限速: 每 15 分钟 1000 个请求
+TODOIST_RATE_PER_SEC = float(os.getenv("TODOIST_RATE_PER_SEC", str(1000 / 900)))
+TODOIST_BURST = int(os.getenv("TODOIST_BURST", "20"))
+KIMAI_RATE_PER_SEC = float(os.getenv("KIMAI_RATE_PER_SEC", "10"))
+KIMAI_BURST = int(os.getenv("KIMAI_BURST", "10"))
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "5"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "60"))
+# 连续失败达到阈值后熔断，冷却期内直接失败，之后放行一次试探请求
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "60"))
+
+RETRYABLE_STATUSES = {409, 429, 500, 502, 503, 504}
+# 请求还没到达服务端的连接阶段错误 (requests/urllib3/httpx)，非幂等请求也可以安全重发
+CONNECT_ERRORS = {"ConnectTimeout", "ConnectTimeoutError", "NewConnectionError", "NameResolutionError", "ConnectError"}
+# 指标里把路径中的 ID 归一成 {id}，避免每个页面/任务各占一条时间序列
+ID_SEGMENT = re.compile(r"^(?:[0-9a-fA-F-]{32,36}|\d+|[0-9a-zA-Z]{16})$")
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class TokenBucket:
+    """Paces calls to ``rate`` per second on average, allowing bursts of ``capacity``."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Drain the bucket so nobody sends for ``seconds`` (used for Retry-After)."""
+        with self.lock:
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.reset_timeout or self.trial_in_flight:
+                raise CircuitOpenError(f"{self.name} circuit is open after {self.failures} consecutive failures")
+            # 冷却结束，放行一次试探请求 (half-open)
+            self.trial_in_flight = True
+
+    def record_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                logger.info("%s circuit closed", self.name)
+                metrics.set("api_circuit_open", 0, api=self.name)
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.error("%s circuit opened after %s consecutive failures", self.name, self.failures)
+                    sync_stats.increment(f"circuit_opened.{self.name}")
+                self.opened_at = time.monotonic()
+                metrics.set("api_circuit_open", 1, api=self.name)
+
+
+def parse_retry_after(headers):
+    value = (headers or {}).get("Retry-After") or (headers or {}).get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        return None
+
+
+def normalize_path(path):
+    segments = [segment for segment in urlparse(str(path)).path.split("/") if segment]
+    return "/" + "/".join("{id}" if ID_SEGMENT.match(segment) else segment for segment in segments)
+
+
+def notion_endpoint(args, kwargs):
+    """Label for ``notion_client.Client.request(path, method, ...)``."""
+    path = kwargs.get("path", args[0] if args else "")
+    method = kwargs.get("method", args[1] if len(args) > 1 else "")
+    return f"{str(method).upper()} {normalize_path(path)}"
+
+
+def notion_idempotent(args, kwargs):
+    """Notion POSTs create objects, except database queries and search, which only read."""
+    path = normalize_path(kwargs.get("path", args[0] if args else ""))
+    method = str(kwargs.get("method", args[1] if len(args) > 1 else "")).upper()
+    return method != "POST" or path.endswith("/query") or path == "/search"
+
+
+def http_method_idempotent(args, kwargs):
+    """For ``requests.Session.request(method, url, ...)``: everything but POST."""
+    return str(kwargs.get("method", args[0] if args else "")).upper() != "POST"
+
+
+def http_endpoint(args, kwargs):
+    """Label for ``requests.Session.post(url, ...)``."""
+    return f"POST {normalize_path(kwargs.get('url', args[0] if args else ''))}"
+
+
+def http_method_endpoint(args, kwargs):
+    """Label for ``requests.Session.request(method, url, ...)``."""
+    method = kwargs.get("method", args[0] if args else "")
+    url = kwargs.get("url", args[1] if len(args) > 1 else "")
+    return f"{str(method).upper()} {normalize_path(url)}"
+
+
+def failure_label(result=None, error=None):
+    """Status code or exception name of a failed attempt, None for a success."""
+    if error is not None:
+        response = getattr(error, "response", None)
+        status = getattr(error, "status", None) or getattr(response, "status_code", None)
+        return str(status) if status is not None else type(error).__name__
+    status = getattr(result, "status_code", None)
+    if status is not None and status >= 400:
+        return str(status)
+    return None
+
+
+def classify(result=None, error=None):
+    """Return (retryable, retry_after) for a response or an exception."""
+    if error is not None:
+        if isinstance(error, CircuitOpenError):
+            return False, None
+        if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+            return True, None
+        # notion_client 的 APIResponseError 带 status/headers，requests 的 HTTPError 带 response
+        response = getattr(error, "response", None)
+        status = getattr(error, "status", None) or getattr(response, "status_code", None)
+        headers = getattr(error, "headers", None) or getattr(response, "headers", None)
+        if status is None:
+            # notion_client 超时等没有状态码的网络错误
+            return type(error).__name__ in ("RequestTimeoutError", "TimeoutException", "ConnectError"), None
+        return status in RETRYABLE_STATUSES, parse_retry_after(headers)
+    status = getattr(result, "status_code", None)
+    if status in RETRYABLE_STATUSES:
+        return True, parse_retry_after(result.headers)
+    return False, None
+
+
+def is_connect_error(error):
+    """True when the request failed while connecting, so the server cannot have processed it."""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        # requests 把 urllib3 的 MaxRetryError 放在 args[0]，真正的原因在它的 reason 里
+        reason = getattr(error.args[0], "reason", None) if error.args else None
+        for candidate in (error, reason):
+            if candidate is not None and any(cls.__name__ in CONNECT_ERRORS for cls in type(candidate).__mro__):
+                return True
+        # notion_client 把 httpx 的超时包装成 RequestTimeoutError，原始异常在 __context__ 中
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def safe_to_resend(result=None, error=None):
+    """Whether a failed non-idempotent request may be sent again: 429, or a connect-phase failure."""
+    if error is not None:
+        status = getattr(error, "status", None) or getattr(getattr(error, "response", None), "status_code", None)
+        return status == 429 or is_connect_error(error)
+    return getattr(result, "status_code", None) == 429
+
+
+class RateLimiter:
+    """Token-bucket pacing, retries with Retry-After and jittered backoff, and a circuit breaker for one API.
+
+    Retryable failures (429, 409 conflicts, 5xx, timeouts, connection errors) are
+    retried up to ``max_attempts`` times and count towards the breaker; anything
+    else is raised or returned to the caller straight away. Calls that
+    ``idempotent`` reports as unsafe to repeat are only retried after a 429 or a
+    connect-phase failure, since the server may already have applied them.
+    """
+
+    def __init__(self, name, rate, burst, endpoint=None, idempotent=None, max_attempts=RETRY_MAX_ATTEMPTS, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY):
+        self.name = name
+        self.endpoint = endpoint
+        self.idempotent = idempotent
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(name)
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt, retry_after=None):
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def call(self, func, *args, **kwargs):
+        endpoint = self.endpoint(args, kwargs) if self.endpoint else getattr(func, "__name__", "call")
+        idempotent = self.idempotent(args, kwargs) if self.idempotent else True
+        for attempt in range(self.max_attempts):
+            self.breaker.before_call()
+            with span(f"{self.name}.rate_limit_wait"):
+                self.bucket.acquire()
+            started = time.perf_counter()
+            try:
+                with span(f"{self.name} {endpoint}", attempt=attempt):
+                    result = func(*args, **kwargs)
+                error = None
+            except Exception as e:
+                result, error = None, e
+            self.record(endpoint, time.perf_counter() - started, result, error)
+            retryable, retry_after = classify(result, error)
+            if not retryable:
+                self.breaker.record_success()
+                if error is not None:
+                    raise error
+                return result
+            self.breaker.record_failure()
+            if attempt == self.max_attempts - 1:
+                break
+            if not idempotent and not safe_to_resend(result, error):
+                sync_stats.increment(f"api_unsafe_retries_skipped.{self.name}")
+                logger.warning("%s %s failed (%s) after it may have been applied, not retrying", self.name, endpoint, error or getattr(result, 'status_code', None))
+                break
+            delay = self.backoff(attempt, retry_after)
+            if retry_after is not None:
+                self.bucket.pause(retry_after)
+            sync_stats.increment(f"api_retries.{self.name}")
+            logger.warning("%s request failed (%s), retry %s/%s in %.1fs", self.name, error or getattr(result, 'status_code', None), attempt + 1, self.max_attempts - 1, delay)
+            time.sleep(delay)
+        if error is not None:
+            raise error
+        return result
+
+    def record(self, endpoint, elapsed, result, error):
+        metrics.observe("api_request_duration_seconds", elapsed, api=self.name, endpoint=endpoint)
+        metrics.increment("api_requests_total", api=self.name, endpoint=endpoint)
+        failure = failure_label(result, error)
+        if failure is not None:
+            metrics.increment("api_errors_total", api=self.name, endpoint=endpoint, status=failure)
+
+    def wrap(self, func):
+        def wrapper(*args, **kwargs):
+            return self.call(func, *args, **kwargs)
+        wrapper.__wrapped__ = func
+        return wrapper
+
+
+notion_limiter = RateLimiter("notion", NOTION_RATE_PER_SEC, NOTION_BURST, notion_endpoint, notion_idempotent)
+# Todoist /sync 的命令带 uuid，服务端按 uuid 去重，重发是安全的
+todoist_limiter = RateLimiter("todoist", TODOIST_RATE_PER_SEC, TODOIST_BURST, http_endpoint)
+kimai_limiter = RateLimiter("kimai", KIMAI_RATE_PER_SEC, KIMAI_BURST, http_method_endpoint, http_method_idempotent)
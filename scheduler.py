@@ -0,0 +1,131 @@
+import os
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from logger import logger
+from metrics import metrics
+from tracing import tracer, span
+
+# 有变更时回到最短间隔，空闲时按倍数退避到最长间隔
+POLL_INTERVAL = int(os.getenv("POLL_INTERVAL", "60"))
+POLL_MAX_INTERVAL = int(os.getenv("POLL_MAX_INTERVAL", "900"))
+PROJECT_POLL_MAX_INTERVAL = int(os.getenv("PROJECT_POLL_MAX_INTERVAL", "3600"))
+POLL_BACKOFF = float(os.getenv("POLL_BACKOFF", "2"))
+POLL_JITTER = float(os.getenv("POLL_JITTER", "0.1"))
+# 流水线模式: 项目同步完成后，同时到期的任务两个方向并行执行 (任务写入有实体锁保护)
+SYNC_PIPELINE = os.getenv("SYNC_PIPELINE", "false").lower() == "true"
+
+
+class ScheduledResource:
+    """One polled resource with its own adaptive interval.
+
+    ``job`` returns the number of changes it handled. Any activity snaps the
+    interval back to ``min_interval``; an idle run or an error multiplies it by
+    ``backoff`` up to ``max_interval``. Each run is spread by +/- ``jitter``.
+    Resources of a lower ``stage`` run before those of a higher one. Only
+    ``concurrent`` resources may run alongside each other; their jobs must guard
+    shared entities themselves.
+    """
+
+    def __init__(self, name, job, min_interval=POLL_INTERVAL, max_interval=POLL_MAX_INTERVAL, backoff=POLL_BACKOFF, jitter=POLL_JITTER, stage=0, concurrent=False):
+        self.name = name
+        self.stage = stage
+        self.concurrent = concurrent
+        self.job = job
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.backoff = backoff
+        self.jitter = jitter
+        self.interval = min_interval
+        self.next_run = 0.0
+        self.last_activity = None
+
+    def due(self, now):
+        return now >= self.next_run
+
+    def record(self, activity, now):
+        self.last_activity = activity
+        if activity:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+        self.next_run = now + self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def run(self):
+        started = time.perf_counter()
+        try:
+            with span(f"phase.{self.name}"):
+                activity = self.job() or 0
+        except Exception as e:
+            logger.error("%s 同步出错: %s", self.name, e)
+            metrics.increment("sync_phase_errors_total", phase=self.name)
+            activity = 0
+        metrics.observe("sync_phase_duration_seconds", time.perf_counter() - started, phase=self.name)
+        metrics.increment("sync_entities_processed_total", activity, phase=self.name)
+        metrics.set("sync_entities_last_cycle", activity, phase=self.name)
+        self.record(activity, time.monotonic())
+        return activity
+
+
+class AdaptiveScheduler:
+    """Runs due resources stage by stage and sleeps until the next one is due.
+
+    Projects sit in an earlier stage than tasks, so that when both are due in the
+    same tick new projects exist before tasks reference them. Within a stage,
+    due resources run in declaration order; when ``parallel`` is set, the due
+    ``concurrent`` ones of a stage run together on worker threads.
+    ``lock`` is held for every tick so other writers (webhooks) never overlap.
+    """
+
+    def __init__(self, resources, lock=None, on_tick=None, parallel=SYNC_PIPELINE):
+        self.resources = resources
+        self.lock = lock or threading.Lock()
+        self.on_tick = on_tick
+        self.parallel = parallel
+        self.stop_event = threading.Event()
+
+    def run_stage(self, resources):
+        concurrent = [resource for resource in resources if resource.concurrent] if self.parallel else []
+        if len(concurrent) < 2:
+            concurrent = []
+        activities = {resource.name: resource.run() for resource in resources if resource not in concurrent}
+        if concurrent:
+            with ThreadPoolExecutor(max_workers=len(concurrent), thread_name_prefix="sync") as executor:
+                activities.update(zip([resource.name for resource in concurrent], executor.map(lambda resource: resource.run(), concurrent)))
+        for resource in resources:
+            activity = activities[resource.name]
+            logger.info("%s: %s changes, next interval %.0fs", resource.name, activity, resource.interval)
+
+    def tick(self):
+        now = time.monotonic()
+        due = [resource for resource in self.resources if resource.due(now)]
+        if not due:
+            return
+        with self.lock:
+            tracer.begin_cycle()
+            try:
+                for stage in sorted(set(resource.stage for resource in due)):
+                    with span(f"stage.{stage}"):
+                        self.run_stage([resource for resource in due if resource.stage == stage])
+            finally:
+                tracer.end_cycle()
+        if self.on_tick:
+            self.on_tick()
+        self.log_schedule()
+
+    def log_schedule(self):
+        now = time.monotonic()
+        schedule = ", ".join(f"{resource.name} in {max(resource.next_run - now, 0):.0f}s" for resource in self.resources)
+        logger.info("下次同步计划: %s", schedule)
+
+    def seconds_until_next(self):
+        return max(min(resource.next_run for resource in self.resources) - time.monotonic(), 0)
+
+    def run_forever(self):
+        while not self.stop_event.is_set():
+            self.tick()
+            self.stop_event.wait(self.seconds_until_next())
+
+    def stop(self):
+        self.stop_event.set()
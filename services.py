@@ -0,0 +1,56 @@
+import os
+import threading
+
+
+class Services:
+    """Process-wide clients and DB handles, each built on first access.
+
+    Importing this module (or any sync module) opens no connection, runs no DDL
+    and needs no credentials. The client modules are imported, and tokens read,
+    inside the accessors for the same reason (api_client runs load_dotenv).
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.instances = {}
+
+    def _get(self, name, factory):
+        instance = self.instances.get(name)
+        if instance is None:
+            with self.lock:
+                instance = self.instances.get(name)
+                if instance is None:
+                    instance = self.instances[name] = factory()
+        return instance
+
+    @property
+    def db_manager(self):
+        from db_operations import get_db_manager
+        return self._get("db_manager", get_db_manager)
+
+    @property
+    def identity_map(self):
+        from identity_map import get_identity_map
+        return self._get("identity_map", lambda: get_identity_map(self.db_manager))
+
+    @property
+    def notion_client(self):
+        from api_client import NotionClient
+        return self._get("notion_client", lambda: NotionClient(os.getenv("NOTION_TOKEN")))
+
+    @property
+    def kimai_client(self):
+        from api_client import KimaiClient
+        return self._get("kimai_client", lambda: KimaiClient(os.getenv("KIMAI_TOKEN")))
+
+    def new_todoist_client(self):
+        """A fresh Todoist client per sync run; its item/note cache only holds that run's /sync responses."""
+        from api_client import TodoistSyncClient
+        return TodoistSyncClient(os.getenv("TODOIST_TOKEN"), db_manager=self.db_manager)
+
+    def reset(self):
+        with self.lock:
+            self.instances.clear()
+
+
+services = Services()
@@ -166,6 +166,34 @@ def get_update_project_query(db_type):
         WHERE id = ?
         """
 
+def get_update_project_by_todoist_id_query(db_type):
+    if db_type == "mysql":
+        return """
+        UPDATE projects SET name = %s, notion_id = %s, todoist_url = %s, notion_url = %s, updated_at = %s, notion_created = %s, notion_modified = %s, deleted = %s, archived = %s
+        WHERE todoist_id = %s
+        """
+    else:
+        return """
+        UPDATE projects SET name = ?, notion_id = ?, todoist_url = ?, notion_url = ?, updated_at = ?, notion_created = ?, notion_modified = ?, deleted = ?, archived = ?
+        WHERE todoist_id = ?
+        """
+
+def get_update_sync_hash_query(db_type, table):
+    # tasks 同时保存字段快照和我们自己写入产生的修改时间；时间为空时保留原值
+    if table == "tasks":
+        columns = "sync_hash = ?, sync_snapshot = ?, notion_written_at = COALESCE(?, notion_written_at), todoist_written_at = COALESCE(?, todoist_written_at)"
+    else:
+        columns = "sync_hash = ?"
+    if db_type == "mysql":
+        columns = columns.replace("?", "%s")
+        return f"""
+        UPDATE {table} SET {columns} WHERE todoist_id = %s
+        """
+    else:
+        return f"""
+        UPDATE {table} SET {columns} WHERE todoist_id = ?
+        """
+
 def get_sync_token_query(db_type):
     if db_type == "mysql":
         return """
@@ -194,4 +222,60 @@ def get_update_count_query(db_type):
     else:
         return """
         UPDATE count SET count = ? WHERE type = ?
-        """
\ No newline at end of file
+        """
+
+def get_create_schema_version_table_sql(db_type):
+    if db_type == "mysql":
+        return """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INT PRIMARY KEY,
+            description TEXT,
+            applied_at DATETIME
+        );
+        """
+    else:
+        return """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at DATETIME
+        );
+        """
+
+def get_schema_version_query(db_type):
+    return """
+    SELECT MAX(version) FROM schema_version
+    """
+
+def get_insert_schema_version_query(db_type):
+    if db_type == "mysql":
+        return """
+        INSERT INTO schema_version (version, description, applied_at) VALUES (%s, %s, %s)
+        """
+    else:
+        return """
+        INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)
+        """
+
+def get_upsert_timesheet_query(db_type):
+    # REPLACE 在 SQLite 和 MySQL 中都按主键 kimai_id 覆盖整行
+    if db_type == "mysql":
+        return """
+        REPLACE INTO timesheets (kimai_id, todoist_id, task_ref, project_id, activity_id, user_id, begin_time, end_time, duration, description, rate, exported, synced_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """
+    else:
+        return """
+        REPLACE INTO timesheets (kimai_id, todoist_id, task_ref, project_id, activity_id, user_id, begin_time, end_time, duration, description, rate, exported, synced_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """
+
+def get_update_timesheet_task_query(db_type):
+    if db_type == "mysql":
+        return """
+        UPDATE timesheets SET todoist_id = %s WHERE kimai_id = %s
+        """
+    else:
+        return """
+        UPDATE timesheets SET todoist_id = ? WHERE kimai_id = ?
+        """
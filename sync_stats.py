@@ -0,0 +1,29 @@
+import threading
+from collections import Counter
+
+
+class SyncStats:
+    """Process-wide counters, e.g. ``skipped_writes.notion_task``, read by the cycle log."""
+
+    def __init__(self):
+        self.counters = Counter()
+        self.lock = threading.Lock()
+
+    def increment(self, name, count=1):
+        with self.lock:
+            self.counters[name] += count
+
+    def get(self, name):
+        with self.lock:
+            return self.counters[name]
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counters)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+
+
+sync_stats = SyncStats()
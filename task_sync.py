@@ -1,27 +1,15 @@
-from api_client import TodoistSyncClient, NotionClient, TodoistTask, NotionTask
-from db_operations import DatabaseManager
-from logger import logger
-from sql_statements import get_insert_task_query, get_update_task_query
-from utils import map_priority_reverse, map_priority, iso_to_timestamp,iso_to_naive,retry_on_failure, notion_task_property, notion_checked_property,notion_priority_property, notion_due_date_property, notion_todoist_id_property, notion_url_property, notion_description_property, is_valid_uuid
+from api_client import TodoistTask, NotionTask, MAX_COMMANDS_PER_SYNC
+from services import services
+from entity_locks import entity_locks, task_lock_keys
+from sync_stats import sync_stats
+from tracing import traced, span
+from logger import logger, payload
+from utils import map_priority_reverse, map_priority, iso_to_timestamp,iso_to_naive, notion_task_property, notion_checked_property, notion_recurring_property,notion_priority_property, notion_due_date_property, notion_todoist_id_property, notion_url_property, notion_description_property, is_valid_uuid, notion_last_edited_filter, next_notion_cursor, canonical_task_fields, payload_hash, dump_snapshot, changed_fields, is_echo
 from datetime import datetime, timezone, timedelta
 import uuid
 import os
+import asyncio
 
-import json
-import logging
-from pythonjsonlogger import jsonlogger
-from notion_client import Client
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
-
-
-
-log_file = 'log.json'
-file_handler = logging.FileHandler(log_file)
-file_handler.setLevel(logging.INFO)
-formatter = jsonlogger.JsonFormatter()
-file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
 
 NOTION_TASK_DATABASE_ID = os.getenv("NOTION_TASK_DATABASE_ID")
 NOTION_PROJECT_DATABASE_ID = os.getenv("NOTION_PROJECT_DATABASE_ID")
@@ -30,8 +18,10 @@ TODOIST_TOKEN = os.getenv("TODOIST_TOKEN")
 NOTION_TOKEN = os.getenv("NOTION_TOKEN")
 DB_TYPE = os.getenv("DB_TYPE")
 DB_PATH = os.getenv("DB_PATH")
-db_manager = DatabaseManager(DB_TYPE, DB_PATH)
-notion = Client(auth=NOTION_TOKEN)
+# 异步模式下同时处理的任务数
+SYNC_CONCURRENCY = int(os.getenv("SYNC_CONCURRENCY", "8"))
+NOTION_PAGE_SIZE = int(os.getenv("NOTION_PAGE_SIZE", "100"))
+NOTION_CURSOR_OVERLAP = int(os.getenv("NOTION_CURSOR_OVERLAP", "120"))
 
 
 
@@ -40,7 +30,7 @@ def create_notion_task(notion_client, todoist_task):
         notion_task = NotionTask.from_todoist_task(todoist_task)
         task_property = notion_task_property(notion_task.name) if notion_task.name else {}
         priority_property = (notion_priority_property(todoist_task.priority)) if notion_task.priority else {}
-        logger.info(f"priority is {map_priority(todoist_task.priority)}")
+        logger.debug("priority is %s", map_priority(todoist_task.priority))
         
         due_date_property = {}
         if notion_task.due_date:
@@ -51,6 +41,7 @@ def create_notion_task(notion_client, todoist_task):
         url_property = notion_url_property(notion_task.todoist_id) if notion_task.todoist_id else {}
         description = notion_description_property(notion_task.description) if notion_task.description else {}
         checked = notion_checked_property(notion_task.checked)
+        recurring = notion_recurring_property(bool(todoist_task.recurring))
 
         # 合并属性部分
         properties = {}
@@ -61,35 +52,67 @@ def create_notion_task(notion_client, todoist_task):
         properties.update(url_property)
         properties.update(description)
         properties.update(checked)
+        properties.update(recurring)
         
         # 检查 properties 是否为空
         if not properties:
             raise Exception("Properties are empty, cannot create Notion task.")
 
-        logger.info(f"Creating Notion task with properties: {json.dumps(properties, ensure_ascii=False)}")
+        logger.info("Creating Notion task with properties: %s", payload(properties))
         new_task = notion_client.create_page(NOTION_TASK_DATABASE_ID, properties)
         
         # 检查返回结果是否包含错误
         if new_task.get('object') == 'error':
             raise Exception(f"Notion API error: {new_task.get('message')}")
         
-        logger.info(f"Notion task created: {new_task}")
+        logger.info("Notion task created: %s", payload(new_task))
         return new_task
     except Exception as e:
-        logger.error(f"Failed to create Notion task: {e}")
+        logger.error("Failed to create Notion task: %s", e)
         raise
 
-def update_notion_task(notion_client, todoist_task, page_id):
+# 规范字段 -> Notion 属性名，用于字段级差异更新
+NOTION_TASK_FIELD_PROPERTIES = {
+    "content": "Task",
+    "priority": "Priority",
+    "due": "Due",
+    "description": "Description",
+    "checked": "Status",
+    "recurring": "Recurring",
+}
+# 差异更新时新值为空的字段，发送这些值显式清空 Notion 中的旧值
+NOTION_TASK_CLEARED_PROPERTIES = {
+    "Task": {"title": []},
+    "Due": {"date": None},
+    "Description": {"rich_text": []},
+}
+# 规范字段 -> Todoist item_update 参数
+TODOIST_TASK_FIELD_ARGS = {
+    "content": "content",
+    "priority": "priority",
+    "due": "due",
+    "description": "description",
+    "checked": "checked",
+    "deleted": "is_deleted",
+    "project_id": "project_id",
+    "recurring": "due",
+}
+
+
+def update_notion_task(notion_client, todoist_task, page_id, changed=None):
+    """Update a Notion task page. With ``changed`` (canonical field names) only those properties are sent."""
     try:
         # 构建各个属性部分
         task_property = notion_task_property(todoist_task.content) if todoist_task.content else {}
         priority_property = notion_priority_property(todoist_task.priority) if todoist_task.priority else {}
-        logger.info(f"priority is {map_priority(todoist_task.priority)}")
+        logger.debug("priority is %s", map_priority(todoist_task.priority))
         due_date_property = notion_due_date_property(todoist_task.due_date) if todoist_task.due_date else {}
         todoist_id_property = notion_todoist_id_property(todoist_task.id) if todoist_task.id else {}
         url_property = notion_url_property(todoist_task.id) if todoist_task.id else {}
         description = notion_description_property(todoist_task.description) if todoist_task.description else {}
-        checked = notion_checked_property(todoist_task.checked) if todoist_task.checked else {}
+        # 差异更新时取消勾选也要同步
+        checked = notion_checked_property(bool(todoist_task.checked)) if todoist_task.checked or (changed and "checked" in changed) else {}
+        recurring = notion_recurring_property(bool(todoist_task.recurring)) if todoist_task.recurring or (changed and "recurring" in changed) else {}
 
         # 合并属性部分
         properties = {}
@@ -100,366 +123,520 @@ def update_notion_task(notion_client, todoist_task, page_id):
         properties.update(url_property)
         properties.update(description)
         properties.update(checked)
-            # 检查 properties 是否为空
-        if not properties:
+        properties.update(recurring)
+        if changed is not None:
+            # TodoistID / URL 只在首次同步时写入，之后不会变化
+            wanted = {NOTION_TASK_FIELD_PROPERTIES[field] for field in changed if field in NOTION_TASK_FIELD_PROPERTIES}
+            properties = {name: value for name, value in properties.items() if name in wanted}
+            for name in wanted - properties.keys():
+                if name in NOTION_TASK_CLEARED_PROPERTIES:
+                    properties[name] = NOTION_TASK_CLEARED_PROPERTIES[name]
+        # 检查 properties 是否为空
+        elif not properties:
             raise Exception("Properties are empty, cannot update Notion task.")
 
-        logger.info(f"Updating Notion task with properties: {properties}")
+        logger.info("Updating Notion task with properties: %s", payload(properties))
         new_task = notion_client.update_task(page_id, properties, todoist_task.deleted)
             
             # 检查返回结果是否包含错误
         if new_task.get('object') == 'error':
             raise Exception(f"Notion API error: {new_task.get('message')}")
             
-        logger.info(f"Notion task updated: {new_task}")
+        logger.info("Notion task updated: %s", payload(new_task))
         return new_task
     except Exception as e:
-        logger.error(f"Failed to update Notion task: {e}")
+        logger.error("Failed to update Notion task: %s", e)
         raise
-def create_todoist_task_with_note(todoist_client, temp_id, todoist_task, notion_url):
-    task_data = todoist_task
-    
-    new_sync_token, new_item_id, new_note_id = todoist_client.create_task_with_note(task_data, temp_id, notion_url)
-    new_task = todoist_client.get_single_task(new_item_id)['item']
-    logger.debug(f"Created todoist task {new_task}")
-    return new_task, new_sync_token, new_item_id, new_note_id
+
+def todoist_task_fields(task):
+    due = task.get("due") or {}
+    return canonical_task_fields(task.get("content"), task.get("description"), due.get("date"), task.get("priority"), task.get("checked"), task.get("is_deleted"), task.get("project_id"), due.get("is_recurring"))
+
+
+def notion_task_fields(todoist_task_data, project_id=None):
+    """Canonical fields of a Notion page, taken from its build_todoist_task_data payload.
+
+    A page without a project keeps ``project_id``, the task's current Todoist project.
+    """
+    return canonical_task_fields(
+        todoist_task_data.get("content"), todoist_task_data.get("description"), todoist_task_data["due"].get("date"),
+        todoist_task_data.get("priority"), todoist_task_data.get("checked"), todoist_task_data.get("is_deleted"),
+        todoist_task_data.get("project_id") or project_id, todoist_task_data["due"].get("is_recurring"))
+
+
+def todoist_update_args(todoist_id, todoist_task_data, changed):
+    """item_update args carrying only the changed fields; everything when there is no snapshot yet."""
+    if changed is None:
+        return {"id": todoist_id, **todoist_task_data}
+    args = {"id": todoist_id}
+    for field in changed:
+        arg = TODOIST_TASK_FIELD_ARGS.get(field)
+        # Todoist 任务总有项目，页面没有项目时不发送
+        if arg and not (arg == "project_id" and not todoist_task_data.get(arg)):
+            args[arg] = todoist_task_data.get(arg)
+    return args
+
+
+@traced("task.prepare_todoist_task")
+def prepare_todoist_task(identity_map, task):
+    """Collect the DB state a Todoist item needs before any remote call is made."""
+    if not isinstance(task, dict):
+        logger.error("Expected task to be a dictionary but got %s: %s", type(task), payload(task))
+        return None
+
+    logger.debug("Processing task: %s", payload(task))
+    # 获取与任务相关的笔记
+    task_row = identity_map.get_task(task.get("id")) or {}
+    note_id, note_content = task_row.get("note_id"), task_row.get("note")
+    due_date = task.get("due", {}).get("date") if task.get("due") else None
+    if due_date:
+        logger.debug("due_date: %s", due_date)
+
+    project_name = identity_map.get_project_name(task.get("project_id"))
+
+    todoist_task = TodoistTask(
+        id=task.get("id"),
+        content=task.get("content"),
+        due_date=due_date,
+        priority=task.get("priority") if task.get("priority") else None,
+        project_id=task.get("project_id"),
+        project_name=project_name,
+        added_at=task.get("added_at"),
+        note_id=note_id,
+        note=note_content,
+        checked=task.get("checked"),
+        description=task.get("description"),
+        recurring=task.get("due", {}).get("is_recurring") if task.get("due") else None,
+        date_updated=task.get("updated_at"),
+        deleted=task.get("is_deleted"),
+        notion_id=None,  # Fetch notion id if needed
+        notion_url=None
+    )
+    modified_date = task_row.get("date_updated")
+    notion_task_id = task_row.get("notion_id")
+    logger.debug("Fetched notion_task_id: %s", notion_task_id)
+
+    if todoist_task.date_updated and modified_date and todoist_task.deleted != True:
+        if iso_to_timestamp(todoist_task.date_updated) > iso_to_timestamp(str(modified_date)):
+            logger.info("对比结果: Todoist任务的更新时间 %s > 数据库中的更新时间 %s", todoist_task.date_updated, modified_date)
+        action = "update"
+    elif todoist_task.deleted == True:
+        action = "delete"
+    else:
+        action = "create"
+
+    # 修改时间正是我们上次写入 Todoist 得到的版本: 这是自己写入的回声，即使 Todoist 规范化了字段也不再写回
+    if action == "update" and is_echo(task.get("updated_at"), task_row.get("todoist_written_at")):
+        logger.info("Task %s change is our own Todoist write, suppressing echo", todoist_task.id)
+        sync_stats.increment("suppressed_echoes.todoist_task")
+        return None
+    # 同步字段没有变化时不再调用 Notion
+    sync_fields = todoist_task_fields(task)
+    sync_hash = payload_hash(sync_fields)
+    if action == "update" and sync_hash == task_row.get("sync_hash"):
+        logger.info("Task %s unchanged since last sync, skipping Notion update", todoist_task.id)
+        sync_stats.increment("skipped_writes.notion_task")
+        return None
+    return {
+        "action": action,
+        "todoist_task": todoist_task,
+        "note_id": note_id,
+        "notion_task_id": notion_task_id,
+        # 上次写入或查询得到的页面时间戳，更新时无需再取整页
+        "notion_created": task_row.get("notion_created"),
+        "notion_modified": task_row.get("notion_modified"),
+        "sync_hash": sync_hash,
+        "sync_snapshot": dump_snapshot(sync_fields),
+        "changed_fields": changed_fields(task_row.get("sync_snapshot"), sync_fields)
+    }
+
+
+@traced("task.push_todoist_task")
+def push_todoist_task(notion_client, todoist_client, context):
+    """Perform the remote writes for a prepared Todoist item. Touches no DB state."""
+    todoist_task = context["todoist_task"]
+    notion_task_id = context["notion_task_id"]
+    if context["action"] == "update":
+        notion_task = {"id": notion_task_id, "created_time": context["notion_created"], "last_edited_time": context["notion_modified"]}
+        if not context["notion_created"] and notion_task_id and is_valid_uuid(notion_task_id):
+            # 本地没有缓存的页面时间戳时才回退到整页读取
+            logger.info("No cached page timestamps for Notion task %s, fetching page", notion_task_id)
+            sync_stats.increment("notion_page_fetches")
+            notion_task = notion_client.get_page(notion_task_id)
+            logger.debug("Fetched modified date: %s, comparing with todoist_task.date_updated: %s", notion_task.get('last_edited_time'), todoist_task.date_updated)
+        logger.info("Updating existing Notion task...")
+        logger.debug("Proposed notion properties: %s", payload(vars(todoist_task)))
+        context["notion_task"] = notion_task
+        context["updated_notion_task"] = update_notion_task(notion_client, todoist_task, notion_task_id, context["changed_fields"])
+        logger.info("Updated task in Notion: %s", payload(context['updated_notion_task']))
+    elif context["action"] == "delete":
+        notion_client.delete_page(notion_task_id)
+        logger.info("Deleting Notion Page with ID: %s", notion_task_id)
+    else:
+        temp_id = str(uuid.uuid4())
+        logger.info("Cannot find matching notion task in database or in Notion, creating new Notion task...")
+        logger.debug("Proposed notion properties: %s", payload(vars(todoist_task)))
+        notion_task = create_notion_task(notion_client, todoist_task)
+        notion_url = notion_task.get('url')
+        logger.info("Adding note with Notion url: %s, Todoist ID: %s, Temp ID: %s, ", notion_url, todoist_task.id, temp_id)
+        note = todoist_client.add_note(todoist_task.id, notion_url, temp_id)
+        logger.info("Added note: %s", payload(note))
+        context["notion_task"] = notion_task
+        context["note_id"] = note.get("temp_id_mapping", {}).get(temp_id)
+    return context
+
+
+@traced("task.record_todoist_task")
+def record_todoist_task(unit_of_work, identity_map, context):
+    """Write the outcome of push_todoist_task back to the DB and the identity map."""
+    todoist_task = context["todoist_task"]
+    note_id = context["note_id"]
+    if context["action"] == "update":
+        notion_task = context["notion_task"]
+        new_task_in_todoist = context["updated_notion_task"]
+        # 更新接口的返回值就是最新的页面，直接用它刷新缓存的时间戳
+        notion_task = {**notion_task, **{key: new_task_in_todoist[key] for key in ("created_time", "last_edited_time") if new_task_in_todoist.get(key)}}
+        unit_of_work.update_task((
+            todoist_task.content, todoist_task.due_date, todoist_task.priority, todoist_task.project_id, todoist_task.project_name, note_id, new_task_in_todoist.get('url'), 
+            todoist_task.checked, todoist_task.description, todoist_task.recurring, datetime.now(), todoist_task.deleted, 
+            notion_task.get('id'), new_task_in_todoist.get("url"), todoist_task.added_at, todoist_task.date_updated, notion_task.get('created_time'), notion_task.get('last_edited_time'), todoist_task.id
+        ))
+        # 记录这次写入产生的页面版本，下一轮据此识别回声
+        notion_written_at = new_task_in_todoist.get('last_edited_time')
+        unit_of_work.set_sync_hash("tasks", todoist_task.id, context["sync_hash"], context["sync_snapshot"], notion_written_at=notion_written_at)
+        identity_map.put_task(todoist_task.id, notion_written_at=notion_written_at, notion_id=notion_task.get('id'), note_id=note_id, note=new_task_in_todoist.get('url'), date_updated=datetime.now(), project_id=todoist_task.project_id, todoist_modified=todoist_task.date_updated, notion_created=notion_task.get('created_time'), notion_modified=notion_task.get('last_edited_time'), sync_hash=context["sync_hash"], sync_snapshot=context["sync_snapshot"])
+        logger.info("Task updated in database: %s (Todoist ID: %s, Notion ID: %s)", todoist_task.content, todoist_task.id, notion_task.get('id'))
+    elif context["action"] == "create":
+        notion_task = context["notion_task"]
+        notion_url = notion_task.get('url')
+        current_date = datetime.now(timezone.utc).astimezone(timezone(timedelta(hours=8)))
+        unit_of_work.insert_task((
+            todoist_task.id, todoist_task.content, todoist_task.due_date, todoist_task.priority, todoist_task.project_id, todoist_task.project_name, todoist_task.added_at, note_id, notion_url, 
+            todoist_task.checked, todoist_task.description, todoist_task.recurring, current_date, todoist_task.deleted, 
+            notion_task.get('id'), notion_url, todoist_task.added_at, todoist_task.date_updated, notion_task.get('created_time'), notion_task.get('last_edited_time')
+                ))
+        notion_written_at = notion_task.get('last_edited_time')
+        unit_of_work.set_sync_hash("tasks", todoist_task.id, context["sync_hash"], context["sync_snapshot"], notion_written_at=notion_written_at)
+        identity_map.put_task(todoist_task.id, notion_written_at=notion_written_at, notion_id=notion_task.get('id'), note_id=note_id, note=notion_url, date_updated=current_date, project_id=todoist_task.project_id, todoist_modified=todoist_task.date_updated, notion_created=notion_task.get('created_time'), notion_modified=notion_task.get('last_edited_time'), sync_hash=context["sync_hash"], sync_snapshot=context["sync_snapshot"])
+        logger.info("Task synced to Notion: %s (Todoist ID: %s, Notion ID: %s)", todoist_task.content, todoist_task.id, notion_task.get('id'))
 
 
-def sync_todoist_to_notion():
-    db_manager = DatabaseManager(DB_TYPE, DB_PATH)
-    todoist_client = TodoistSyncClient(TODOIST_TOKEN, DB_TYPE, DB_PATH)
-    notion_client = NotionClient(NOTION_TOKEN)
+def todoist_task_lock_keys(identity_map, task):
+    if not isinstance(task, dict):
+        return []
+    return task_lock_keys(task.get("id"), (identity_map.get_task(task.get("id")) or {}).get("notion_id"))
 
+
+@traced("task.fetch_todoist_tasks")
+def fetch_todoist_tasks(db_manager, todoist_client):
     task_sync_token = db_manager.get_sync_token("items")
-    logger.info(f"Task sync token: {task_sync_token}")
+    logger.info("Task sync token: %s", task_sync_token)
     tasks_data = todoist_client.get_tasks(task_sync_token)
-    logger.info(f"Tasks data from Todoist: {tasks_data}")
+    logger.info("Tasks data from Todoist: %d items, full_sync=%s", len(tasks_data.get("items", [])), tasks_data.get("full_sync"))
     new_task_sync_token = tasks_data['sync_token']
-    logger.info(f"New task sync token: {new_task_sync_token}")
+    logger.info("New task sync token: %s", new_task_sync_token)
     todoist_tasks = tasks_data["items"]
-    logger.debug(f"Todoist tasks: {todoist_tasks}")
+    logger.debug("Todoist tasks: %s", payload(todoist_tasks))
+    return todoist_tasks, new_task_sync_token
 
 
+def sync_todoist_to_notion(todoist_items=None):
+    """Sync the Todoist item delta to Notion.
 
-    for task in todoist_tasks:
-        if not isinstance(task, dict):
-            logger.error(f"Expected task to be a dictionary but got {type(task)}: {task}")
-            continue
+    ``todoist_items`` (e.g. from a webhook) replaces the delta fetch; the items
+    sync token is then left untouched so the next poll still sees every change.
+    """
+    db_manager = services.db_manager
+    todoist_client = services.new_todoist_client()
+    notion_client = services.notion_client
 
-        logger.debug(f"Processing task: {task}")  # Print debug info
+    identity_map = services.identity_map
 
-        try:
-            # 获取与任务相关的笔记
-            note_id, note_content = db_manager.fetch_one("SELECT note_id, note FROM tasks WHERE todoist_id = ?", (task.get("id"),)) or (None, None)
-            due_date = task.get("due", {}).get("date") if task.get("due") else None
-            if due_date:
-                logger.debug(f"due_date: {due_date}")
-            
-            project_name = db_manager.fetch_one("SELECT name FROM projects WHERE todoist_id = ?", (task.get("project_id"),))
-            project_name = project_name[0] if project_name else None
-
-            todoist_task = TodoistTask(
-                id=task.get("id"),
-                content=task.get("content"),
-                due_date=due_date,
-                priority=task.get("priority") if task.get("priority") else None,
-                project_id=task.get("project_id"),
-                project_name=project_name,
-                added_at=task.get("added_at"),
-                note_id=note_id,
-                note=note_content,
-                checked=task.get("checked"),
-                description=task.get("description"),
-                recurring=task.get("due", {}).get("is_recurring") if task.get("due") else None,
-                date_updated=task.get("updated_at"),
-                deleted=task.get("is_deleted"),
-                notion_id=None,  # Fetch notion id if needed
-                notion_url=None
-            )
-            # 获取 notion_task_id 并提取第一个元素
-            modified_date = db_manager.fetch_one("SELECT date_updated FROM tasks WHERE todoist_id = ?", (todoist_task.id,))
-            modified_date = modified_date[0] if modified_date else None
-            notion_task_id_tuple = db_manager.fetch_one("SELECT notion_id FROM tasks WHERE todoist_id = ?", (todoist_task.id,))
-            notion_task_id = notion_task_id_tuple[0] if notion_task_id_tuple else None
-            logger.debug(f"Fetched notion_task_id: {notion_task_id}")
-
-
-            if todoist_task.date_updated and modified_date and todoist_task.deleted != True:
-                if todoist_task.date_updated > modified_date:
-                    logger.info(f"对比结果: Todoist任务的更新时间 {todoist_task.date_updated} > 数据库中的更新时间 {modified_date}")
-                if notion_task_id and is_valid_uuid(notion_task_id):
-                    logger.info(f"Valid Notion task ID found: {notion_task_id}")
-                    notion_task = notion_client.get_page(notion_task_id)
-                    notion_modified = notion_task.get('last_edited_time')
-                    logger.info(f"Fetched notion_task: {notion_task.get('properties')['Task']['title'][0]['text']['content']}")
-                    logger.debug(f"Fetched modified date: {notion_modified}, comparing with todoist_task.date_updated: {todoist_task.date_updated}")
-                logger.info("Updating existing Notion task...")
-                logger.debug(f"Proposed notion properties: id={todoist_task.id}, content={todoist_task.content}, due_date={todoist_task.due_date}, priority={todoist_task.priority}, project_id={todoist_task.project_id}, added_at={todoist_task.added_at}, date_updated={todoist_task.date_updated}, description={todoist_task.description}")
-                new_task_in_todoist = update_notion_task(notion_client, todoist_task, notion_task_id)
-                logger.info(f"Updated task in Notion: {new_task_in_todoist}")
-                update_task_query = get_update_task_query(db_manager.db_type)
-                db_manager.execute_query(update_task_query, (
-                    todoist_task.content, todoist_task.due_date, todoist_task.priority, todoist_task.project_id, todoist_task.project_name, note_id, new_task_in_todoist.get('url'), 
-                    todoist_task.checked, todoist_task.description, todoist_task.recurring, datetime.now(), todoist_task.deleted, 
-                    notion_task.get('id'), new_task_in_todoist.get("url"), todoist_task.added_at, todoist_task.date_updated, notion_task.get('created_time'), notion_modified, todoist_task.id
-                ))
-                logger.info(f"Task updated in database: {todoist_task.content} (Todoist ID: {todoist_task.id}, Notion ID: {notion_task.get('id')})")
-            elif todoist_task.deleted == True:
-                notion_client.delete_page(notion_task_id)
-                logger.info(f"Deleting Notion Page with ID: {notion_task_id}")
-
-            else:    
-                temp_id = str(uuid.uuid4())
-                logger.info("Cannot find matching notion task in database or in Notion, creating new Notion task...")
-                try:
-                    logger.debug(f"Proposed notion properties: id={todoist_task.id}, content={task.get('content')}, due_date={todoist_task.due_date}, priority={todoist_task.priority}, project_id={todoist_task.project_id}, added_at={todoist_task.added_at}, date_updated={todoist_task.date_updated}")
-                    notion_task = create_notion_task(notion_client, todoist_task)
-                except Exception as e:
-                    logger.error(f"Failed to create Notion task: {e}")
-                    continue  # 跳过这个任务，继续处理下一个
-
-                notion_url = notion_task.get('url')
-                todoist_url = f"https://todoist.com/showTask?id={todoist_task.id}"
-                current_date = datetime.now(timezone.utc).astimezone(timezone(timedelta(hours=8)))
-                logger.info(f"Adding note with Notion url: {notion_url}, Todoist ID: {todoist_task.id}, Temp ID: {temp_id}, ")
-                note = todoist_client.add_note(todoist_task.id, notion_url, temp_id)
-                logger.info(f"Added note: {note}")
-                temp_id_mapping = note.get("temp_id_mapping", {})
-                note_id = temp_id_mapping.get(temp_id)
-                insert_task_query = get_insert_task_query(db_manager.db_type)
-                project_name = db_manager.fetch_one("SELECT name FROM projects WHERE todoist_id = ?", (todoist_task.project_id,))
-                logger.debug(f"Fetched project_name: {project_name}")
-                due_date = todoist_task.due_date
-                is_recurring = todoist_task.recurring
-                db_manager.execute_query(insert_task_query, (
-                    todoist_task.id, todoist_task.content, todoist_task.due_date, todoist_task.priority, todoist_task.project_id, todoist_task.project_name, todoist_task.added_at, note_id, notion_url, 
-                    todoist_task.checked, todoist_task.description, todoist_task.recurring, current_date, todoist_task.deleted, 
-                    notion_task.get('id'), notion_url, todoist_task.added_at, todoist_task.date_updated, notion_task.get('created_time'), notion_task.get('last_edited_time')
-                        ))
-                logger.info(f"Task synced to Notion: {notion_task.get} (Todoist ID: {todoist_task.id}, Notion ID: {notion_task.get('id')})")
-
-        except Exception as e:
-            logger.error(f"Error processing task {task.get('id')}: {e}")
-            continue
-
-    db_manager.update_sync_token("items", new_task_sync_token)
-    db_manager.close_connection()
-
-
-def sync_notion_to_todoist():
-    db_manager = DatabaseManager(DB_TYPE, DB_PATH)
-    notion_client = NotionClient(NOTION_TOKEN)
-    todoist_client = TodoistSyncClient(TODOIST_TOKEN, DB_TYPE, DB_PATH)
-    task_sync_token = db_manager.get_sync_token("items")
-    logger.debug(f"Task sync token: {task_sync_token}")
-    notion_tasks = notion_client.get_tasks({})
-    valid_tasks = [project for project in notion_tasks.get("results", []) if project.get('last_edited_time') is not None]
-    logger.debug(f"Valid tasks: {valid_tasks}")
-    if valid_tasks:
-        task_last_modified = max(valid_tasks, key=lambda x: x['last_edited_time'])['last_edited_time']
+    if todoist_items is None:
+        todoist_tasks, new_task_sync_token = fetch_todoist_tasks(db_manager, todoist_client)
     else:
-        task_last_modified = None  # 或者设置为一个合理的默认值
-    task_db_last_modified = db_manager.fetch_one("SELECT MAX(date_updated) FROM tasks WHERE deleted IS FALSE")
-    task_db_last_modified = task_db_last_modified[0] if task_db_last_modified else None
-    
-    if task_db_last_modified == None:
-        logger.info(f"Database not set, start initial syncing")
-        for task in notion_tasks.get("results", []):
-                if not isinstance(task, dict):
-                    logger.error(f"Expected task to be a dictionary but got {type(task)}: {task}")
-                    continue
-                current_date = datetime.now(timezone.utc).astimezone(timezone(timedelta(hours=8)))
-                logger.debug(f"Processing task: {task}")  # Print debug info
-                properties = task.get('properties', {})
-                due_date = properties.get('Due',{})
-                due_date_value = ''
-                if due_date:
-                    date_field = due_date.get('date')
-                    if date_field:
-                        due_date_value = date_field.get('start')
-                        due_date_value = iso_to_naive(due_date_value)
-                        logger.debug(f"due_date_value: {due_date_value}")
-                rich_text = properties.get('Description', {}).get('rich_text', [])
-                description = rich_text[0].get('text', {}).get('content', '') if rich_text else ''
-                priority_select = properties.get('Priority', {}).get('select')
-                todoist_task_data = {
-                    "content": properties.get('Task', {}).get('title', [{}])[0].get('text', {}).get('content', ''),
-                    "due": {
-                        "date":due_date_value,
-                        "is_recurring": properties.get('Recurring', {}).get('checkbox'),
-                        "timezone": "Asia/Shanghai"
-                                        },
-                    "priority": map_priority_reverse(priority_select.get('name')) if priority_select else None,
-                    "project_id": properties.get('Project ID', {}).get('select', {}).get('id'),
-                    "todoist_id": next((prop['text']['content'] for prop in properties.get('TodoistID', {}).get('rich_text', [])), None),
-                    "description": description,
-                    "checked": properties.get('Status', {}).get('checkbox'),
-                    "is_deleted": task.get('archived'),
-                }
-                temp_id = str(uuid.uuid4())
-                new_task_in_todoist, new_task_sync_token, item_id, note_id = create_todoist_task_with_note(todoist_client, temp_id, todoist_task_data, task.get('url'))
-                todoist_url = f"https://todoist.com/showTask?id={item_id}"
-                logger.debug(f"Todoist task created: {item_id}")
-                logger.debug(f"Todoist note created: {note_id}")
-                logger.debug(f"Updating notion with TodoistID: {item_id}")
-                proposed_properties = notion_todoist_id_property(item_id)
-                update_notion_task = notion_client.update_page(notion_task_id, proposed_properties, new_task_in_todoist.get('is_deleted'))
-                logger.info(f"Updated notion with TodoistID: {item_id}")
-                current_date = datetime.now(timezone.utc).astimezone(timezone(timedelta(hours=8)))
-                notion_url = task.get('url')
-
-                insert_task_query = get_insert_task_query(db_manager.db_type)
-                project_name = db_manager.fetch_one("SELECT name FROM projects WHERE todoist_id = ?", (new_task_in_todoist.get('project_id'),))[0]
-                #  if not project_name:
-                #       logger.info("Project not found, running project_sync...")
-                #     project_sync()
-                #     project_name = db_manager.fetch_one("SELECT name FROM projects WHERE todoist_id = ?", (new_task_in_todoist.get('project_id'),))
-                logger.debug(f"Fetched project_name: {project_name}")
-                db_manager.execute_query(insert_task_query, (
-                        item_id, task_name, due_date_value, new_task_in_todoist.get("priority"), 
-                        new_task_in_todoist.get("project_id"), project_name, current_date, note_id, 
-                        todoist_url, new_task_in_todoist['checked'], todoist_task_data['description'], 
-                        todoist_task_data['due']['is_recurring'], current_date, new_task_in_todoist.get('is_deleted'), 
-                        task.get('id'), notion_url, new_task_in_todoist.get('added_at'), new_task_in_todoist.get('updated_at'), task['created_time'], task['last_edited_time']
-                ))
-                db_manager.update_sync_token('items', new_task_sync_token)
-                logger.info(f"Task synced to Todoist and recorded in database: {task_name} (Todoist ID: {item_id}, Notion ID: {task['id']})")
+        todoist_tasks, new_task_sync_token = todoist_items, None
+    processed = 0
+    with db_manager.unit_of_work() as unit_of_work:
+        for task in todoist_tasks:
+            try:
+                # 持有该任务的锁，避免与 Notion -> Todoist 方向同时写同一个任务
+                with span("task.todoist_to_notion"), entity_locks.hold(*todoist_task_lock_keys(identity_map, task)):
+                    context = prepare_todoist_task(identity_map, task)
+                    if context is None:
+                        continue
+                    push_todoist_task(notion_client, todoist_client, context)
+                    record_todoist_task(unit_of_work, identity_map, context)
+                processed += 1
+            except Exception as e:
+                logger.error("Error processing task %s: %s", task.get('id') if isinstance(task, dict) else task, e)
+                continue
+
+        if new_task_sync_token:
+            unit_of_work.update_sync_token("items", new_task_sync_token)
+    return processed
+
+
+async def sync_todoist_to_notion_async(todoist_items=None, concurrency=SYNC_CONCURRENCY):
+    """Asyncio variant of sync_todoist_to_notion, taking the same ``todoist_items``.
+
+    Remote writes of independent tasks run concurrently in worker threads, bounded by
+    ``concurrency``. DB reads and writes stay on the event loop thread, so the
+    connection is never shared across threads.
+    """
+    db_manager = services.db_manager
+    todoist_client = services.new_todoist_client()
+    notion_client = services.notion_client
+    semaphore = asyncio.Semaphore(concurrency)
+    identity_map = services.identity_map
+
+    if todoist_items is None:
+        todoist_tasks, new_task_sync_token = await asyncio.to_thread(fetch_todoist_tasks, db_manager, todoist_client)
     else:
-        logger.info(f"Comparing DB modified time: {task_db_last_modified} and Notion Task DB modified time: {task_last_modified}")
-        if iso_to_timestamp(str(task_last_modified)) > iso_to_timestamp(str(task_db_last_modified)):
-            logger.info(f"Notion Task modified time {task_last_modified} is later than DB modified time {task_db_last_modified}, time difference: {abs(iso_to_timestamp(str(task_last_modified)) - iso_to_timestamp(str(task_db_last_modified)))}")
-            for task in valid_tasks.get("results", []):
-                if not isinstance(task, dict):
-                    logger.error(f"Expected task to be a dictionary but got {type(task)}: {task}")
-                    continue
-                current_date = datetime.now(timezone.utc).astimezone(timezone(timedelta(hours=8)))
-                logger.debug(f"Processing task: {task}")  # Print debug info
-                properties = task.get('properties', {})
-                due_date = properties.get('Due',{})
-                due_date_value = ''
-                if due_date:
-                    date_field = due_date.get('date')
-                    if date_field:
-                        due_date_value = date_field.get('start')
-                        due_date_value = iso_to_naive(due_date_value)
-                        logger.debug(f"due_date_value: {due_date_value}")
-                rich_text = properties.get('Description', {}).get('rich_text', [])
-                description = rich_text[0].get('text', {}).get('content', '') if rich_text else ''
-                priority_select = properties.get('Priority', {}).get('select')
-                todoist_task_data = {
-                    "content": properties.get('Task', {}).get('title', [{}])[0].get('text', {}).get('content', ''),
-                    "due": {
-                        "date":due_date_value,
-                        "is_recurring": properties.get('Recurring', {}).get('checkbox'),
-                        "timezone": "Asia/Shanghai"
-                                        },
-                    "priority": map_priority_reverse(priority_select.get('name')) if priority_select else None,
-                    "project_id": properties.get('Project ID', {}).get('select', {}).get('id'),
-                    "todoist_id": next((prop['text']['content'] for prop in properties.get('TodoistID', {}).get('rich_text', [])), None),
-                    "description": description,
-                    "checked": properties.get('Status', {}).get('checkbox'),
-                    "is_deleted": task.get('archived'),
-                }
-                logger.debug(f"Notion due date: {due_date_value}")
-                logger.debug(f"Todoist task properties: {todoist_task_data}")
-                #update
-                
-                logger.info(f"Updated task in Todoist: {todoist_task_data['content']}")
-                todoist_id = todoist_task_data["todoist_id"]
+        todoist_tasks, new_task_sync_token = todoist_items, None
+    unit_of_work = db_manager.unit_of_work()
+
+    async def run_pipeline(task):
+        async with semaphore:
+            with span("task.todoist_to_notion"):
+                # 在工作线程里等锁，不阻塞事件循环
+                lock_keys = todoist_task_lock_keys(identity_map, task)
+                await asyncio.to_thread(entity_locks.acquire, lock_keys)
+                try:
+                    context = prepare_todoist_task(identity_map, task)
+                    if context is None:
+                        return 0
+                    await asyncio.to_thread(push_todoist_task, notion_client, todoist_client, context)
+                    record_todoist_task(unit_of_work, identity_map, context)
+                    return 1
+                except Exception as e:
+                    logger.error("Error processing task %s: %s", task.get('id') if isinstance(task, dict) else task, e)
+                    return 0
+                finally:
+                    entity_locks.release(lock_keys)
+
+    with unit_of_work:
+        results = await asyncio.gather(*(run_pipeline(task) for task in todoist_tasks))
+        if new_task_sync_token:
+            unit_of_work.update_sync_token("items", new_task_sync_token)
+    return sum(results)
+
+
+@traced("task.build_todoist_task_data")
+def build_todoist_task_data(task):
+    properties = task.get('properties', {})
+    due_date = properties.get('Due',{})
+    due_date_value = ''
+    if due_date:
+        date_field = due_date.get('date')
+        if date_field:
+            due_date_value = date_field.get('start')
+            due_date_value = iso_to_naive(due_date_value)
+            logger.debug("due_date_value: %s", due_date_value)
+    rich_text = properties.get('Description', {}).get('rich_text', [])
+    description = rich_text[0].get('text', {}).get('content', '') if rich_text else ''
+    priority_select = properties.get('Priority', {}).get('select')
+    todoist_task_data = {
+        "content": properties.get('Task', {}).get('title', [{}])[0].get('text', {}).get('content', ''),
+        "due": {
+            "date":due_date_value,
+            "is_recurring": properties.get('Recurring', {}).get('checkbox'),
+            "timezone": "Asia/Shanghai"
+                            },
+        "priority": map_priority_reverse(priority_select.get('name')) if priority_select else None,
+        "project_id": (properties.get('Project ID', {}).get('select') or {}).get('id'),
+        "todoist_id": next((prop['text']['content'] for prop in properties.get('TodoistID', {}).get('rich_text', [])), None),
+        "description": description,
+        "checked": properties.get('Status', {}).get('checkbox'),
+        "is_deleted": task.get('archived'),
+    }
+    return todoist_task_data, due_date_value
+
+
+@traced("task.queue_todoist_task_with_note")
+def queue_todoist_task_with_note(command_queue, todoist_task_data, notion_url, on_created, on_error=None):
+    temp_id = str(uuid.uuid4())
+    note_temp_id = str(uuid.uuid4())
+    command_queue.add("item_add", todoist_task_data, temp_id=temp_id)
+    # 回调挂在 note_add 上，保证 item 和 note 的真实 ID 都已解析
+    command_queue.add(
+        "note_add",
+        {"item_id": temp_id, "content": notion_url},
+        temp_id=note_temp_id,
+        on_success=lambda note_id: on_created(command_queue.resolve_id(temp_id), note_id),
+        on_error=on_error
+    )
+
+
+@traced("task.record_created_todoist_task")
+def record_created_todoist_task(unit_of_work, identity_map, notion_client, todoist_client, task, todoist_task_data, due_date_value, item_id, note_id):
+    new_task_in_todoist = todoist_client.get_item(item_id)
+    logger.info("Todoist Task created: %s", payload(new_task_in_todoist))
+    todoist_url = f"https://todoist.com/showTask?id={item_id}"
+    logger.info("Todoist note created: %s", note_id)
+    logger.info("Updating notion with TodoistID: %s", item_id)
+    proposed_properties = notion_todoist_id_property(item_id)
+    updated_page = notion_client.update_page(task['id'], proposed_properties, new_task_in_todoist.get('is_deleted'))
+    logger.info("Updated notion with TodoistID: %s", item_id)
+    current_date = datetime.now(timezone.utc).astimezone(timezone(timedelta(hours=8)))
+    notion_url = task.get('url')
+
+    project_name = identity_map.get_project_name(new_task_in_todoist.get('project_id'))
+    logger.info("Fetched project_name: %s", project_name)
+    unit_of_work.insert_task((
+        item_id, todoist_task_data['content'], due_date_value, new_task_in_todoist.get("priority"),
+        new_task_in_todoist.get("project_id"), project_name, current_date, note_id,
+        todoist_url, new_task_in_todoist['checked'], todoist_task_data['description'],
+        todoist_task_data['due']['is_recurring'], current_date, new_task_in_todoist.get('is_deleted'),
+        task.get('id'), notion_url, new_task_in_todoist.get('added_at'), new_task_in_todoist.get('updated_at'), task['created_time'], task['last_edited_time']
+    ))
+    sync_fields = notion_task_fields(todoist_task_data, new_task_in_todoist.get("project_id"))
+    sync_hash, sync_snapshot = payload_hash(sync_fields), dump_snapshot(sync_fields)
+    # 记录双方由我们写入产生的版本，下一轮据此识别回声
+    written_at = {"notion_written_at": updated_page.get('last_edited_time'), "todoist_written_at": new_task_in_todoist.get('updated_at')}
+    unit_of_work.set_sync_hash("tasks", item_id, sync_hash, sync_snapshot, **written_at)
+    identity_map.put_task(item_id, **written_at, notion_id=task.get('id'), note_id=note_id, note=todoist_url, date_updated=current_date, project_id=new_task_in_todoist.get("project_id"), todoist_modified=new_task_in_todoist.get('updated_at'), notion_created=task['created_time'], notion_modified=task['last_edited_time'], sync_hash=sync_hash, sync_snapshot=sync_snapshot)
+    logger.info("Task synced to Todoist and recorded in database: %s (Todoist ID: %s, Notion ID: %s)", todoist_task_data['content'], item_id, task['id'])
+
+
+@traced("task.record_updated_todoist_task")
+def record_updated_todoist_task(unit_of_work, identity_map, todoist_client, task, todoist_task_data, due_date_value, todoist_id):
+    task_data = todoist_client.get_item(todoist_id)
+    logger.info("Todoist task after update: %s", payload(task_data))
+    current_date = datetime.now(timezone.utc).astimezone(timezone(timedelta(hours=8)))
+    notion_url = f"https://www.notion.so/{task['id']}"
+    # 页面没有指定项目时任务留在原项目，以 Todoist 返回的为准
+    project_id = todoist_task_data.get("project_id") or task_data.get("project_id")
+    project_name = identity_map.get_project_name(project_id)
+    logger.info("Fetched project name: %s", project_name)
+    unit_of_work.update_task((
+            todoist_task_data.get('content'), due_date_value, todoist_task_data.get('priority'),
+            project_id, project_name, None, None, todoist_task_data['checked'], todoist_task_data['description'],
+            todoist_task_data['due']['is_recurring'], current_date, todoist_task_data.get('is_deleted'),
+            task['id'], notion_url, None, task_data.get('updated_at'), task['created_time'], task['last_edited_time'], todoist_id
+        ))
+    sync_fields = notion_task_fields(todoist_task_data, project_id)
+    sync_hash, sync_snapshot = payload_hash(sync_fields), dump_snapshot(sync_fields)
+    unit_of_work.set_sync_hash("tasks", todoist_id, sync_hash, sync_snapshot, todoist_written_at=task_data.get('updated_at'))
+    identity_map.put_task(todoist_id, todoist_written_at=task_data.get('updated_at'), notion_id=task['id'], note_id=None, note=None, date_updated=current_date, project_id=project_id, todoist_modified=task_data.get('updated_at'), notion_created=task['created_time'], notion_modified=task['last_edited_time'], sync_hash=sync_hash, sync_snapshot=sync_snapshot)
+    logger.info("Task updated in database: %s (Todoist ID: %s, Notion ID: %s)", todoist_task_data['content'], todoist_id, task['id'])
+
+
+def sync_notion_to_todoist(notion_pages=None):
+    """Sync changed Notion task pages to Todoist.
+
+    ``notion_pages`` (e.g. from a webhook) replaces the cursor-based query and
+    leaves the cursor untouched. Returns the number of tasks written to Todoist
+    and recorded.
+    """
+    db_manager = services.db_manager
+    notion_client = services.notion_client
+    todoist_client = services.new_todoist_client()
+    command_queue = todoist_client.command_queue("items")
+    identity_map = services.identity_map
+    queued = 0
+    # 回调成功 (已在 Todoist 写入并记录) 的 Notion 页面
+    synced = []
+    # 已排队任务的锁一直持有到该批命令发送并记录完成
+    with db_manager.unit_of_work() as unit_of_work, entity_locks.batch() as held_locks:
+        task_db_last_modified = db_manager.fetch_one("SELECT MAX(date_updated) FROM tasks WHERE deleted IS FALSE")
+        task_db_last_modified = task_db_last_modified[0] if task_db_last_modified else None
+        if task_db_last_modified == None:
+            logger.info("Database not set, start initial syncing")
+            cursor = None
+        else:
+            cursor = db_manager.get_notion_cursor(notion_client.task_database_id)
+        logger.info("Notion task cursor: %s", cursor)
+        seen_max = None
+        failed_times = []
+
+        # 逐页流式处理 Notion 结果，内存占用与数据库大小无关
+        advance_cursor = notion_pages is None
+        if advance_cursor:
+            notion_pages = notion_client.iter_tasks(notion_last_edited_filter(cursor, NOTION_CURSOR_OVERLAP), page_size=NOTION_PAGE_SIZE)
+        for task in notion_pages:
+            if not isinstance(task, dict) or task.get('last_edited_time') is None:
+                logger.error("Expected task to be a dictionary with last_edited_time but got %s: %s", type(task), payload(task))
+                continue
+            logger.debug("Processing task: %s", payload(task))
+            seen_max = next_notion_cursor(seen_max, [task['last_edited_time']], [])
+            on_error = lambda error, edited=task['last_edited_time']: failed_times.append(edited)
+            try:
+                todoist_task_data, due_date_value = build_todoist_task_data(task)
+                logger.debug("Notion due date: %s", due_date_value)
+                logger.debug("Todoist task properties: %s", payload(todoist_task_data))
                 task_name = todoist_task_data["content"]
-                task_created = task.get('created_time')
-                task_modified = task.get('last_edited_time')
-                if not all([task_name, task_created, task_modified]):
-                    logger.error(f"Task data missing required fields: {task}")
+                if not all([task_name, task.get('created_time'), task.get('last_edited_time')]):
+                    logger.error("Task data missing required fields: %s", payload(task))
                     continue
 
-            # Check if the project exists in Todoist
                 notion_task_id = task.get('id')
-                todoist_id = db_manager.fetch_one("SELECT todoist_id FROM tasks WHERE notion_id = ?", (notion_task_id,))
-                todoist_id = todoist_id[0] if todoist_id else None
-                logger.info(f"Todoist task ID found: {todoist_id}")
+                task_row = identity_map.get_task_by_notion_id(notion_task_id) or {}
+                if not held_locks.add(task_lock_keys(task_row.get("todoist_id"), notion_task_id)):
+                    logger.info("Task %s is being written by the other direction, retrying next cycle", notion_task_id)
+                    failed_times.append(task['last_edited_time'])
+                    continue
+                # 拿到锁后重新读取，另一方向可能刚刚写入
+                task_row = identity_map.get_task_by_notion_id(notion_task_id) or {}
+                todoist_id = task_row.get("todoist_id")
+                if todoist_id and not task_row.get("notion_created"):
+                    # 顺便缓存查询结果里的页面时间戳，供 Todoist -> Notion 更新使用
+                    identity_map.put_task(todoist_id, notion_created=task.get('created_time'), notion_modified=task.get('last_edited_time'))
+                logger.info("Todoist task ID found: %s", todoist_id)
 
                 if not todoist_id:
-                    logger.info(f"No matching Todoist task found for notion_id: {notion_task_id}")
-                    temp_id = str(uuid.uuid4())
-                    new_task_in_todoist, new_task_sync_token, item_id, note_id = create_todoist_task_with_note(todoist_client, temp_id, todoist_task_data, task.get('url'))
-                    logger.info(f"is deleted {new_task_in_todoist.get('is_deleted')}")
-                    logger.info(f"Todoist Task created: {new_task_in_todoist}")
-                    todoist_url = f"https://todoist.com/showTask?id={item_id}"
-                    logger.info(f"Todoist task created: {item_id}")
-                    logger.info(f"Todoist note created: {note_id}")
-                    logger.info(f"Updating notion with TodoistID: {item_id}")
-                    proposed_properties = notion_todoist_id_property(item_id)
-                    update_notion_task = notion_client.update_page(notion_task_id, proposed_properties, new_task_in_todoist.get('is_deleted'))
-                    logger.info(f"Updated notion with TodoistID: {item_id}")
-                    current_date = datetime.now(timezone.utc).astimezone(timezone(timedelta(hours=8)))
-                    notion_url = task.get('url')
-
-                    insert_task_query = get_insert_task_query(db_manager.db_type)
-                    project_name = db_manager.fetch_one("SELECT name FROM projects WHERE todoist_id = ?", (new_task_in_todoist.get('project_id'),))[0]
-                #  if not project_name:
-                #       logger.info("Project not found, running project_sync...")
-                #     project_sync()
-                #     project_name = db_manager.fetch_one("SELECT name FROM projects WHERE todoist_id = ?", (new_task_in_todoist.get('project_id'),))
-                    logger.info(f"Fetched project_name: {project_name}")
-                    db_manager.execute_query(insert_task_query, (
-                        item_id, task_name, due_date_value, new_task_in_todoist.get("priority"), 
-                        new_task_in_todoist.get("project_id"), project_name, current_date, note_id, 
-                        todoist_url, new_task_in_todoist['checked'], todoist_task_data['description'], 
-                        todoist_task_data['due']['is_recurring'], current_date, new_task_in_todoist.get('is_deleted'), 
-                        task.get('id'), notion_url, new_task_in_todoist.get('added_at'), new_task_in_todoist.get('updated_at'), task['created_time'], task['last_edited_time']
-                    ))
-                    db_manager.update_sync_token('items', new_task_sync_token)
-                    logger.info(f"Task synced to Todoist and recorded in database: {task_name} (Todoist ID: {item_id}, Notion ID: {task['id']})")
+                    logger.info("No matching Todoist task found for notion_id: %s, queueing creation", notion_task_id)
+                    def on_created(item_id, note_id, task=task, data=todoist_task_data, due=due_date_value):
+                        record_created_todoist_task(unit_of_work, identity_map, notion_client, todoist_client, task, data, due, item_id, note_id)
+                        synced.append(task['id'])
+                    queue_todoist_task_with_note(command_queue, todoist_task_data, task.get('url'), on_created, on_error=on_error)
+                    continue
+
+                # Notion 的修改时间只精确到分钟，同一分钟内的人工修改时间相同，所以还要确认最后修改者是本集成
+                if is_echo(task['last_edited_time'], task_row.get("notion_written_at")) and notion_client.is_own_edit(task):
+                    logger.info("Notion task %s change is our own Notion write, suppressing echo", notion_task_id)
+                    sync_stats.increment("suppressed_echoes.notion_task")
+                    continue
+
+                notion_modified = iso_to_timestamp(str(task.get('last_edited_time')))
+                modified = task_row.get("date_updated")
+                modified = iso_to_timestamp(str(modified)) if modified else 0
+                sync_fields = notion_task_fields(todoist_task_data, task_row.get("project_id"))
+                if notion_modified > modified and payload_hash(sync_fields) == task_row.get("sync_hash"):
+                    # 只有非同步字段变化（例如写回 TodoistID）时不调用 Todoist
+                    logger.info("Notion task %s edited but synced fields unchanged, skipping Todoist update", notion_task_id)
+                    sync_stats.increment("skipped_writes.todoist_task")
+                elif notion_modified > modified:
+                    logger.info("Notion task modified time %s is later than database modified time %s, time difference: %s", datetime.fromtimestamp(notion_modified), datetime.fromtimestamp(modified), abs(notion_modified - modified))
+                    # 只发送与上次同步快照不同的字段
+                    update_args = todoist_update_args(todoist_id, todoist_task_data, changed_fields(task_row.get("sync_snapshot"), sync_fields))
+                    logger.info("Queueing task update in Todoist: %s", payload(update_args))
+                    def on_updated(real_id, task=task, data=todoist_task_data, due=due_date_value):
+                        record_updated_todoist_task(unit_of_work, identity_map, todoist_client, task, data, due, real_id)
+                        synced.append(task['id'])
+                    command_queue.add("item_update", update_args, on_success=on_updated, on_error=on_error)
                 else:
-                    notion_modified = task.get('last_edited_time')
-                    notion_modified = iso_to_timestamp(str(notion_modified))
-                    logger.info(f"notion_modified: {notion_modified}")
-                    modified = db_manager.fetch_one("SELECT date_updated FROM tasks WHERE todoist_id = ?", (todoist_id,))
-                    modified = iso_to_timestamp(modified[0]) if modified else None
-                    if notion_modified and modified:
-                        logger.info(f"Fetched notion update time {datetime.fromtimestamp(notion_modified)}, comparing with database update date: {datetime.fromtimestamp(modified)}")
-                    if notion_modified > modified:
-                        logger.info(f"Notion task modified time {datetime.fromtimestamp(notion_modified)} is later than database modified time {datetime.fromtimestamp(modified)}, time difference: {abs(notion_modified - modified)}")
-                        task_data_update = {
-                                "content": properties.get('Task', {}).get('title', [{}])[0].get('text', {}).get('content', ''),
-                                "due": {
-                                    "datetime": due_date_value,
-                                    "is_recurring": properties.get('Recurring', {}).get('checkbox'),
-                                    "timezone": "Asia/Shanghai"
-                                },
-                                "priority": map_priority_reverse(priority_select.get('name')) if priority_select else None,
-                                "project_id": properties.get('Project ID', {}).get('select', {}).get('id'),
-                                "todoist_id": next((prop['text']['content'] for prop in properties.get('TodoistID', {}).get('rich_text', [])), None),
-                                "description": description,
-                                "checked": properties.get('Status', {}).get('checkbox'),
-                                "is_deleted": task.get('archived'),
-                            }
-                        logger.info(f"Updating task in Todoist: {todoist_task_data}")
-                        new_task_in_todoist = todoist_client.update_task(todoist_id, todoist_task_data)
-                        logger.info(f"Updated task in Todoist: {new_task_in_todoist}")
-                        new_sync_token = new_task_in_todoist.get('sync_token')
-                        logger.info(f"New sync token: {new_sync_token}")
-                        task_data = todoist_client.get_single_task(todoist_id)
-                        logger.info(f"Fetched single task data from Todoist: {task_data}")
-                        notion_url = f"https://www.notion.so/{task['id']}"
-                        todoist_url = f"https://todoist.com/showTask?id={todoist_id}"
-                        project_name = db_manager.fetch_one("SELECT name FROM projects WHERE todoist_id = ?", (todoist_task_data.get("project_id"),))[0]
-                        logger.info(f"Fetched project name: {project_name}")
-                        update_task_query = get_update_task_query(db_manager.db_type)
-                        db_manager.execute_query(update_task_query, (
-                                new_task_in_todoist.get('content'), due_date_value, todoist_task_data.get('priority'),
-                                todoist_task_data.get('project_id'), project_name, None, None, todoist_task_data['checked'], todoist_task_data['description'],
-                                properties.get('Recurring', {}).get('checkbox'), current_date, todoist_task_data.get('is_deleted'),
-                                task['id'], notion_url, None, task_data.get('updated_at'), task['created_time'], task['last_edited_time'], todoist_id
-                            ))
-                        logger.info(f"Task updated in database: {task_name} (Todoist ID: {todoist_id}, Notion ID: {task['id']})")
-                        db_manager.update_sync_token("items", new_sync_token)
-                        logger.info(f"Sync token updated for items: {new_sync_token}")
-                    else:
-                        logger.info(f"No update needed for task: {task_name} (Todoist ID: {todoist_id}, Notion ID: {task['id']})")
-    
-    db_manager.close_connection()
+                    logger.info("No update needed for task: %s (Todoist ID: %s, Notion ID: %s)", task_name, todoist_id, task['id'])
+            except Exception as e:
+                logger.error("Error processing Notion task %s: %s", task.get('id'), e)
+                failed_times.append(task['last_edited_time'])
+                continue
+
+            # 队列满一批就发送，避免在内存中累积整个数据库的变更
+            if len(command_queue) >= MAX_COMMANDS_PER_SYNC:
+                queued += len(command_queue)
+                command_queue.flush()
+                held_locks.release_all()
+
+        queued += len(command_queue)
+        result = command_queue.flush()
+        logger.info("Flushed %s Todoist commands, %s failed, %s tasks synced", queued, len(result['failed']), len(synced))
+        new_cursor = next_notion_cursor(cursor, [seen_max], failed_times)
+        if new_cursor and advance_cursor:
+            unit_of_work.update_notion_cursor(notion_client.task_database_id, new_cursor)
+            logger.info("Notion task cursor advanced to: %s", new_cursor)
+    return len(synced)
+
 
 if __name__ == "__main__":
     logger.info("Starting synchronization from Todoist to Notion...")
@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# 配置在模块导入时读取，必须在导入同步模块之前设置
+os.environ.setdefault("LOG_CONSOLE", "false")
+os.environ.setdefault("LOG_FILE", "")
+
+from services import services  # noqa: E402
+from db_operations import DatabaseManager  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def clean_services():
+    services.reset()
+    yield
+    services.reset()
+
+
+@pytest.fixture
+def db_manager(tmp_path):
+    """A fresh SQLite database with the full schema, installed as services.db_manager."""
+    db_manager = DatabaseManager("sqlite", str(tmp_path / "sync_tasks.db"))
+    services.instances["db_manager"] = db_manager
+    yield db_manager
+    db_manager.close_connection()
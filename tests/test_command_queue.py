@@ -0,0 +1,76 @@
+from api_client import TodoistCommandQueue
+
+
+class StubSyncClient:
+    """Answers sync_commands with a fixed status per command, in the order they were added."""
+
+    def __init__(self, *statuses):
+        self.statuses = list(statuses)
+        self.batches = []
+
+    def sync_commands(self, resource_type, commands):
+        self.batches.append(commands)
+        sync_status = {command["uuid"]: self.statuses.pop(0) for command in commands}
+        temp_id_mapping = {command["temp_id"]: "real-" + command["temp_id"] for command in commands if "temp_id" in command}
+        return {"sync_status": sync_status, "temp_id_mapping": temp_id_mapping}
+
+
+def test_on_success_receives_real_id():
+    queue = TodoistCommandQueue(StubSyncClient("ok", "ok"), "items")
+    resolved = []
+    queue.add("item_add", {"content": "new"}, temp_id="tmp-1", on_success=resolved.append)
+    queue.add("item_update", {"id": "42", "content": "edited"}, on_success=resolved.append)
+    result = queue.flush()
+    assert resolved == ["real-tmp-1", "42"]
+    assert result["failed"] == {}
+
+
+def test_error_status_calls_on_error():
+    error = {"error_code": 22, "error": "Item not found"}
+    queue = TodoistCommandQueue(StubSyncClient(error), "items")
+    successes, errors = [], []
+    command_uuid = queue.add("item_update", {"id": "42"}, on_success=successes.append, on_error=errors.append)
+    result = queue.flush()
+    assert successes == []
+    assert errors == [error]
+    assert result["failed"] == {command_uuid: error}
+
+
+def test_raising_on_success_calls_on_error():
+    queue = TodoistCommandQueue(StubSyncClient("ok", "ok"), "items")
+    errors, successes = [], []
+
+    def record(real_id):
+        raise RuntimeError("database is locked")
+
+    failing_uuid = queue.add("item_add", {"content": "a"}, temp_id="tmp-1", on_success=record, on_error=errors.append)
+    queue.add("item_add", {"content": "b"}, temp_id="tmp-2", on_success=successes.append, on_error=errors.append)
+    result = queue.flush()
+    assert len(errors) == 1 and isinstance(errors[0], RuntimeError)
+    assert list(result["failed"]) == [failing_uuid]
+    # 同批次其他命令的回调照常执行
+    assert successes == ["real-tmp-2"]
+
+
+def test_raising_on_error_does_not_stop_the_batch():
+    queue = TodoistCommandQueue(StubSyncClient({"error": "boom"}, "ok"), "items")
+    successes = []
+
+    def explode(error):
+        raise RuntimeError("callback failed")
+
+    queue.add("item_update", {"id": "1"}, on_error=explode)
+    queue.add("item_update", {"id": "2"}, on_success=successes.append)
+    queue.flush()
+    assert successes == ["2"]
+
+
+def test_flush_sends_batches_and_resolves_earlier_temp_ids():
+    client = StubSyncClient("ok", "ok", "ok")
+    queue = TodoistCommandQueue(client, "items", batch_size=2)
+    queue.add("item_add", {"content": "parent"}, temp_id="tmp-parent")
+    queue.add("item_add", {"content": "other"}, temp_id="tmp-other")
+    queue.add("note_add", {"item_id": "tmp-parent", "content": "note"}, temp_id="tmp-note")
+    queue.flush()
+    assert [len(batch) for batch in client.batches] == [2, 1]
+    assert client.batches[1][0]["args"]["item_id"] == "real-tmp-parent"
@@ -0,0 +1,68 @@
+import pytest
+
+import kimai_sync
+from api_client import KimaiClient
+from fake_servers import FakeKimaiServer
+from services import services
+
+NOTION_ID = "0f1e2d3c-4b5a-6978-8796-a5b4c3d2e1f0"
+
+
+@pytest.fixture
+def kimai(monkeypatch):
+    server = FakeKimaiServer(utc_offset_hours=kimai_sync.KIMAI_UTC_OFFSET_HOURS).start()
+    services.instances["kimai_client"] = KimaiClient("fake-kimai-token", base_url=f"{server.url}/api")
+    yield server
+    server.stop()
+
+
+def insert_task(db_manager, todoist_id, content, notion_id=None):
+    db_manager.execute_query("INSERT INTO tasks (todoist_id, content, deleted, notion_id) VALUES (?, ?, ?, ?)", (todoist_id, content, False, notion_id))
+
+
+def linked_tasks(db_manager):
+    return dict(db_manager.fetch_all("SELECT kimai_id, todoist_id FROM timesheets ORDER BY kimai_id"))
+
+
+def test_timesheets_are_linked_by_meta_field_urls_and_title(db_manager, kimai):
+    insert_task(db_manager, 111, "Write report", NOTION_ID)
+    kimai.seed_timesheet("anything", meta_fields=[{"name": kimai_sync.KIMAI_TASK_META_FIELD, "value": "111"}])
+    kimai.seed_timesheet("see https://todoist.com/showTask?id=111")
+    kimai.seed_timesheet("see https://app.todoist.com/app/task/write-report-111")
+    kimai.seed_timesheet("page https://www.notion.so/Write-report-" + NOTION_ID.replace("-", ""))
+    kimai.seed_timesheet("Write report\nfirst draft")
+    kimai.seed_timesheet("meeting")
+    assert kimai_sync.sync_kimai_timesheets() == 6
+    assert linked_tasks(db_manager) == {1: "111", 2: "111", 3: "111", 4: "111", 5: "111", 6: None}
+
+
+def test_explicit_reference_wins_over_title(db_manager, kimai):
+    insert_task(db_manager, 111, "Write report")
+    insert_task(db_manager, 222, "Review")
+    kimai.seed_timesheet("Write report https://todoist.com/showTask?id=222")
+    kimai_sync.sync_kimai_timesheets()
+    assert linked_tasks(db_manager) == {1: "222"}
+
+
+def test_unlinked_timesheets_are_relinked_once_the_task_is_synced(db_manager, kimai):
+    kimai.seed_timesheet("Later task")
+    kimai.seed_timesheet("https://todoist.com/showTask?id=333")
+    kimai_sync.sync_kimai_timesheets()
+    assert linked_tasks(db_manager) == {1: None, 2: None}
+    insert_task(db_manager, 222, "Later task")
+    insert_task(db_manager, 333, "Referenced task")
+    kimai_sync.sync_kimai_timesheets()
+    assert linked_tasks(db_manager) == {1: "222", 2: "333"}
+
+
+def test_cursor_only_pulls_modified_timesheets(db_manager, kimai, monkeypatch):
+    monkeypatch.setattr(kimai_sync, "KIMAI_CURSOR_OVERLAP", 0)
+    kimai.seed_timesheet("first")
+    assert kimai_sync.sync_kimai_timesheets() == 1
+    assert db_manager.get_sync_token(kimai_sync.KIMAI_CURSOR_KEY)
+    # 游标是闭区间，把修改时间移到游标之前
+    kimai.modified[1] = "2000-01-01T00:00:00"
+    assert kimai_sync.sync_kimai_timesheets() == 0
+    kimai.edit_timesheet(1, duration=60)
+    assert kimai_sync.sync_kimai_timesheets() == 1
+    assert db_manager.fetch_one("SELECT duration FROM timesheets WHERE kimai_id = 1")[0] == 60
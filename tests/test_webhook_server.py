@@ -0,0 +1,180 @@
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import project_sync
+import task_sync
+import webhook_server
+from http_session import get_session
+from services import services
+from webhook_server import (
+    NOTION_PATH, TODOIST_PATH, SeenEvents, WebhookDispatcher, WebhookEvent, WebhookHandler,
+    notion_signature, send_fake_notion_event, send_fake_todoist_event, todoist_signature,
+)
+
+TODOIST_SECRET = "todoist-secret"
+NOTION_SECRET = "notion-secret"
+TASK_DATABASE_ID = "11111111-2222-3333-4444-555555555555"
+PROJECT_DATABASE_ID = "66666666-7777-8888-9999-000000000000"
+
+
+class CollectingDispatcher:
+    def __init__(self):
+        self.events = []
+
+    def submit(self, event):
+        self.events.append(event)
+
+
+@pytest.fixture
+def receiver(monkeypatch):
+    """A receiver on a free local port whose dispatcher only collects the accepted events."""
+    monkeypatch.setattr(webhook_server, "TODOIST_CLIENT_SECRET", TODOIST_SECRET)
+    monkeypatch.setattr(webhook_server, "NOTION_WEBHOOK_SECRET", NOTION_SECRET)
+    dispatcher = CollectingDispatcher()
+    handler = type("TestWebhookHandler", (WebhookHandler,), {"dispatcher": dispatcher, "seen_events": SeenEvents()})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    server.dispatcher = dispatcher
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def post(url, body, headers):
+    return get_session().post(url, data=body, headers=headers, timeout=5)
+
+
+def test_todoist_event_with_valid_signature_is_accepted(receiver):
+    response = send_fake_todoist_event(receiver.url, "item:updated", {"id": "42", "content": "x"}, secret=TODOIST_SECRET)
+    assert response.status_code == 200
+    assert [(event.source, event.kind, event.entity_id) for event in receiver.dispatcher.events] == [("todoist", "item", "42")]
+
+
+@pytest.mark.parametrize("secret", [None, "wrong-secret"])
+def test_todoist_event_without_valid_signature_is_rejected(receiver, secret):
+    response = send_fake_todoist_event(receiver.url, "item:updated", {"id": "42"}, secret=secret)
+    assert response.status_code == 401
+    assert receiver.dispatcher.events == []
+
+
+def test_todoist_duplicate_delivery_is_dropped(receiver):
+    for _ in range(2):
+        response = send_fake_todoist_event(receiver.url, "item:updated", {"id": "42"}, secret=TODOIST_SECRET, delivery_id="delivery-1")
+        assert response.status_code == 200
+    assert response.text == "duplicate"
+    assert len(receiver.dispatcher.events) == 1
+
+
+def test_todoist_signed_malformed_body_is_rejected(receiver):
+    for body in (b"{not json", b"[1, 2]"):
+        response = post(receiver.url + TODOIST_PATH, body, {"X-Todoist-Hmac-SHA256": todoist_signature(TODOIST_SECRET, body)})
+        assert response.status_code == 400
+    assert receiver.dispatcher.events == []
+
+
+def test_todoist_rejected_without_configured_secret(receiver, monkeypatch):
+    monkeypatch.setattr(webhook_server, "TODOIST_CLIENT_SECRET", None)
+    response = send_fake_todoist_event(receiver.url, "item:updated", {"id": "42"}, secret=TODOIST_SECRET)
+    assert response.status_code == 401
+
+
+def test_notion_event_with_valid_signature_is_accepted(receiver):
+    response = send_fake_notion_event(receiver.url, "page-1", secret=NOTION_SECRET)
+    assert response.status_code == 200
+    assert [(event.source, event.entity_id) for event in receiver.dispatcher.events] == [("notion", "page-1")]
+
+
+@pytest.mark.parametrize("secret", [None, "wrong-secret"])
+def test_notion_event_without_valid_signature_is_rejected(receiver, secret):
+    response = send_fake_notion_event(receiver.url, "page-1", secret=secret)
+    assert response.status_code == 401
+    assert receiver.dispatcher.events == []
+
+
+def test_notion_signed_malformed_body_is_rejected(receiver):
+    body = b"{not json"
+    response = post(receiver.url + NOTION_PATH, body, {"X-Notion-Signature": notion_signature(NOTION_SECRET, body)})
+    assert response.status_code == 400
+
+
+def test_notion_verification_request_without_secret(receiver, monkeypatch):
+    monkeypatch.setattr(webhook_server, "NOTION_WEBHOOK_SECRET", None)
+    monkeypatch.setattr(WebhookHandler, "verification_logged_at", None)
+    logged = []
+    monkeypatch.setattr(webhook_server.logger, "warning", lambda message, *args: logged.append(message % args))
+    token = "secret_" + "x" * 200
+    for _ in range(2):
+        response = post(receiver.url + NOTION_PATH, ('{"verification_token": "%s"}' % token).encode(), {})
+        assert response.status_code == 200
+    # 只记录一次，且截断
+    token_logs = [message for message in logged if "verification_token" in message]
+    assert len(token_logs) == 1
+    assert token[:webhook_server.VERIFICATION_TOKEN_MAX_LENGTH] in token_logs[0]
+    assert token not in token_logs[0]
+    # 其他未签名的事件仍然拒绝
+    assert send_fake_notion_event(receiver.url, "page-1", secret=None).status_code == 401
+    assert post(receiver.url + NOTION_PATH, b"{not json", {}).status_code == 401
+    assert receiver.dispatcher.events == []
+
+
+class StubNotionClient:
+    task_database_id = TASK_DATABASE_ID
+    project_database_id = PROJECT_DATABASE_ID
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.fetched = []
+
+    def get_page(self, page_id):
+        self.fetched.append(page_id)
+        return self.pages[page_id]
+
+
+def notion_page(page_id, database_id):
+    # Notion 返回的 parent.database_id 可能带或不带连字符
+    return {"object": "page", "id": page_id, "parent": {"type": "database_id", "database_id": database_id}}
+
+
+@pytest.fixture
+def sync_calls(monkeypatch):
+    calls = {"tasks": [], "projects": 0}
+
+    def sync_notion_to_todoist(notion_pages=None):
+        calls["tasks"].append([page["id"] for page in notion_pages])
+
+    def sync_notion_projects_to_todoist():
+        calls["projects"] += 1
+
+    monkeypatch.setattr(task_sync, "sync_notion_to_todoist", sync_notion_to_todoist)
+    monkeypatch.setattr(project_sync, "sync_notion_projects_to_todoist", sync_notion_projects_to_todoist)
+    return calls
+
+
+def test_dispatch_only_syncs_pages_from_the_sync_databases(sync_calls):
+    notion_client = StubNotionClient({
+        "fetched-task": notion_page("fetched-task", TASK_DATABASE_ID.replace("-", "")),
+        "other": notion_page("other", "deadbeefdeadbeefdeadbeefdeadbeef"),
+    })
+    services.instances["notion_client"] = notion_client
+    WebhookDispatcher().dispatch([
+        WebhookEvent("notion", "page", "task", notion_page("task", TASK_DATABASE_ID)),
+        WebhookEvent("notion", "page", "fetched-task"),
+        WebhookEvent("notion", "page", "other"),
+        WebhookEvent("notion", "page", "workspace-page", {"object": "page", "id": "workspace-page", "parent": {"type": "workspace", "workspace": True}}),
+    ])
+    assert notion_client.fetched == ["fetched-task", "other"]
+    assert sync_calls["tasks"] == [["task", "fetched-task"]]
+    assert sync_calls["projects"] == 0
+
+
+def test_dispatch_syncs_projects_once_for_project_pages(sync_calls):
+    services.instances["notion_client"] = StubNotionClient({})
+    WebhookDispatcher().dispatch([
+        WebhookEvent("notion", "page", "project-1", notion_page("project-1", PROJECT_DATABASE_ID)),
+        WebhookEvent("notion", "page", "project-2", notion_page("project-2", PROJECT_DATABASE_ID.replace("-", ""))),
+    ])
+    assert sync_calls["projects"] == 1
+    assert sync_calls["tasks"] == []
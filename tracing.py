@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import pstats
+import cProfile
+import functools
+import threading
+from logger import logger
+
+# TRACE_ENABLED 在启动时录制 TRACE_CYCLES 个同步周期；运行中可发送 SIGUSR1 再录制一次
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "false").lower() == "true"
+TRACE_CYCLES = int(os.getenv("TRACE_CYCLES", "1"))
+TRACE_DIR = os.getenv("TRACE_DIR", "traces")
+# chrome: chrome://tracing / Perfetto 可打开的 JSON; cprofile: pstats 文件; both: 两者都写
+TRACE_FORMAT = os.getenv("TRACE_FORMAT", "chrome")
+
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    __slots__ = ("tracer", "name", "args", "started")
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.started = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        ended = time.perf_counter_ns()
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer.record(self.name, self.started, ended, self.args)
+        return False
+
+
+class Tracer:
+    """Records nested spans for a number of armed sync cycles and dumps them when the last one ends.
+
+    Outside an armed cycle ``span()`` returns a shared no-op context, so the
+    instrumentation costs one attribute check per call. cProfile only sees the
+    thread that runs the scheduler tick; pipelined and async worker threads
+    show up in the Chrome trace only.
+    """
+
+    def __init__(self, trace_dir=TRACE_DIR, trace_format=TRACE_FORMAT):
+        self.trace_dir = trace_dir
+        self.trace_format = trace_format
+        self.lock = threading.Lock()
+        self.active = False
+        self.remaining = 0
+        self.events = []
+        self.profiler = None
+        self.started_at = None
+
+    def arm(self, cycles=TRACE_CYCLES):
+        with self.lock:
+            self.remaining = max(cycles, 1)
+        logger.info("Tracing armed for the next %s sync cycles", self.remaining)
+
+    def begin_cycle(self):
+        if not self.remaining or self.active:
+            return
+        self.events = []
+        self.started_at = time.strftime("%Y%m%d-%H%M%S")
+        if self.trace_format in ("cprofile", "both"):
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.active = True
+
+    def end_cycle(self):
+        if not self.active:
+            return
+        with self.lock:
+            self.remaining -= 1
+            if self.remaining > 0:
+                return
+            self.active = False
+        if self.profiler is not None:
+            self.profiler.disable()
+        try:
+            self.dump()
+        except OSError as e:
+            logger.error("写入 trace 文件失败: %s", e)
+        self.events = []
+        self.profiler = None
+
+    def record(self, name, started_ns, ended_ns, args):
+        event = {
+            "name": name, "ph": "X", "pid": os.getpid(), "tid": threading.get_ident(),
+            "ts": started_ns / 1000, "dur": (ended_ns - started_ns) / 1000,
+        }
+        if args:
+            event["args"] = {key: str(value) for key, value in args.items()}
+        # list.append 在 CPython 中是原子的，多线程记录不需要加锁
+        self.events.append(event)
+
+    def span(self, name, **args):
+        if not self.active:
+            return NULL_SPAN
+        return Span(self, name, args)
+
+    def dump(self):
+        os.makedirs(self.trace_dir, exist_ok=True)
+        base = os.path.join(self.trace_dir, f"sync-{self.started_at}")
+        if self.trace_format in ("chrome", "both"):
+            with open(f"{base}.trace.json", "w") as f:
+                json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+            logger.info("Chrome trace with %s spans written to %s.trace.json", len(self.events), base)
+        if self.profiler is not None:
+            self.profiler.dump_stats(f"{base}.prof")
+            logger.info("cProfile stats written to %s.prof (python -m pstats %s.prof)", base, base)
+            top = sorted(pstats.Stats(self.profiler).stats.items(), key=lambda item: item[1][3], reverse=True)[:10]
+            for (filename, line, function), (_, calls, _, cumulative, _) in top:
+                logger.info("  %8.3fs %8d calls  %s (%s:%s)", cumulative, calls, function, os.path.basename(filename), line)
+
+
+tracer = Tracer()
+
+
+def span(name, **args):
+    return tracer.span(name, **args)
+
+
+def traced(name=None):
+    """Decorator wrapping every call of the function in a span."""
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.active:
+                return func(*args, **kwargs)
+            with Span(tracer, span_name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def install_signal_handler(cycles=TRACE_CYCLES):
+    """Arm tracing on SIGUSR1 (main thread only, not available on Windows)."""
+    import signal
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: tracer.arm(cycles))
@@ -1,7 +1,9 @@
-import logger
-from datetime import datetime
+from logger import logger
+from datetime import timedelta
 import time
 import uuid
+import json
+import hashlib
 from dateutil.parser import isoparse
 def map_priority(priority):
     priority_map = {
@@ -28,11 +30,11 @@ def retry_on_failure(func):
             try:
                 return func(*args, **kwargs)
             except Exception as e:
-                logger.error(f"Error in {func.__name__}: {e}")
+                logger.error("Error in %s: %s", func.__name__, e)
                 if attempt < max_retries - 1:
                     time.sleep(2 ** attempt)  # Exponential backoff
                 else:
-                    logger.error(f"Failed after {max_retries} attempts")
+                    logger.error("Failed after %s attempts", max_retries)
                     raise
     return wrapper
 
@@ -99,6 +101,12 @@ def notion_checked_property(checked):
             "checkbox": checked
         }
     }
+def notion_recurring_property(recurring):
+    return {
+        "Recurring": {
+            "checkbox": recurring
+        }
+    }
 def notion_description_property(description):
     return {
         "Description": {
@@ -161,3 +169,77 @@ def iso_to_naive(iso_str):
     dt = isoparse(iso_str)
     # 将 datetime 对象转换为不带时区信息的字符串
     return dt.strftime('%Y-%m-%dT%H:%M:%S')
+
+
+def notion_last_edited_filter(cursor, overlap_seconds):
+    # Notion 的 last_edited_time 只精确到分钟，向前回退一段时间避免漏掉边界上的修改
+    if not cursor:
+        return None
+    start = isoparse(cursor) - timedelta(seconds=overlap_seconds)
+    return {
+        "timestamp": "last_edited_time",
+        "last_edited_time": {
+            "on_or_after": start.isoformat()
+        }
+    }
+
+def next_notion_cursor(cursor, seen_times, failed_times):
+    # 新游标取本轮见到的最大 last_edited_time；有失败的页面时不越过最早的失败，下轮会重新拉取
+    candidates = [t for t in seen_times if t]
+    if cursor:
+        candidates.append(cursor)
+    if not candidates:
+        return cursor
+    new_cursor = max(candidates, key=iso_to_timestamp)
+    failed = [t for t in failed_times if t]
+    if failed:
+        earliest_failed = min(failed, key=iso_to_timestamp)
+        if iso_to_timestamp(earliest_failed) < iso_to_timestamp(new_cursor):
+            new_cursor = earliest_failed
+    return new_cursor
+
+
+def canonical_task_fields(content, description, due, priority, checked, deleted, project_id, recurring):
+    # 两个方向都归一到同一组字段，Todoist 任务和 Notion 页面内容一致时哈希相同
+    return {
+        "content": (content or "").strip(),
+        "description": (description or "").strip(),
+        "due": iso_to_naive(due) if due else None,
+        "priority": int(priority) if priority else 1,
+        "checked": bool(checked),
+        "deleted": bool(deleted),
+        "project_id": str(project_id) if project_id else None,
+        "recurring": bool(recurring),
+    }
+
+def canonical_project_fields(name, archived, deleted):
+    return {
+        "name": (name or "").strip(),
+        "archived": bool(archived),
+        "deleted": bool(deleted),
+    }
+
+def payload_hash(fields):
+    payload = json.dumps(fields, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def dump_snapshot(fields):
+    return json.dumps(fields, sort_keys=True, ensure_ascii=False, default=str)
+
+def changed_fields(snapshot, fields):
+    """Keys of ``fields`` that differ from the stored JSON ``snapshot``; None when there is no snapshot yet."""
+    if not snapshot:
+        return None
+    try:
+        previous = json.loads(snapshot)
+    except ValueError:
+        return None
+    # 与快照比较前先经过一次 JSON 往返，保证类型一致
+    current = json.loads(dump_snapshot(fields))
+    return {key for key, value in current.items() if previous.get(key) != value}
+
+def is_echo(remote_time, written_at):
+    """True when a remote change is exactly the revision our own last write produced."""
+    if not remote_time or not written_at:
+        return False
+    return iso_to_timestamp(str(remote_time)) == iso_to_timestamp(str(written_at))
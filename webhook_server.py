@@ -0,0 +1,317 @@
+import os
+import sys
+import json
+import hmac
+import time
+import uuid
+import base64
+import hashlib
+import queue
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logger import logger
+from http_session import get_session, get_timeout
+
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# Todoist 应用的 client secret，用于校验 X-Todoist-Hmac-SHA256
+TODOIST_CLIENT_SECRET = os.getenv("TODOIST_CLIENT_SECRET")
+# Notion webhook 订阅的 verification_token，用于校验 X-Notion-Signature
+NOTION_WEBHOOK_SECRET = os.getenv("NOTION_WEBHOOK_SECRET")
+# 收到事件后等待一小段时间，把同一批事件合并成一次同步
+WEBHOOK_DEBOUNCE = float(os.getenv("WEBHOOK_DEBOUNCE", "2"))
+WEBHOOK_DEDUPE_SIZE = int(os.getenv("WEBHOOK_DEDUPE_SIZE", "10000"))
+# 未配置 NOTION_WEBHOOK_SECRET 时记录 Notion 校验 token，限制频率和长度，防止任意请求刷日志
+VERIFICATION_LOG_INTERVAL = float(os.getenv("WEBHOOK_VERIFICATION_LOG_INTERVAL", "60"))
+VERIFICATION_TOKEN_MAX_LENGTH = 64
+
+TODOIST_PATH = "/webhooks/todoist"
+NOTION_PATH = "/webhooks/notion"
+
+
+def todoist_signature(secret, body):
+    return base64.b64encode(hmac.new(secret.encode(), body, hashlib.sha256).digest()).decode()
+
+
+def notion_signature(secret, body):
+    return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def verify_signature(expected, received):
+    return bool(received) and hmac.compare_digest(expected, received)
+
+
+def normalize_database_id(database_id):
+    return (database_id or "").replace("-", "")
+
+
+def parse_body(body):
+    """The JSON object in a webhook body, or None if it is not one."""
+    try:
+        payload = json.loads(body or b"{}")
+    except ValueError:
+        return None
+    return payload if isinstance(payload, dict) else None
+
+
+class SeenEvents:
+    """Bounded set of delivery ids used to drop webhook retries and duplicates."""
+
+    def __init__(self, max_size=WEBHOOK_DEDUPE_SIZE):
+        self.max_size = max_size
+        self.ids = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add(self, event_id):
+        """Record ``event_id``; return False if it was already seen."""
+        with self.lock:
+            if event_id in self.ids:
+                return False
+            self.ids[event_id] = True
+            while len(self.ids) > self.max_size:
+                self.ids.popitem(last=False)
+            return True
+
+
+class WebhookEvent:
+    def __init__(self, source, kind, entity_id, data=None):
+        self.source = source
+        self.kind = kind
+        self.entity_id = entity_id
+        self.data = data
+
+
+def parse_todoist_event(payload):
+    # event_name 形如 item:added / item:updated / item:completed / project:added
+    event_name = payload.get("event_name", "")
+    kind = event_name.split(":", 1)[0]
+    data = payload.get("event_data") or {}
+    if kind not in ("item", "project"):
+        return None
+    return WebhookEvent("todoist", kind, data.get("id"), data)
+
+
+def parse_notion_event(payload):
+    # Notion webhook 订阅: {"type": "page.properties_updated", "entity": {"id": ..., "type": "page"}}
+    entity = payload.get("entity")
+    if entity and entity.get("type") == "page":
+        return WebhookEvent("notion", "page", entity.get("id"))
+    # Notion 自动化的 "Send webhook" 动作: {"source": {...}, "data": {页面对象}}
+    data = payload.get("data")
+    if isinstance(data, dict) and data.get("object") == "page":
+        return WebhookEvent("notion", "page", data.get("id"), data)
+    return None
+
+
+class WebhookDispatcher:
+    """Collects verified events and feeds only the affected entities into the sync pipeline.
+
+    Events are debounced for WEBHOOK_DEBOUNCE seconds and grouped per entity, so a
+    burst of updates to the same item becomes a single write. ``lock`` is held while
+    the sync functions run, so pushes never overlap a polling cycle.
+    """
+
+    def __init__(self, lock=None):
+        self.events = queue.Queue()
+        self.lock = lock or threading.Lock()
+        self.thread = None
+
+    def submit(self, event):
+        self.events.put(event)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def run(self):
+        while True:
+            batch = [self.events.get()]
+            deadline = time.monotonic() + WEBHOOK_DEBOUNCE
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.events.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self.dispatch(batch)
+            except Exception as e:
+                logger.error("Webhook dispatch failed: %s", e)
+
+    def dispatch(self, batch):
+        # 延迟导入: 只有真正处理事件时才需要加载同步模块
+        from task_sync import sync_todoist_to_notion, sync_notion_to_todoist
+        from project_sync import sync_todoist_projects_to_notion, sync_notion_projects_to_todoist
+        from services import services
+
+        items, projects, pages = OrderedDict(), OrderedDict(), OrderedDict()
+        for event in batch:
+            if event.source == "todoist" and event.kind == "item":
+                items[event.entity_id] = event.data
+            elif event.source == "todoist" and event.kind == "project":
+                projects[event.entity_id] = event.data
+            elif event.source == "notion":
+                pages[event.entity_id] = event.data
+
+        with self.lock:
+            if projects:
+                logger.info("Webhook: syncing %s Todoist projects to Notion", len(projects))
+                sync_todoist_projects_to_notion(todoist_projects=list(projects.values()))
+            if items:
+                logger.info("Webhook: syncing %s Todoist items to Notion", len(items))
+                sync_todoist_to_notion(todoist_items=list(items.values()))
+            if pages:
+                notion_client = services.notion_client
+                task_database_id = normalize_database_id(notion_client.task_database_id)
+                project_database_id = normalize_database_id(notion_client.project_database_id)
+                task_pages, project_changed = [], False
+                for page_id, page in pages.items():
+                    page = page or notion_client.get_page(page_id)
+                    parent_id = normalize_database_id((page.get("parent") or {}).get("database_id"))
+                    if parent_id and parent_id == project_database_id:
+                        project_changed = True
+                    elif parent_id and parent_id == task_database_id:
+                        task_pages.append(page)
+                    else:
+                        # 集成能访问的其他数据库/页面，不属于同步范围
+                        logger.info("Webhook: ignoring Notion page %s outside the task and project databases", page_id)
+                if project_changed:
+                    logger.info("Webhook: syncing Notion projects to Todoist")
+                    sync_notion_projects_to_todoist()
+                if task_pages:
+                    logger.info("Webhook: syncing %s Notion pages to Todoist", len(task_pages))
+                    sync_notion_to_todoist(notion_pages=task_pages)
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    dispatcher = None
+    seen_events = None
+    verification_logged_at = None
+    verification_lock = threading.Lock()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path == TODOIST_PATH:
+            self.handle_todoist(body)
+        elif self.path == NOTION_PATH:
+            self.handle_notion(body)
+        else:
+            self.respond(404)
+
+    def respond(self, status, message=""):
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain")
+        self.end_headers()
+        self.wfile.write(message.encode())
+
+    def handle_todoist(self, body):
+        if not TODOIST_CLIENT_SECRET:
+            # 未配置密钥时无法校验来源，一律拒绝
+            logger.warning("Rejected Todoist webhook: TODOIST_CLIENT_SECRET is not configured")
+            return self.respond(401, "webhook secret not configured")
+        if not verify_signature(todoist_signature(TODOIST_CLIENT_SECRET, body), self.headers.get("X-Todoist-Hmac-SHA256")):
+            logger.warning("Rejected Todoist webhook with invalid signature")
+            return self.respond(401, "invalid signature")
+        payload = parse_body(body)
+        if payload is None:
+            logger.warning("Rejected Todoist webhook with a malformed body")
+            return self.respond(400, "malformed body")
+        delivery_id = self.headers.get("X-Todoist-Delivery-ID") or f"{payload.get('event_name')}:{(payload.get('event_data') or {}).get('id')}:{(payload.get('event_data') or {}).get('updated_at')}"
+        self.accept(delivery_id, parse_todoist_event(payload))
+
+    def handle_notion(self, body):
+        if not NOTION_WEBHOOK_SECRET:
+            payload = parse_body(body)
+            if payload is not None and "verification_token" in payload:
+                # 创建订阅时 Notion 发送的一次性校验请求，需要把 token 配置到 NOTION_WEBHOOK_SECRET
+                self.log_verification_token(payload["verification_token"])
+                return self.respond(200)
+            logger.warning("Rejected Notion webhook: NOTION_WEBHOOK_SECRET is not configured")
+            return self.respond(401, "webhook secret not configured")
+        if not verify_signature(notion_signature(NOTION_WEBHOOK_SECRET, body), self.headers.get("X-Notion-Signature")):
+            logger.warning("Rejected Notion webhook with invalid signature")
+            return self.respond(401, "invalid signature")
+        payload = parse_body(body)
+        if payload is None:
+            logger.warning("Rejected Notion webhook with a malformed body")
+            return self.respond(400, "malformed body")
+        event = parse_notion_event(payload)
+        delivery_id = payload.get("id") or f"{event.entity_id if event else None}:{payload.get('timestamp') or (payload.get('data') or {}).get('last_edited_time')}"
+        self.accept(delivery_id, event)
+
+    def log_verification_token(self, token):
+        # 请求未经校验，任何人都能发送: 只按间隔记录，并截断过长的值
+        with self.verification_lock:
+            now = time.monotonic()
+            last = WebhookHandler.verification_logged_at
+            if last is not None and now - last < VERIFICATION_LOG_INTERVAL:
+                return
+            WebhookHandler.verification_logged_at = now
+        logger.warning("Received Notion webhook verification_token (set it as NOTION_WEBHOOK_SECRET): %s", str(token)[:VERIFICATION_TOKEN_MAX_LENGTH])
+
+    def accept(self, delivery_id, event):
+        if event is None or not event.entity_id:
+            return self.respond(200, "ignored")
+        if not self.seen_events.add(delivery_id):
+            logger.debug("Dropping duplicate webhook delivery %s", delivery_id)
+            return self.respond(200, "duplicate")
+        self.dispatcher.submit(event)
+        self.respond(200, "ok")
+
+    def log_message(self, format, *args):
+        logger.debug("Webhook request: " + format, *args)
+
+
+def start_webhook_server(lock=None, host=WEBHOOK_HOST, port=WEBHOOK_PORT):
+    """Start the receiver and its dispatcher in daemon threads and return the server.
+
+    Deliveries are only accepted from sources whose secret is configured; with
+    neither secret set the receiver refuses to start.
+    """
+    if not TODOIST_CLIENT_SECRET and not NOTION_WEBHOOK_SECRET:
+        raise RuntimeError("WEBHOOK_ENABLED requires TODOIST_CLIENT_SECRET and/or NOTION_WEBHOOK_SECRET")
+    if not TODOIST_CLIENT_SECRET:
+        logger.warning("TODOIST_CLIENT_SECRET is not set, Todoist webhooks will be rejected")
+    if not NOTION_WEBHOOK_SECRET:
+        logger.warning("NOTION_WEBHOOK_SECRET is not set, Notion webhooks will be rejected (the verification request is still logged)")
+    handler = type("BoundWebhookHandler", (WebhookHandler,), {
+        "dispatcher": WebhookDispatcher(lock).start(),
+        "seen_events": SeenEvents(),
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info("Webhook receiver listening on %s:%s", host, server.server_port)
+    return server
+
+
+def send_fake_todoist_event(url, event_name, event_data, secret=TODOIST_CLIENT_SECRET, delivery_id=None):
+    """Post a signed Todoist-style webhook to a local receiver, for manual testing."""
+    body = json.dumps({"event_name": event_name, "event_data": event_data, "user_id": "fake"}).encode()
+    headers = {"Content-Type": "application/json", "X-Todoist-Delivery-ID": delivery_id or str(uuid.uuid4())}
+    if secret:
+        headers["X-Todoist-Hmac-SHA256"] = todoist_signature(secret, body)
+    return get_session().post(url.rstrip("/") + TODOIST_PATH, data=body, headers=headers, timeout=get_timeout())
+
+
+def send_fake_notion_event(url, page_id, event_type="page.properties_updated", secret=NOTION_WEBHOOK_SECRET, event_id=None):
+    """Post a signed Notion-style webhook to a local receiver, for manual testing."""
+    body = json.dumps({"id": event_id or str(uuid.uuid4()), "type": event_type, "entity": {"id": page_id, "type": "page"}}).encode()
+    headers = {"Content-Type": "application/json"}
+    if secret:
+        headers["X-Notion-Signature"] = notion_signature(secret, body)
+    return get_session().post(url.rstrip("/") + NOTION_PATH, data=body, headers=headers, timeout=get_timeout())
+
+
+if __name__ == "__main__":
+    # python webhook_server.py todoist http://localhost:8080 item:updated '{"id": "123", ...}'
+    # python webhook_server.py notion http://localhost:8080 <page_id>
+    if len(sys.argv) >= 5 and sys.argv[1] == "todoist":
+        print(send_fake_todoist_event(sys.argv[2], sys.argv[3], json.loads(sys.argv[4])).text)
+    elif len(sys.argv) >= 4 and sys.argv[1] == "notion":
+        print(send_fake_notion_event(sys.argv[2], sys.argv[3]).text)
+    else:
+        print("usage: webhook_server.py todoist <url> <event_name> <event_data_json> | notion <url> <page_id>")